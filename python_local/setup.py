@@ -13,7 +13,8 @@ setup(
         'console_scripts': [
             'write_db_tables  = write_db.cli:main',
             'compare_versions = compare_versions.compare_versions:main',
-            'flag_ss_proc_codes = run_prep.flag_ss_proc_codes:main'
+            'flag_ss_proc_codes = run_prep.flag_ss_proc_codes:main',
+            'write_db_benchmark = benchmark.run_benchmark:main'
         ],
     },
 )
\ No newline at end of file
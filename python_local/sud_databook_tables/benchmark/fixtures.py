@@ -0,0 +1,259 @@
+"""
+synthetic fixtures to run write_db end to end without the restricted inputs: a state-level dataset for every SAS dataset read by the tables
+in config.yaml (SUD and _op versions, for the given year and prior year), written as parquet (read in place of the SAS datasets, see source_path),
+and table shells with one sheet per sheet number in config
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+import openpyxl as xl
+
+from common.utils.params import FIPS_NAME_MAP, TOTALS_DS, SHELL, SHELL_OUD, SHELL_PYEAR
+
+# count cols of each dataset with one rec per state (col names as in the EBI outputs read by the tables in config.yaml)
+# datasets not listed have one rec per state and combination of key values (taken from config, see dataset_keys) with a single count col
+
+STATE_COUNTS = {
+    'state_sud_methods' : ['pop_tot', 'pop_sud_tot', 'pop_sud_alchl_tot', 'pop_sud_cnnbs_tot', 'pop_sud_opioids_tot', 'pop_sud_plysbstnce_tot',
+                           'pop_sud_stmlnts_tot', 'pop_sud_tbcco_tot', 'pop_sud_other_tot'],
+    'state_sud_set_srvc' : ['trt_srvc_case_mgmt', 'trt_srvc_comm_sprt', 'trt_srvc_cnsltn', 'trt_srvc_cnsling', 'trt_srvc_detox', 'trt_srvc_emer_srvcs',
+                            'trt_srvc_inpat', 'trt_srvc_intrvn', 'trt_srvc_mat', 'trt_srvc_med_mgmt', 'trt_srvc_obs_care', 'trt_srvc_other',
+                            'trt_srvc_part_hosp', 'trt_srvc_peer_sprt', 'trt_srvc_phys_srvcs', 'trt_srvc_rx', 'trt_srvc_scn_assmt', 'trt_srvc_treat',
+                            'inpatient', 'outpatient', 'residential', 'home', 'community', 'unknown'],
+    'stdy_inpat' : ['tot_count_inpat'],
+    'stdy_mat' : ['tot_count_mat'],
+    'stdy_obs_care' : ['tot_count_obs_care'],
+    'stdy_part_hosp' : ['tot_count_part_hosp'],
+    'stdy_treat' : ['tot_count_treat'],
+    'state_sud_count_claims' : ['tot_count_cnsltn', 'tot_count_cnsling', 'tot_count_emer_srvcs', 'tot_count_phys_srvcs', 'tot_count_scn_assmt'],
+    'state_sud_dates_30' : ['any_service30', 'mult_service30', 'nbenes'],
+}
+
+# range of values for population cols (all other counts are 0 to 5,000 with some small cells to suppress)
+
+POP_RANGES = {'pop_tot' : (50000, 900000), 'pop_sud_tot' : (1000, 40000), 'nbenes' : (100, 9000)}
+
+# number of unused cols added to each dataset per unit of scale (EBI outputs carry many cols not read by the tables)
+
+PAD_COLS = 10
+
+def dataset_keys(table_details):
+    """
+    Function dataset_keys to return key cols and values of each dataset with more than one rec per state, from config:
+        - group_cols of TableClassWideTransform tables (values from group_order, split on _ if more than one group col)
+        - numer_col of TableClassWideTransform and TableClassDuals tables and subset_col of TableClassDuals tables (values 0 and 1)
+        - numer_col_any cols (values 0 and 1), each paired with the sas_ds_numer dataset in the same position
+
+    params:
+        table_details dict: TABLE_MAPPINGS from config
+
+    returns:
+        dict of dict of list of values for each key col, keyed by dataset name
+
+    """
+
+    keys = {}
+
+    for kwargs in table_details.values():
+
+        use_class = kwargs.get('use_class', 'TableClass')
+
+        if use_class == 'TableClassWideTransform':
+
+            group_values = [str(value).split('_') for value in kwargs['group_order']]
+
+            for sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', []):
+                for i, col in enumerate(kwargs['group_cols']):
+                    keys.setdefault(sas_ds, {})[col] = list(dict.fromkeys(float(values[i]) for values in group_values))
+
+        if use_class in ['TableClassWideTransform', 'TableClassDuals']:
+            for param in ['numer_col', 'subset_col']:
+                if param in kwargs:
+                    keys.setdefault(kwargs['sas_ds'], {})[kwargs[param]] = [0.0, 1.0]
+
+        for col, sas_ds in zip(kwargs.get('numer_col_any', []), kwargs.get('sas_ds_numer', [])):
+            keys.setdefault(sas_ds, {})[col] = [0.0, 1.0]
+
+    return keys
+
+def group_cols_of(table_details, sas_ds):
+    """
+    Function group_cols_of to return group cols of any TableClassWideTransform table reading given dataset
+
+    """
+
+    return list(dict.fromkeys(col for kwargs in table_details.values() if kwargs.get('use_class') == 'TableClassWideTransform'
+                              and sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', []) for col in kwargs['group_cols']))
+
+def group_combos(table_details, sas_ds, cols):
+    """
+    Function group_combos to return combinations of values of more than one group col of dataset listed in group_order
+    of any table reading the dataset with exactly those group cols (None if no table lists combinations)
+
+    """
+
+    for kwargs in table_details.values():
+        if (kwargs.get('use_class') == 'TableClassWideTransform') and (sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', [])) \
+            and (kwargs['group_cols'] == cols) and (len(cols) > 1):
+            return [tuple(float(value) for value in str(combo).split('_')) for combo in kwargs['group_order']]
+
+    return None
+
+def counts(rng, n, col):
+    """
+    Function counts to return n random counts for given col, with about 15% small cells (0 to 11) for cols without a population range
+
+    """
+
+    if col in POP_RANGES:
+        return rng.integers(*POP_RANGES[col], n).astype(float)
+
+    values = rng.integers(0, 5000, n).astype(float)
+
+    small = rng.random(n) < 0.15
+    values[small] = rng.integers(0, 12, small.sum())
+
+    return values
+
+def gen_dataset(*, name, table_details, scale=1, seed=0):
+    """
+    Function gen_dataset to create synthetic dataset with all FIPS codes in FIPS_NAME_MAP
+
+    params:
+        name str: name of SAS dataset (_op suffix gives a different draw of the same layout)
+        table_details dict: TABLE_MAPPINGS from config
+        scale int: number of sets of PAD_COLS unused cols to add, default is 1
+        seed int: seed for random values (combined with name), default is 0
+
+    returns:
+        df
+
+    """
+
+    base = name[:-len('_op')] if name.endswith('_op') else name
+
+    rng = np.random.default_rng([seed] + list(name.encode()))
+
+    fips = sorted(FIPS_NAME_MAP)
+
+    keys = dataset_keys(table_details).get(base)
+
+    if base in STATE_COUNTS:
+        df = pd.DataFrame({'submtg_state_cd' : fips})
+        count_cols = STATE_COUNTS[base]
+
+    elif keys is not None:
+
+        # group cols listed together in group_order only take the listed combinations, all other key cols take all values
+
+        group_cols = [col for col in group_cols_of(table_details, base) if col in keys]
+        combos = group_combos(table_details, base, group_cols) or list(itertools.product(*[keys[col] for col in group_cols]))
+
+        other_cols = [col for col in keys if col not in group_cols]
+        key_rows = [combo + rest for combo in combos for rest in itertools.product(*[keys[col] for col in other_cols])]
+
+        df = pd.DataFrame([(state,) + row for state in fips for row in key_rows], columns = ['submtg_state_cd'] + group_cols + other_cols)
+        count_cols = ['count']
+
+    else:
+        raise ValueError(f"ERROR: No synthetic layout for dataset {name} - add count cols to STATE_COUNTS or key cols to config - FIX")
+
+    for col in count_cols:
+        df[col] = counts(rng, len(df), col)
+
+    for i in range(PAD_COLS * scale):
+        df[f"pad_{i}"] = rng.random(len(df))
+
+    return df
+
+def config_datasets(table_details):
+    """
+    Function config_datasets to return names of all SAS datasets read by tables in config (without _op suffix)
+
+    """
+
+    return list(dict.fromkeys([TOTALS_DS] + [sas_ds for kwargs in table_details.values() for sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', [])]))
+
+def make_shell(*, path, sheet_nums, total_sheets=[], exact_names=False):
+    """
+    Function make_shell to write table shell with one sheet per sheet number, each with title rows and state col (national row,
+    then all states with a row break every 20 states and some states marked with asterisks), and a footnote.
+    National row is United States, or Total number of states for count only tables (see TableClassCountsOnly)
+
+    params:
+        path Path: path to write shell to
+        sheet_nums list: sheet numbers in order
+        total_sheets list: sheet numbers of count only tables, default is none
+        exact_names bool: if True, sheets are named with sheet number only, otherwise with sheet number and title, default is False
+
+    returns:
+        none
+
+    """
+
+    workbook = xl.Workbook()
+    workbook.remove(workbook.active)
+
+    state_names = sorted(FIPS_NAME_MAP.values())
+
+    for sheet_num in sheet_nums:
+
+        sheet = workbook.create_sheet(sheet_num if exact_names else f"{sheet_num} Table {sheet_num}")
+
+        sheet['A1'], sheet['A2'] = f"Table {sheet_num}", 'State'
+
+        row = 4
+        national = 'Total number of states' if sheet_num in total_sheets else 'United States'
+
+        for i, state in enumerate([national] + state_names):
+            sheet.cell(row = row, column = 1, value = state + ('*' if i % 9 == 3 else ''))
+            row += 1 if i % 20 else 2
+
+        sheet.cell(row = row + 2, column = 1, value = 'Source: synthetic fixture')
+
+    workbook.save(path)
+
+def write_fixtures(*, root, year, table_details, g_table_details, scale=1, seed=0):
+    """
+    Function write_fixtures to write synthetic datasets for year and prior year to root/sas/<year> (parquet, one per SAS dataset
+    and _op version) and table shells (SUD, OUD and prior year comparisons) to root/spec
+
+    params:
+        root Path: directory to write fixtures to
+        year str/int: year of tables
+        table_details dict: TABLE_MAPPINGS from config
+        g_table_details dict: G_TABLE_MAPPINGS from config
+        scale int: number of sets of PAD_COLS unused cols to add to each dataset, default is 1
+        seed int: seed for random values, default is 0 (prior year datasets use seed + 1)
+
+    returns:
+        dict of paths of shells, keyed by SHELL, SHELL_OUD and SHELL_PYEAR
+
+    """
+
+    for data_year, data_seed in [(int(year), seed), (int(year)-1, seed+1)]:
+
+        sas_dir = root / 'sas' / str(data_year)
+        sas_dir.mkdir(parents=True, exist_ok=True)
+
+        for sas_ds in config_datasets(table_details):
+            for name in [sas_ds, f"{sas_ds}_op"]:
+                gen_dataset(name = name, table_details = table_details, scale = scale, seed = data_seed).to_parquet(sas_dir / f"{name}.parquet", index=False)
+
+    spec_dir = root / 'spec'
+    spec_dir.mkdir(parents=True, exist_ok=True)
+
+    sud_sheets = [kwargs['sheet_num_sud'] for kwargs in table_details.values() if kwargs.get('sheet_num_sud')]
+    oud_sheets = [kwargs['sheet_num_op'] for kwargs in table_details.values() if kwargs.get('sheet_num_op')]
+    g_sheets = [g_sheet_num for g_sheets in g_table_details.values() for g_sheet_num in g_sheets]
+
+    total_sheets = [kwargs.get(param) for kwargs in table_details.values() if kwargs.get('use_class') == 'TableClassCountsOnly' for param in ['sheet_num_sud', 'sheet_num_op']]
+
+    shells = {SHELL : spec_dir / SHELL, SHELL_OUD : spec_dir / SHELL_OUD, SHELL_PYEAR : spec_dir / SHELL_PYEAR}
+
+    make_shell(path = shells[SHELL], sheet_nums = sud_sheets + g_sheets, total_sheets = total_sheets)
+    make_shell(path = shells[SHELL_OUD], sheet_nums = oud_sheets, total_sheets = total_sheets)
+    make_shell(path = shells[SHELL_PYEAR], sheet_nums = sud_sheets, exact_names = True)
+
+    return shells
@@ -0,0 +1,177 @@
+"""
+end to end benchmark of write_db on synthetic fixtures (see fixtures): writes fixtures at the given scale, then runs all SUD tables
+(with prior year comparisons) and OUD tables in turn, timing each stage of each table (see timing), and reports stage times per table and in total.
+Results can be saved to json and compared to saved results of a previous run to flag regressions
+"""
+
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import pandas as pd
+import openpyxl as xl
+from pathlib import Path
+
+from common.utils.general_funcs import variable_matcher, variable_constructor, read_config, get_current_path
+from common.utils.params import SHELL, SHELL_OUD, SHELL_PYEAR
+from common.utils.timing import STAGE_STATS, clear_stage_stats, table_timer, stage_timer
+from write_db.gen_tables import gen_tables, plan_shared_work
+from write_db.tasks.read_data import clear_cache
+from write_db.tasks.planner import clear_plan
+from .fixtures import write_fixtures
+
+STAGES = ['read', 'transform', 'prep', 'suppress', 'stats', 'write', 'save']
+
+def run_once(*, root, year, shells, table_details, g_table_details, chunksize=None):
+    """
+    Function run_once to run and save all SUD and OUD tables from fixtures with empty dataset cache, timing each stage
+
+    params:
+        root Path: directory with fixtures (see write_fixtures), outputs are saved to root/out
+        year str: year of tables
+        shells dict: paths of shells (see write_fixtures)
+        table_details dict: TABLE_MAPPINGS from config
+        g_table_details dict: G_TABLE_MAPPINGS from config
+        chunksize int: optional chunksize to pass to gen_tables, default is None
+
+    returns:
+        tuple of dict of seconds in each stage keyed by table (saves are keyed by table type and workbook), and total seconds
+
+    """
+
+    clear_cache()
+    clear_plan()
+    clear_stage_stats()
+
+    (root / 'out').mkdir(exist_ok=True)
+
+    pipelines = [('SUD', {'workbook' : SHELL, 'workbook_pyear' : SHELL_PYEAR}, dict(config_sheet_num = 'sheet_num_sud', pyr_comp = True, g_table_details = g_table_details)),
+                 ('OUD', {'workbook' : SHELL_OUD}, dict(config_sheet_num = 'sheet_num_op', pyr_comp = False))]
+
+    start = time.perf_counter()
+
+    # plan steps shared between tables of both pipelines before running either (as when running the cli in turn)
+
+    for table_type, books, params in pipelines:
+        plan_shared_work(year = year, table_details = table_details, config_sheet_num = params['config_sheet_num'], table_type = table_type,
+                         pyr_comp = params['pyr_comp'], chunksize = chunksize, sas_root = root / 'sas')
+
+    for table_type, books, params in pipelines:
+
+        workbooks = {key : xl.load_workbook(shells[shell]) for key, shell in books.items()}
+
+        gen_tables(year = year, table_details = table_details, table_type = table_type, chunksize = chunksize, sas_root = root / 'sas', **workbooks, **params)
+
+        for key, workbook in workbooks.items():
+            with table_timer(f"{table_type}/{key}"), stage_timer('save'):
+                workbook.save(root / 'out' / f"{table_type.lower()}_{key}.xlsx")
+
+    total = time.perf_counter() - start
+
+    return {table : {stage : metrics['wall'] for stage, metrics in stages.items()} for table, stages in STAGE_STATS.items() if table is not None}, total
+
+def summarize(runs):
+    """
+    Function summarize to take median over runs of seconds in each stage of each table, and of total seconds
+
+    params:
+        runs list: list of (stage times, total) from run_once
+
+    returns:
+        dict of per table stage times (tables), stage totals over tables (stages) and total (total)
+
+    """
+
+    tables = {table : {stage : statistics.median(times[table].get(stage, 0.0) for times, total in runs) for stage in STAGES}
+              for table in runs[0][0]}
+
+    return {'tables' : tables, 'stages' : {stage : sum(times[stage] for times in tables.values()) for stage in STAGES},
+            'total' : statistics.median(total for times, total in runs)}
+
+def regressions(results, baseline, threshold, min_seconds=0.05):
+    """
+    Function regressions to compare stage totals and total to baseline results, returning list of messages for each that is
+    slower than baseline by more than threshold (and by more than min_seconds, so noise in short stages is not flagged)
+
+    """
+
+    pairs = [(f"stage {stage}", results['stages'][stage], baseline['stages'].get(stage, 0.0)) for stage in STAGES] + \
+            [('total', results['total'], baseline['total'])]
+
+    return [f"{name}: {current:.3f}s vs baseline {base:.3f}s ({current/base - 1:+.0%})" for name, current, base in pairs
+            if (current > base * (1 + threshold)) and (current - base > min_seconds) and (base > 0)]
+
+def main(args=None):
+
+    # add cli args and extract
+    # scale is the number of sets of unused cols added to each dataset, repeat is number of runs to take median of
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--year', required=False, default='2020')
+    parser.add_argument('--scale', required=False, type=int, default=1)
+    parser.add_argument('--seed', required=False, type=int, default=0)
+    parser.add_argument('--repeat', required=False, type=int, default=3)
+    parser.add_argument('--chunksize', required=False, type=int, default=None)
+    parser.add_argument('--root', required=False, default=None)
+    parser.add_argument('--output', required=False, default=None)
+    parser.add_argument('--baseline', required=False, default=None)
+    parser.add_argument('--threshold', required=False, type=float, default=0.25)
+
+    args = parser.parse_args(args)
+
+    CONFIG = read_config(config_dir = get_current_path(sub_dirs = 'sud_databook_tables/write_db/config'), variable_match = {'matcher' : variable_matcher, 'constructor' : variable_constructor})
+
+    # write fixtures to given root, or temp directory removed after run
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        root = Path(args.root) if args.root else Path(tmp_dir)
+
+        shells = write_fixtures(root = root, year = args.year, table_details = CONFIG['TABLE_MAPPINGS'], g_table_details = CONFIG['G_TABLE_MAPPINGS'],
+                                scale = args.scale, seed = args.seed)
+
+        # config entries are changed by gen_tables (use_sud_ds is popped), so read config again for each run
+
+        runs = []
+
+        for run in range(args.repeat):
+
+            config = read_config(config_dir = get_current_path(sub_dirs = 'sud_databook_tables/write_db/config'), variable_match = {'matcher' : variable_matcher, 'constructor' : variable_constructor})
+
+            runs.append(run_once(root = root, year = args.year, shells = shells, table_details = config['TABLE_MAPPINGS'],
+                                 g_table_details = config['G_TABLE_MAPPINGS'], chunksize = args.chunksize))
+
+    results = dict(summarize(runs), meta = {'year' : args.year, 'scale' : args.scale, 'seed' : args.seed, 'repeat' : args.repeat, 'chunksize' : args.chunksize,
+                                            'python' : platform.python_version(), 'pandas' : pd.__version__})
+
+    # report median seconds in each stage for each table and in total
+
+    report = pd.DataFrame(results['tables']).T[STAGES]
+    report.loc['all tables'] = pd.Series(results['stages'])
+    report['total'] = report.sum(axis=1)
+
+    print(f"stage seconds (median of {args.repeat} runs, scale {args.scale}):")
+    print(report.round(3).to_string())
+    print(f"total seconds: {results['total']:.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    # compare to baseline if given, exiting with error if any stage regressed
+
+    if args.baseline:
+
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.threshold)
+
+        for message in slower:
+            print(f"REGRESSION {message}")
+
+        if slower:
+            raise SystemExit(1)
+
+        print(f"no regressions vs baseline (threshold {args.threshold:.0%})")
@@ -1,6 +1,10 @@
 import pandas as pd
 import numpy as np
 
+from common.utils.cell_status import VALUE, MISSING, NOT_APPLICABLE
+from common.utils.stats import as_float_array
+from common.utils.timing import timed_stage
+
 def calc_comparisons(*, data1, data2, join_on, how_join = 'outer', compare_cols = 'All', join_suffixes = ('_1','_2'), diff_types = 'both', fill_na = None, **kwargs):
     """
     Function calc_comparisons to read in two datasets with the same columns and calculate raw and/or pct differences for each pairs of columns,
@@ -56,4 +60,150 @@ def calc_comparisons(*, data1, data2, join_on, how_join = 'outer', compare_cols
             if fill_na:
                 joined[f"{col}_pctdiff"].fillna(fill_na, inplace=True)
     
-    return joined
\ No newline at end of file
+    return joined
+
+def comparison_pairs(pairs, n):
+    """
+    Function comparison_pairs to return list of (i, j) pairs of positions of datasets to compare (dataset i - dataset j) for n datasets:
+        - yoy: each dataset compared to the next (year over year if datasets are in year order)
+        - base: first dataset compared to each other dataset
+        - list of (i, j) pairs: given pairs
+
+    """
+
+    if pairs == 'yoy':
+        return [(i, i + 1) for i in range(n - 1)]
+
+    elif pairs == 'base':
+        return [(0, j) for j in range(1, n)]
+
+    assert all((0 <= i < n) and (0 <= j < n) and (i != j) for i, j in pairs), f"Invalid pairs ({pairs}) passed to calc_comparisons_years for {n} datasets: FIX"
+
+    return list(pairs)
+
+@timed_stage('stats')
+def calc_comparisons_years(*, datas, statuses, join_on, suffixes, compare_cols = 'All', diff_types = 'both', pairs = 'yoy', fill_status = MISSING, **kwargs):
+    """
+    Function calc_comparisons_years to calculate raw and/or pct differences between any number of datasets with the same columns (e.g. prepped
+        dfs for each year), each with a status df giving the status of each cell (see common.utils.cell_status), and return the joined data with joined status.
+
+    All datasets are aligned on join_on in one join, and each compared col of each dataset is converted once to a numeric array (non-numeric values are nan),
+    so differences for all cols and pairs of datasets are calculated as array operations
+
+    Notes:
+        - any div by 0 for percent differences is given NOT_APPLICABLE status
+        - any other null comparison (e.g. either value suppressed) is given fill_status
+        - recs not on all datasets are given MISSING status for cols from datasets they are not on
+        - percent differences are NOT multiplied by 100 - that must be done with formatting
+
+    params:
+        datas list: datasets to compare (e.g. most recent year first), each with one rec per join_on value
+        statuses list: status df of each dataset (same index and cols as dataset)
+        join_on str: name of col to join on (must be on all)
+        suffixes list: suffix to add to cols of each dataset (e.g. _cy, _py)
+        compare_cols str/list: columns to compare, default = All (all cols), otherwise will only compare passed list
+        diff_types str: type of differences to create - default is both.
+            Other options are raw (only calculate raw differences) or pct (only calcualte pct differences).
+            Will issue error if other value is given
+        pairs str/list: pairs of datasets to compare (see comparison_pairs), default is yoy (each dataset - next dataset).
+            Difference cols are named col_diff/col_pctdiff if there is one pair, otherwise col_diff/col_pctdiff followed by suffixes of pair (e.g. col_diff_cy_py)
+        fill_status int: status to give null comparisons, default is MISSING
+
+    returns:
+        tuple of pandas df, joined datasets with comparisons (recs in order of first dataset then any recs not on it), and df with status of each cell in joined df
+
+    """
+
+    assert len(datas) == len(statuses) == len(suffixes) >= 2, f"Must pass at least two datasets, with a status df and suffix for each, to calc_comparisons_years: FIX"
+
+    cols = [col for col in datas[0] if col != join_on]
+
+    if compare_cols == 'All':
+        compare_cols = cols
+
+    else:
+        assert all(col in data.columns for data in datas for col in compare_cols), f"Invalid list of cols ({compare_cols}) passed to {kwargs['function_name']}: FIX"
+
+    assert diff_types.lower() in ['both','raw','pct'], f"Invalid value of diff_types ({diff_types}) passed to calc_comparisons_years. Must be both, raw or pct: FIX"
+
+    pairs = comparison_pairs(pairs, len(datas))
+
+    # align all datasets and status dfs on join values in one join (outer, recs in order of first dataset then any recs not on it in order found),
+    # status of recs not on a dataset is MISSING
+
+    aligned = pd.concat([data.set_index(join_on)[cols] for data in datas], axis=1, keys=range(len(datas)), join='outer', sort=False)
+
+    aligned_status = pd.concat([status[cols].set_axis(data[join_on].to_numpy(), axis=0) for data, status in zip(datas, statuses)],
+                               axis=1, keys=range(len(datas)), join='outer').reindex(aligned.index).fillna(MISSING).astype('int8')
+
+    joined = {join_on : aligned.index.to_numpy()}
+    status = {join_on : np.full(len(aligned), VALUE)}
+
+    for i, suffix in enumerate(suffixes):
+        for col in cols:
+            joined[f"{col}{suffix}"] = aligned[(i, col)].to_numpy()
+            status[f"{col}{suffix}"] = aligned_status[(i, col)].to_numpy()
+
+    # convert compared cols of each dataset to numeric array of shape (datasets, recs, cols), and get result dtype of raw difference of each col for each pair
+    # (ints if cols of both datasets are ints, as when subtracting cols)
+
+    values = np.stack([as_float_array(aligned[i][compare_cols]) for i in range(len(datas))])
+
+    dtypes = {pair : [np.result_type(aligned[(pair[0], col)].dtype, aligned[(pair[1], col)].dtype) for col in compare_cols] for pair in pairs}
+
+    diffs, pctdiffs = {}, {}
+
+    for i, j in pairs:
+
+        diffs[(i, j)] = values[i] - values[j]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pctdiffs[(i, j)] = 100 * (diffs[(i, j)] / values[j])
+
+    for c, col in enumerate(compare_cols):
+        for i, j in pairs:
+
+            name = lambda diff_type: f"{col}_{diff_type}" if len(pairs) == 1 else f"{col}_{diff_type}{suffixes[i]}{suffixes[j]}"
+
+            if diff_types != 'pct':
+                diff = diffs[(i, j)][:, c]
+
+                joined[name('diff')] = diff.astype(dtypes[(i, j)][c]) if dtypes[(i, j)][c].kind in 'iu' else diff
+                status[name('diff')] = np.where(np.isnan(diff), fill_status, VALUE).astype('int8')
+
+            if diff_types != 'raw':
+                pctdiff = pctdiffs[(i, j)][:, c].copy()
+
+                status[name('pctdiff')] = np.select([np.isinf(pctdiff), np.isnan(pctdiff)], [NOT_APPLICABLE, fill_status], VALUE).astype('int8')
+
+                pctdiff[np.isinf(pctdiff)] = np.nan
+                joined[name('pctdiff')] = pctdiff
+
+    return pd.DataFrame(joined), pd.DataFrame(status)
+
+def calc_comparisons_status(*, data1, status1, data2, status2, join_on, compare_cols = 'All', join_suffixes = ('_1','_2'), diff_types = 'both', fill_status = MISSING, **kwargs):
+    """
+    Function calc_comparisons_status to calculate raw and/or pct differences (data1 - data2) for two numeric datasets with the same columns,
+        each with a status df giving the status of each cell (see common.utils.cell_status), and return the joined data with joined status
+        (see calc_comparisons_years for notes on status of comparisons)
+
+    params:
+        data1 df: first dataset
+        status1 df: status of each cell in data1 (same index and cols)
+        data2 df: second dataset (difference will be calulcated as data1 - data2)
+        status2 df: status of each cell in data2 (same index and cols)
+        join_on str: name of col to join on (must be on both)
+        compare_cols str/list: columns to compare, default = All (all cols), otherwise will only compare passed list
+        join_suffixes tuple: suffixes to add to joined data, default is _1, _2
+        diff_types str: type of differences to create - default is both.
+            Other options are raw (only calculate raw differences) or pct (only calcualte pct differences).
+            Will issue error if other value is given
+        fill_status int: status to give null comparisons, default is MISSING
+
+    returns:
+        tuple of pandas df, merged data1 and data2 with comparisons, and df with status of each cell in joined df
+
+    """
+
+    return calc_comparisons_years(datas = [data1, data2], statuses = [status1, status2], join_on = join_on, suffixes = join_suffixes, compare_cols = compare_cols,
+                                  diff_types = diff_types, fill_status = fill_status, **kwargs)
@@ -0,0 +1,69 @@
+"""
+cell status codes to carry alongside numeric table values, so values stay numeric through all processing
+and the status strings (sentinels) are only set when writing to excel
+"""
+
+import numpy as np
+import pandas as pd
+
+# status codes and the sentinel written to the table for each (VALUE cells are written as is)
+
+VALUE = 0
+SUPPRESSED = 1
+DQ = 2
+MISSING = 3
+NOT_APPLICABLE = 4
+
+SENTINELS = {SUPPRESSED : 'DS', DQ : 'DQ', MISSING : '.', NOT_APPLICABLE : 'NA'}
+
+def build_status(df, suppressed=None, dq_rows=None):
+    """
+    Function build_status to create status df for given df (same index and cols), where every cell is:
+        - SUPPRESSED if flagged in suppressed
+        - DQ if nan and in a DQ row
+        - MISSING if nan otherwise
+        - VALUE otherwise
+
+    params:
+        df df: df of values (non-VALUE cells expected to be nan)
+        suppressed df: optional boolean df flagging suppressed cells (cols must be in df, index must match df), default is None
+        dq_rows series: optional boolean series flagging rows of states excluded for DQ, default is None
+
+    returns:
+        df of int8 status codes
+
+    """
+
+    isna = df.isna().to_numpy()
+
+    status = np.where(isna, MISSING, VALUE)
+
+    if dq_rows is not None:
+        status[isna & dq_rows.to_numpy()[:, None]] = DQ
+
+    status = pd.DataFrame(status.astype('int8'), index=df.index, columns=df.columns)
+
+    if suppressed is not None:
+        status[suppressed.columns] = status[suppressed.columns].mask(suppressed, SUPPRESSED)
+
+    return status.astype('int8')
+
+def render_status(df, status):
+    """
+    Function render_status to return copy of df with the sentinel for each non-VALUE cell in status
+
+    params:
+        df df: df of values
+        status df: status codes with same shape as df
+
+    returns:
+        df (object cols)
+
+    """
+
+    rendered = df.astype(object)
+
+    for code, sentinel in SENTINELS.items():
+        rendered = rendered.mask(status.to_numpy() == code, sentinel)
+
+    return rendered
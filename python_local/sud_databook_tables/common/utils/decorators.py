@@ -1,3 +1,11 @@
+def op_name(filename, table_type, use_sud_ds):
+    """
+    Function op_name to return filename with _op suffix added if table_type is OUD and filename is not given in use_sud_ds (see add_op_suffix)
+
+    """
+
+    return f"{filename}_op" if (table_type == 'OUD') & (filename not in use_sud_ds) else filename
+
 def add_op_suffix(func):
     """
     Decorator add_op_suffix to decorate read_sas_data methods in table classes to add _op suffix to all input filenames if:
@@ -11,9 +19,6 @@ def add_op_suffix(func):
     def wrapper(*args, **kwargs):
         
         filename = kwargs.pop('filename')
-        
-        if (args[0].table_type == 'OUD') & (filename not in args[0].use_sud_ds):
-            return func(*args, filename = f"{filename}_op", **kwargs)
-        else:
-            return func(*args, filename = filename, **kwargs)
+
+        return func(*args, filename = op_name(filename, args[0].table_type, args[0].use_sud_ds), **kwargs)
     return wrapper
\ No newline at end of file
@@ -90,6 +90,30 @@ def print_to_log(*, log, message, records, print_index=False):
     
     log.info(f"\n{message}:\n")
     log.info(f"{records.to_string(index=print_index)}") 
+
+class LogBuffer():
+    """
+    LogBuffer to collect messages written with info (as to logger, so can be passed as log to e.g. print_to_log), to write to log later
+    in a set order (e.g. messages collected in worker processes)
+
+    """
+
+    def __init__(self):
+
+        self.messages = []
+
+    def info(self, message):
+
+        self.messages.append(message)
+
+    def write(self, log):
+        """
+        Method write to write all collected messages to given log in order collected
+
+        """
+
+        for message in self.messages:
+            log.info(message)
     
     
 def crosstab(*, df, groupcols):
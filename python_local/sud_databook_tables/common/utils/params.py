@@ -34,6 +34,12 @@ OUTDIR = lambda year: DIR_MAIN(year) / 'Output'
 
 LOGDIR = lambda year: DIR_RESTRICTED(year) / Path(r'python_local\logs')
 
+STOREDIR = lambda year: DIR_RESTRICTED(year) / Path(r'python_local\prepped_store')
+
+# template cache is kept per user (in the home dir), as cached entries are unpickled so must only be writable by the user running the tables
+
+TEMPLATE_CACHEDIR = lambda year: Path.home() / Path(r'sud_databook_tables\template_cache') / str(year)
+
 # file names
 
 SHELL = 'SUD DB Tables.xlsx'
@@ -44,6 +50,9 @@ OUTFILE = lambda year: f"SUD DB Tables ({year}) - {DATE_NOW}.xlsx"
 OUTFILE_OUD = lambda year: f"SUD DB Tables (OUD) ({year}) - {DATE_NOW}.xlsx"
 OUTFILE_PYEAR = lambda year: f"SUD DB Tables ({year}) - Prior Year Comparisons - {DATE_NOW}.xlsx"
 
+FINGERPRINTS = lambda table_type: f"table_fingerprints_{table_type.lower()}.json"
+PROFILE_LOG = f"write_db_profile_{DATE_NOW}.jsonl"
+
 TOTALS_DS = 'state_sud_methods'
 
 # list of states to exclude based on data quality (current and prior year), set to empty list if no states excluded
@@ -1,8 +1,7 @@
 
 import numpy as np
-from scipy import stats
+from scipy import stats, special
 import pandas as pd
-from itertools import compress
 
 def two_proportions_test(success_a, size_a, success_b, size_b, default_exception = 'NA'):
     """
@@ -99,36 +98,217 @@ def two_proportions_confint(success_a, size_a, success_b, size_b, significance =
         return default_exception
 
 
+def as_float_array(values):
+    """
+    Function as_float_array to convert array/list of values to float array, with any non-numeric values (eg DS) set to nan
+
+    """
+
+    try:
+        return np.asarray(values, dtype=float)
+
+    except (ValueError, TypeError):
+        values = np.asarray(values, dtype=object)
+        return pd.to_numeric(pd.Series(values.ravel()), errors='coerce').to_numpy(dtype=float).reshape(values.shape)
+
+def two_proportions_inputs(success_a, size_a, success_b, size_b):
+    """
+    Function two_proportions_inputs to convert inputs of two_proportions_tests/two_proportions_confints to float arrays and return with
+    mask of invalid inputs (non-numeric/nan or non-positive size)
+
+    """
+
+    success_a, size_a, success_b, size_b = np.broadcast_arrays(*[as_float_array(values) for values in [success_a, size_a, success_b, size_b]])
+
+    with np.errstate(invalid='ignore'):
+        invalid = ~(np.isfinite(success_a) & np.isfinite(success_b) & (size_a > 0) & (size_b > 0))
+
+    return success_a, size_a, success_b, size_b, invalid
+
+def two_proportions_tests(success_a, size_a, success_b, size_b):
+    """
+    Function two_proportions_tests to run two proportion z-test (see two_proportions_test) on arrays of successes and sizes
+    of groups A and B, computing all pvalues at once
+
+    params:
+        success_a, success_b array/list: number of successes in each group
+        size_a, size_b array/list: size, or number of observations in each group
+
+    returns:
+        masked array of pvalues, masked where inputs are invalid (non-numeric eg DS, nan, or non-positive size)
+        or pvalue cannot be calculated (eg both proportions 0)
+
+    """
+
+    success_a, size_a, success_b, size_b, invalid = two_proportions_inputs(success_a, size_a, success_b, size_b)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        prop_a = success_a / size_a
+        prop_b = success_b / size_b
+        prop_pooled = (success_a + success_b) / (size_a + size_b)
+        var = prop_pooled * (1 - prop_pooled) * (1 / size_a + 1 / size_b)
+        zscore = np.abs(prop_b - prop_a) / np.sqrt(var)
+
+        # two sided pvalue, with upper tail taken as lower tail of -zscore (1 - cdf(zscore) loses precision for large zscores)
+
+        pvalue = special.ndtr(-zscore) * 2
+
+    return np.ma.masked_array(pvalue, mask = invalid | np.isnan(pvalue))
+
+def two_proportions_confints(success_a, size_a, success_b, size_b, significance = 0.05):
+    """
+    Function two_proportions_confints to compute confidence intervals of difference of two proportions (see two_proportions_confint) on arrays
+    of successes and sizes of groups A and B, computing all intervals at once
+
+    params:
+        success_a, success_b array/list: number of successes in each group
+        size_a, size_b array/list: size, or number of observations in each group
+        significance float: significance level (alpha), default is 0.05
+
+    returns:
+        masked array of shape (n, 2) with lower and upper bounds of confidence intervals, masked where inputs are invalid
+        (non-numeric eg DS, nan, or non-positive size), bounds are nan for valid inputs where interval cannot be calculated
+
+    """
+
+    success_a, size_a, success_b, size_b, invalid = two_proportions_inputs(success_a, size_a, success_b, size_b)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        prop_a = success_a / size_a
+        prop_b = success_b / size_b
+        se = np.sqrt(prop_a * (1 - prop_a) / size_a + prop_b * (1 - prop_b) / size_b)
+
+    # z critical value, point-estimate +- z * standard-error
+
+    z = special.ndtri((1 - significance) + significance / 2)
+
+    confint = (prop_b - prop_a)[..., np.newaxis] + np.array([-1, 1]) * z * se[..., np.newaxis]
+
+    return np.ma.masked_array(confint, mask = np.repeat(invalid[..., np.newaxis], 2, axis=-1))
+
+# multiple testing corrections available in p_adjust
+
+P_ADJUST_METHODS = ['bh', 'by', 'holm', 'bonferroni']
+
+def p_adjust(pvalues, method = 'bh', groups = None):
+    """
+    Function p_adjust to adjust pvalues for multiple testing (as R's p.adjust), adjusting all numeric pvalues in one pass over sorted arrays:
+        - bh: Benjamini-Hochberg
+        - by: Benjamini-Yekutieli
+        - holm: Holm
+        - bonferroni: Bonferroni
+    Non-numeric/nan pvalues are not counted as tests and are passed through in place
+
+    params:
+        pvalues array/list: pvalues to adjust
+        method str: correction to apply (see P_ADJUST_METHODS), default is bh
+        groups array/list: optional group of each pvalue (e.g. sheet), pvalues are adjusted separately within each group so pvalues of many
+            sheets can be adjusted at once, default is None (all pvalues are one group)
+
+    returns:
+        array of adjusted pvalues in same order as pvalues (float array if all pvalues are numeric, otherwise object array with non-numeric values kept)
+
+    """
+
+    if method not in P_ADJUST_METHODS:
+        raise ValueError(f"ERROR: p_adjust method {method!r} must be one of {', '.join(P_ADJUST_METHODS)} - FIX")
+
+    # keep lists as objects (so nan is not converted to string alongside any strings), but as float if all numeric
+
+    values = pvalues if isinstance(pvalues, np.ndarray) else pd.Series(list(pvalues), dtype=object).infer_objects().to_numpy()
+    p = as_float_array(values).ravel()
+
+    out = p.copy() if values.dtype.kind in 'fiub' else values.astype(object).ravel()
+
+    # positions of numeric pvalues, with group code of each and number of tests in each group
+
+    positions = np.flatnonzero(~np.isnan(p))
+
+    codes = np.zeros(len(positions), dtype=int) if groups is None else pd.factorize(np.asarray(groups).ravel()[positions])[0]
+    counts = np.bincount(codes)
+
+    # sort by group then by pvalue (descending for step-up methods bh/by, ascending for step-down holm),
+    # then get number of tests in group and position of each pvalue within its group in sort order
+
+    step_up = method in ['bh', 'by']
+
+    order = np.lexsort((-p[positions] if step_up else p[positions], codes))
+    positions, codes = positions[order], codes[order]
+
+    n = counts[codes]
+    rank = np.arange(len(positions)) - (np.cumsum(counts) - counts)[codes]
+
+    sorted_p = p[positions]
+
+    if method == 'bonferroni':
+        adjusted = np.minimum(1, n * sorted_p)
+
+    elif method == 'holm':
+        adjusted = np.minimum(1, pd.Series((n - rank) * sorted_p).groupby(codes).cummax().to_numpy())
+
+    else:
+        steps = n / (n - rank)
+
+        if method == 'by':
+            steps = steps * np.cumsum(1 / np.arange(1, max(counts, default=0) + 1))[n - 1]
+
+        adjusted = np.minimum(1, pd.Series(steps * sorted_p).groupby(codes).cummin().to_numpy())
+
+    out[positions] = adjusted
+
+    return out.reshape(values.shape)
+
 def p_adjust_bh(pvalue_list):
-    
-    # taken from https://stackoverflow.com/questions/7450957/how-to-implement-rs-p-adjust-in-python/33532498#33532498
-    # adapted to remove nans and reinsert before returning final values
-    
-    """Benjamini-Hochberg p-value correction for multiple hypothesis testing."""
-    
-    # create a mask to identify numeric values to use for correction,
-    # then insert non-numerics into same position at end
-    
-    check_p = lambda p: ~np.isnan(pd.to_numeric(p, errors='coerce'))
-    
-    use_mask = [check_p(p) for p in pvalue_list]
-    
-    p = list(compress(pvalue_list, use_mask))
-    
-    p = np.asfarray(p)
-    by_descend = p.argsort()[::-1]
-    by_orig = by_descend.argsort()
-    steps = float(len(p)) / np.arange(len(p), 0, -1)
-    q = np.minimum(1, np.minimum.accumulate(steps * p[by_descend]))
-    pvals = list(q[by_orig])
-    
-    pvals_out = []
-    for i, mask in enumerate(use_mask):
-        if mask:
-            pvals_out = pvals_out + [pvals.pop(0)]
-        else:
-            pvals_out = pvals_out + [pvalue_list[i]]
-    
-    return pvals_out
+    """
+    Function p_adjust_bh to apply Benjamini-Hochberg p-value correction for multiple hypothesis testing (see p_adjust),
+    with non-numeric values kept in same position
+
+    """
+
+    return list(p_adjust(pvalue_list, method = 'bh'))
+
+format_p = lambda x: "<0.001" if pd.to_numeric(x, errors='coerce') <.001 else (f'{"{:0.3f}".format(x)}' if ~np.isnan(pd.to_numeric(x, errors='coerce')) else x)
+
+def format_pvalues(pvalues):
+    """
+    Function format_pvalues to format array of numeric pvalues as strings (vectorized version of format_p):
+        pvalues < 0.001 are set to <0.001, all others are rounded to 3 decimals, nan values are left as nan
+
+    params:
+        pvalues array/list: numeric pvalues
+
+    returns:
+        object array of formatted pvalues
+
+    """
+
+    p = np.asarray(pvalues, dtype=float)
+
+    formatted = np.where(p < .001, '<0.001', np.char.mod('%0.3f', p)).astype(object)
+    formatted[np.isnan(p)] = np.nan
+
+    return formatted
+
+def format_confints(confints, mult = 100):
+    """
+    Function format_confints to format array of confidence intervals (see two_proportions_confints) as strings of form (0.00, 0.00)
+    after multiplying by mult, masked intervals are set to nan
+
+    params:
+        confints array: array of shape (n, 2) of lower and upper bounds
+        mult int: value to multiply bounds by, default is 100 (to percentages)
+
+    returns:
+        object array of formatted intervals
+
+    """
+
+    confints = np.ma.asarray(confints, dtype=float)
+    bounds = confints.data * mult
+
+    formatted = np.char.add(np.char.add(np.char.add('(', np.char.mod('%0.2f', bounds[:, 0])), ', '), np.char.add(np.char.mod('%0.2f', bounds[:, 1]), ')')).astype(object)
+    formatted[np.ma.getmaskarray(confints).any(axis=1)] = np.nan
 
-format_p = lambda x: "<0.001" if pd.to_numeric(x, errors='coerce') <.001 else (f'{"{:0.3f}".format(x)}' if ~np.isnan(pd.to_numeric(x, errors='coerce')) else x)
\ No newline at end of file
+    return formatted
@@ -0,0 +1,254 @@
+"""
+timing of pipeline stages (read, transform, prep, suppress, stats, write, save): wall and CPU time, calls, rows in/out and cells written
+in each stage are added to the totals of the table being run, so stages can be reported per table (see benchmark and --profile).
+When profiling with memory, peak memory (tracemalloc) in each stage is also recorded
+
+Stages can be nested (e.g. a read within table prep), time in a nested stage is only counted for the nested stage
+(peak memory of a stage includes any nested stages)
+"""
+
+import time
+import cProfile
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+import pandas as pd
+
+METRICS = ['calls', 'wall', 'cpu', 'rows_in', 'rows_out', 'cells', 'peak_mem']
+
+# totals of each metric in each stage keyed by table (stages run outside of table_timer are keyed by None)
+
+STAGE_STATS = {}
+
+# profiling settings (see enable_profiling): count rows in/out of each stage, trace memory, and directory to dump cProfile stats of each table to
+
+PROFILE = {'enabled' : False, 'memory' : False, 'dump_dir' : None}
+
+# table currently being run and stages currently running (innermost last) are kept per thread, so workbooks can be saved in threads
+
+_LOCAL = threading.local()
+
+def _state():
+
+    if not hasattr(_LOCAL, 'table'):
+        _LOCAL.table, _LOCAL.stages = None, []
+
+    return _LOCAL
+
+def enable_profiling(*, memory=True, dump_dir=None):
+    """
+    Function enable_profiling to count rows in/out of each stage, and optionally trace memory and dump cProfile stats of each table
+
+    params:
+        memory bool: if True, start tracemalloc and record peak memory of each stage, default is True
+            (per stage peaks require python 3.9+ tracemalloc.reset_peak, otherwise only the peak of each table prep is recorded)
+        dump_dir Path: optional directory to dump cProfile stats of each table prep to (see profile_table), default is None (no dumps)
+
+    returns:
+        none
+
+    """
+
+    PROFILE.update({'enabled' : True, 'memory' : memory, 'dump_dir' : dump_dir})
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+@contextmanager
+def table_timer(table):
+    """
+    Function table_timer to add stats of all stages run within context to given table
+
+    """
+
+    state = _state()
+    previous, state.table = state.table, table
+
+    try:
+        yield
+
+    finally:
+        state.table = previous
+
+@contextmanager
+def profile_table(table, stage):
+    """
+    Function profile_table to run context as given stage of given table (see table_timer and stage_timer) and, if a dump directory
+    is set (see enable_profiling), dump cProfile stats of context to <table>.prof (with / in table replaced by _).
+    If tracing memory without tracemalloc.reset_peak (python < 3.9), traces are cleared at start so peak of whole context is recorded for stage
+
+    """
+
+    with table_timer(table):
+
+        profiler = cProfile.Profile() if PROFILE['dump_dir'] is not None else None
+
+        table_peak = PROFILE['memory'] and tracemalloc.is_tracing() and not hasattr(tracemalloc, 'reset_peak')
+
+        if table_peak:
+            tracemalloc.clear_traces()
+
+        if profiler is not None:
+            profiler.enable()
+
+        try:
+            with stage_timer(stage):
+                yield
+
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                PROFILE['dump_dir'].mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(PROFILE['dump_dir'] / f"{table.replace('/', '_')}.prof")
+
+            if table_peak:
+                totals = STAGE_STATS[table][stage]
+                totals['peak_mem'] = max(totals['peak_mem'], tracemalloc.get_traced_memory()[1])
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Function stage_timer to add wall and CPU time of context (less time in any nested stages) to given stage of current table.
+    Yields dict of rows_in, rows_out and cells that can be added to (see add_metrics) and are added to the stage totals
+
+    """
+
+    state = _state()
+
+    # if tracing memory per stage, fold peak so far into running stage's peak before resetting the peak for this stage
+
+    memory = PROFILE['memory'] and tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak')
+
+    start_mem = 0
+
+    if memory:
+        start_mem, peak = tracemalloc.get_traced_memory()
+
+        if state.stages:
+            state.stages[-1]['peak'] = max(state.stages[-1]['peak'], peak)
+
+        tracemalloc.reset_peak()
+
+    frame = {'metrics' : {'rows_in' : 0, 'rows_out' : 0, 'cells' : 0}, 'nested_wall' : 0.0, 'nested_cpu' : 0.0, 'peak' : 0}
+    state.stages.append(frame)
+
+    wall, cpu = time.perf_counter(), time.thread_time()
+
+    try:
+        yield frame['metrics']
+
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+
+        state.stages.pop()
+
+        totals = STAGE_STATS.setdefault(state.table, {}).setdefault(stage, dict.fromkeys(METRICS, 0))
+
+        totals['calls'] += 1
+        totals['wall'] += wall - frame['nested_wall']
+        totals['cpu'] += cpu - frame['nested_cpu']
+
+        for metric, value in frame['metrics'].items():
+            totals[metric] += value
+
+        if memory:
+            totals['peak_mem'] = max(totals['peak_mem'], max(frame['peak'], tracemalloc.get_traced_memory()[1]) - start_mem)
+
+        if state.stages:
+            state.stages[-1]['nested_wall'] += wall
+            state.stages[-1]['nested_cpu'] += cpu
+
+def add_metrics(**metrics):
+    """
+    Function add_metrics to add given values of rows_in, rows_out or cells to innermost running stage (ignored if no stage is running)
+
+    """
+
+    state = _state()
+
+    if state.stages:
+        for metric, value in metrics.items():
+            state.stages[-1]['metrics'][metric] += value
+
+def frame_rows(values):
+    """
+    Function frame_rows to return number of rows of first df in given values (0 if none)
+
+    """
+
+    return next((len(value) for value in values if isinstance(value, pd.DataFrame)), 0)
+
+def timed_stage(stage):
+    """
+    Decorator timed_stage to add stats of each call of decorated function to given stage (see stage_timer).
+    If profiling is enabled, rows of first df passed in and of df returned (or first df in tuple returned) are added to rows_in and rows_out
+
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            with stage_timer(stage) as metrics:
+
+                result = func(*args, **kwargs)
+
+                if PROFILE['enabled']:
+                    metrics['rows_in'] += frame_rows(list(args) + list(kwargs.values()))
+                    metrics['rows_out'] += frame_rows(result if isinstance(result, tuple) else [result])
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+def pop_stats(table):
+    """
+    Function pop_stats to remove and return stage stats of given table (e.g. to return from worker process, see merge_stats)
+
+    """
+
+    return {table : STAGE_STATS.pop(table, {})}
+
+def merge_stats(stats):
+    """
+    Function merge_stats to add stage stats of each table in given dict (see pop_stats) to totals (peak memory is max of peaks)
+
+    """
+
+    for table, stages in stats.items():
+        for stage, metrics in stages.items():
+
+            totals = STAGE_STATS.setdefault(table, {}).setdefault(stage, dict.fromkeys(METRICS, 0))
+
+            for metric, value in metrics.items():
+                totals[metric] = max(totals[metric], value) if metric == 'peak_mem' else totals[metric] + value
+
+def stats_records(stats, **fields):
+    """
+    Function stats_records to flatten stage stats (see pop_stats) to one record per table and stage, with table keys of form
+    <table type>/<table> split into table_type and table
+
+    params:
+        stats dict: stage stats keyed by table
+        fields: any fields to add to every record (e.g. year)
+
+    returns:
+        list of dicts
+
+    """
+
+    return [dict(fields, table_type = table.split('/', 1)[0], table = table.split('/', 1)[-1], stage = stage, **metrics)
+            for table, stages in stats.items() if table is not None for stage, metrics in stages.items()]
+
+def clear_stage_stats():
+    """
+    Function clear_stage_stats to drop all stage totals
+
+    """
+
+    STAGE_STATS.clear()
@@ -3,12 +3,19 @@ Stand-alone script to compare old (SAS DDE) and new (python) versions of tables
 """
 
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import argparse
 from datetime import date
+from functools import lru_cache, partial
+from itertools import zip_longest
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import load_workbook
+from pandas._libs.parsers import STR_NA_VALUES
 
 from common.utils.params import STATE_LIST, DIR_MAIN, OUTDIR, LOGDIR, DATE_NOW
-from common.utils.general_funcs import generate_logger, print_to_log
+from common.utils.general_funcs import generate_logger, print_to_log, LogBuffer
 
 # assign old and new table paths
 
@@ -22,32 +29,53 @@ TABLES = { 'SUD': {'OLD' : lambda year: f"SUD DB Tables ({year}) - 2021-06-15.xl
                      'NEW' : lambda year, run_date: f"SUD DB Tables (OUD) ({year}) - {run_date}.xlsx"}
         }
 
-# function to return name of Excel file given excel wb object
+# values read as nan (pandas default NA strings plus periods, as in read_sheet) and set of state row labels to compare
 
-get_file_name = lambda workbook: Path(workbook.__dict__['io']).name
+NA_VALUES = set(STR_NA_VALUES) | {'.', '. '}
+STATES = set(STATE_LIST)
 
-def prep_values(x):
+def prep_values(df):
     """
-    Function prep_values to read in specific variable and prep for comparisons:
+    Function prep_values to prep all values of sheet df for comparisons, operating on all cells at once:
         - replace trailing space from DS cells (added in base version)
-        - round numerics to 2 decimal places for comparisons
+        - round numerics to 2 decimal places for comparisons (only numbers changed by rounding are replaced, so ints are kept)
 
     params:
-        x str/num: specific cell value
+        df: df of sheet values
 
     returns:
-        x str/num: prepped value
+        df: prepped df
 
     """
-    
-    if str(x).strip() == 'DS':
-        return 'DS'
-    
-    elif type(x) == float:
-        return round(x,2)
-    
-    else:
-        return x
+
+    # flatten all cells to one array, split into strings and all other values
+
+    values = df.to_numpy(dtype=object).ravel()
+
+    is_str = np.fromiter((type(value) is str for value in values), dtype=bool, count=len(values))
+    str_pos, other_pos = np.flatnonzero(is_str), np.flatnonzero(~is_str)
+
+    # strip each distinct string once to find DS cells
+
+    codes, strings = pd.factorize(values[str_pos])
+    is_ds = np.array([string.strip() == 'DS' for string in strings], dtype=bool)[codes] if len(strings) else np.zeros(0, dtype=bool)
+
+    # convert all other values to numbers and round, replacing only numbers changed by rounding
+
+    numbers = pd.to_numeric(pd.Series(values[other_pos], dtype=object), errors='coerce').to_numpy(dtype=float)
+    rounded = numbers.round(2)
+
+    # numpy rounds number * 100, which can differ from python round for numbers near a half cent, so round those as python does
+
+    near_half = np.abs(np.abs(numbers * 100) % 1 - 0.5) < 1e-6
+    rounded[near_half] = [round(float(number), 2) for number in numbers[near_half]]
+
+    changed = rounded != numbers
+
+    values[str_pos[is_ds]] = 'DS'
+    values[other_pos[changed]] = rounded[changed]
+
+    return pd.DataFrame(values.reshape(df.shape), index=df.index, columns=df.columns).infer_objects()
 
 def read_sheet(excel_obj, sheetname):
     """
@@ -65,7 +93,7 @@ def read_sheet(excel_obj, sheetname):
     
     df = pd.io.excel.ExcelFile.parse(excel_obj, sheetname, na_values=['.', '. '], verbose=True)
     
-    df.iloc[:,0] = df.iloc[:,0].apply(lambda x: str(x).replace('*',''))
+    df.iloc[:,0] = df.iloc[:,0].astype(str).str.replace('*', '', regex=False)
     
     df.set_index(df.iloc[:,0], inplace=True)
     df.index.rename(sheetname, inplace=True)
@@ -80,11 +108,11 @@ def read_sheet(excel_obj, sheetname):
     # - replace trailing space from DS cells (added in base version)
     # - round numerics to 2 decimal places for comparisons
     
-    df = df.applymap(prep_values)
+    df = prep_values(df)
 
     # return df with overall/state rows only
     
-    return df[df.index.isin([value for value in df.index if value in STATE_LIST])]
+    return df[df.index.isin(STATE_LIST)]
     
 
 def comp_tables(sheetname, log, base_excel_obj, comp_excel_obj):
@@ -114,6 +142,198 @@ def comp_tables(sheetname, log, base_excel_obj, comp_excel_obj):
     else:
         log.info('--NOT all equal!')
         print_to_log(log = log, message = 'Differences', records = diff_df, print_index=True)
+
+def prep_value(value):
+    """
+    Function prep_value to prep single cell value read from workbook for comparisons, as done for all cells of sheet df by read_sheet:
+        - replace NA strings (see NA_VALUES), periods and empty cells with None
+        - replace trailing space from DS cells (added in base version)
+        - round numerics to 2 decimal places for comparisons (floats with integer values are read as ints, as by pd.read_excel)
+
+    params:
+        value str/num: cell value
+
+    returns:
+        value str/num: prepped value
+
+    """
+
+    if isinstance(value, str):
+
+        if value in NA_VALUES:
+            return None
+
+        return 'DS' if value.strip() == 'DS' else value
+
+    elif type(value) == float:
+        return int(value) if value.is_integer() else round(value, 2)
+
+    return value
+
+def state_rows(worksheet):
+    """
+    Function state_rows to stream overall/state rows of read-only worksheet, one row at a time
+
+    params:
+        worksheet: openpyxl read-only worksheet
+
+    returns:
+        generator of tuples of state name (first column, asterisks removed) and tuple of prepped values of all other columns
+
+    """
+
+    # dimensions saved with workbook can be wrong, so read all rows that exist (as with pd.read_excel)
+
+    worksheet.reset_dimensions()
+
+    for row in worksheet.iter_rows(values_only=True):
+
+        if row and (str(row[0]).replace('*', '') in STATES):
+            yield str(row[0]).replace('*', ''), tuple(prep_value(value) for value in row[1:])
+
+def diff_cells(base_values, comp_values):
+    """
+    Function diff_cells to return differing cells of two rows as dict of (base value, comparison value), keyed by col_# (None for missing values)
+
+    """
+
+    return {f"col_{i}" : (base, comp) for i, (base, comp) in enumerate(zip_longest(base_values, comp_values), start=1)
+            if not ((base == comp) or ((base is None) and (comp is None)))}
+
+def diff_sheet(sheetname, base_ws, comp_ws):
+    """
+    Function diff_sheet to compare overall/state rows of two read-only worksheets in one pass over each, walking rows of both in lockstep.
+    Rows are matched on state name, so rows only need to be in the same order to be compared as they are read, any rows out of order are held
+    until the matching row is read (a state missing from one worksheet is compared to an empty row).
+    Only differing cells are kept, so memory is bounded by the rows held and the differences found
+
+    params:
+        sheetname str: sheet name (to name index of returned df)
+        base_ws: openpyxl read-only worksheet of base workbook
+        comp_ws: openpyxl read-only worksheet of comparison workbook
+
+    returns:
+        df: df of differing cells with the same layout as pd.compare of sheet dfs (rows of states with differences in base order,
+            col_# and self/other cols for cols with differences, nan for cells that do not differ)
+
+    """
+
+    # rows read from each worksheet not yet matched, keyed by state (base rows are kept with row number to keep base order),
+    # and differing cells of each state with row number
+
+    held = ({}, {})
+    diffs = []
+
+    for row_num, rows in enumerate(zip_longest(state_rows(base_ws), state_rows(comp_ws))):
+        for side, row in enumerate(rows):
+
+            if row is None:
+                continue
+
+            state, values = row
+            matched = held[1 - side].get(state)
+
+            if not matched:
+                held[side].setdefault(state, []).append((row_num, values))
+                continue
+
+            match_num, match_values = matched.pop(0)
+
+            if not matched:
+                del held[1 - side][state]
+
+            base_num, base_values, comp_values = (row_num, values, match_values) if side == 0 else (match_num, match_values, values)
+
+            diffs.append((base_num, state, diff_cells(base_values, comp_values)))
+
+    # compare any rows missing from other worksheet to empty row (states only in comparison worksheet go last)
+
+    for state, rows in held[0].items():
+        diffs += [(row_num, state, diff_cells(values, ())) for row_num, values in rows]
+
+    for state, rows in held[1].items():
+        diffs += [(float('inf'), state, diff_cells((), values)) for row_num, values in rows]
+
+    diffs = [(state, cells) for row_num, state, cells in sorted(diffs, key=lambda diff: diff[0]) if cells]
+
+    if not diffs:
+        return pd.DataFrame()
+
+    # create df of differing cells only, with nan for missing values and cells that do not differ in cols with differences
+
+    cols = sorted({col for state, cells in diffs for col in cells}, key=lambda col: int(col.split('_')[1]))
+
+    records = {(col, side) : [np.nan if (col not in cells) or (cells[col][i] is None) else cells[col][i] for state, cells in diffs]
+               for col in cols for i, side in enumerate(['self', 'other'])}
+
+    return pd.DataFrame(records, index=pd.Index([state for state, cells in diffs], name=sheetname), dtype=object)
+
+def stream_tables(sheetname, log, base_wb, comp_wb):
+    """
+    Function stream_tables to compare specific sheet on two Excel files streamed in read-only mode (see diff_sheet) and print results to log,
+    as with comp_tables but without reading full sheets into dfs
+    params:
+        sheetname str: sheet name to compare
+        log logger obj: log to write results to
+        base_wb workbook obj: base openpyxl read-only workbook
+        comp_wb workbook obj: comparison openpyxl read-only workbook
+
+    returns:
+        none (prints to log)
+
+    """
+
+    log.info(f"\n{sheetname}")
+
+    if sheetname not in comp_wb.sheetnames:
+        log.info('--NOT all equal! Sheet not in comparison workbook\n')
+        return
+
+    diff_df = diff_sheet(sheetname, base_wb[sheetname], comp_wb[sheetname])
+
+    if diff_df.shape[0]==0:
+        log.info('--All equal!\n')
+
+    else:
+        log.info('--NOT all equal!')
+        print_to_log(log = log, message = 'Differences', records = diff_df, print_index=True)
+
+@lru_cache(maxsize=None)
+def open_workbook(path, engine='stream'):
+    """
+    Function open_workbook to open Excel file to read sheets from, opening each file once per process:
+        - stream: openpyxl workbook in read-only mode (sheets are read as streamed)
+        - pandas: pd.ExcelFile
+
+    """
+
+    if engine == 'stream':
+        return load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+    return pd.ExcelFile(path)
+
+def comp_sheet(sheetname, base_path, comp_path, engine='stream'):
+    """
+    Function comp_sheet to compare given sheet of two Excel files with given engine (stream_tables or comp_tables), collecting messages to write to log
+    (can be run in worker process)
+    params:
+        sheetname str: sheet name to read
+        base_path Path: path to base Excel file
+        comp_path Path: path to comparison Excel file
+        engine str: stream (compare rows as streamed, see stream_tables) or pandas (compare sheet dfs, see comp_tables), default is stream
+
+    returns:
+        LogBuffer with messages to write to log
+
+    """
+
+    log = LogBuffer()
+
+    compare = stream_tables if engine == 'stream' else comp_tables
+
+    compare(sheetname, log, open_workbook(base_path, engine), open_workbook(comp_path, engine))
+
+    return log
     
 def main(args=None):
 
@@ -123,32 +343,48 @@ def main(args=None):
 
     parser.add_argument('--year', required=True)
     parser.add_argument('--run_date', required=True, type=date.fromisoformat)
+    parser.add_argument('--jobs', required=False, type=int, default=None)
+    parser.add_argument('--engine', required=False, choices=['stream', 'pandas'], default='stream')
 
     # extract arguments from parser
     
     args = parser.parse_args()
 
-    year, run_date = args.year, args.run_date
+    year, run_date, jobs, engine = args.year, args.run_date, args.jobs, args.engine
+
+    parallel = (jobs is not None) and (jobs > 1)
 
     # generate log
 
     log = generate_logger(logdir=LOGDIR(year), logname = f"compare_db_versions_{DATE_NOW}.log")
 
-    # run comparisons for both SUD and OUD
-    
-    for type in ['SUD','OUD']:
+    # run comparisons for both SUD and OUD on each sheet of old workbook
+    # if jobs > 1, compare all sheets of both table types in worker processes, otherwise compare each sheet in turn
+    # messages for each sheet are collected and written to log in sheet order, so log is the same either way
+
+    with ProcessPoolExecutor(max_workers = jobs) if parallel else nullcontext() as pool:
+
+        comparisons = []
+
+        for type in ['SUD','OUD']:
+
+            # define old and new workbooks
+
+            path_old = DIR_OLD(year) / TABLES[type]['OLD'](year)
+            path_new = DIR_NEW(year) / TABLES[type]['NEW'](year, run_date)
 
-       # define old and new workbooks
+            sheetnames = open_workbook(path_old).sheetnames
 
-        workbook_old = pd.ExcelFile(DIR_OLD(year) / TABLES[type]['OLD'](year))
-        workbook_new = pd.ExcelFile(DIR_NEW(year) / TABLES[type]['NEW'](year, run_date))
+            if parallel:
+                sheets = [pool.submit(comp_sheet, sheetname, path_old, path_new, engine).result for sheetname in sheetnames]
+            else:
+                sheets = [partial(comp_sheet, sheetname, path_old, path_new, engine) for sheetname in sheetnames]
 
-        # generate series with sheet names 
+            comparisons.append((f"Comparison of {type}  tables: {path_old.name} vs {path_new.name}", sheets))
 
-        sheets_df = pd.Series(workbook_old.sheet_names)
+        for message, sheets in comparisons:
 
-        # run comp_tables on each sheet
+            log.info(message)
 
-        log.info(f"Comparison of {type}  tables: {get_file_name(workbook_old)} vs {get_file_name(workbook_new)}")
-                
-        sheets_df.apply(comp_tables, log=log, base_excel_obj = workbook_old, comp_excel_obj = workbook_new)
\ No newline at end of file
+            for sheet in sheets:
+                sheet().write(log)
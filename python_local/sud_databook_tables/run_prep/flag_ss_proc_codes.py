@@ -1,7 +1,11 @@
 """
 Read in SS procedure codes downloaded from Redshift, remove national codes, and output excel with all codes not in national list with any word matching SUD list
+Can be run for one year (--year) or a range of years (--years, e.g. 2019-2021), with extracts saved as Excel, CSV or Parquet
 """
 
+import os
+import re
+import hashlib
 import pandas as pd
 import argparse
 from pathlib import Path
@@ -14,18 +18,71 @@ NAT_DIR = lambda natyear: Path(fr"N:\Project\51131_MACBIS\MA1\T2_DQ_Atlas\Automa
 SS_FILE = "State_Specific_Proc_Codes_Raw_20210614.xlsx"
 NAT_FILE = lambda natyear: f"values_prcdr_cd_{natyear}.txt"
 
+# parsed national code sets are cached as text keyed by hash of national code file (increment version if parsing or cache format changes)
+
+NAT_CACHEDIR = lambda year: SS_DIR(year) / 'nat_code_cache'
+NAT_CACHE_VERSION = 2
+
+# readers for each extract format, and cols read as text (codes and state FIPS with leading zeros)
+
+READERS = {'.xlsx' : pd.read_excel, '.xls' : pd.read_excel, '.csv' : pd.read_csv, '.parquet' : pd.read_parquet}
+TEXT_COLS = {'submtg_state_cd' : str, 'vld_val' : str}
+
 OUT_FILE = f"State_Specific_Proc_Codes_SUD_Words {DATE_NOW}.xlsx"
 
 SUD_WORDS = ['substance','opioid','tobacco','alcohol','drug','naloxone','methadone','naltrexone','vivitrol','suboxone','buprenorphine', 
            'disulphiram','detox','chemical','cannabis','abuse','cocaine','stimulant','hallucinogen','nicotine','inhalant','psychoactive',
            'smoking','opium','heroin','narcotic','cigarette','ethanol','caffeine']
 
-def is_sa(row):
-    
-    if any(word in str(row).lower() for word in SUD_WORDS):
-        return True
-    else:
-        return False
+# single pattern matching any of the SUD words anywhere in a description, and lookahead version to find all words matched
+# (including words overlapping another match)
+
+SUD_PATTERN = re.compile('|'.join(re.escape(word) for word in SUD_WORDS))
+SUD_WORDS_FOUND = re.compile(f"(?=({SUD_PATTERN.pattern}))")
+
+def distinct_lower(descs):
+    """
+    Function distinct_lower to return codes and distinct lowercased descriptions (descriptions repeat across states and years, so words
+    are only matched once per distinct description)
+
+    """
+
+    return pd.factorize(descs.astype(str).str.lower())
+
+def flag_sud_words(descs):
+    """
+    Function flag_sud_words to flag descriptions containing any of SUD_WORDS (case insensitive, anywhere in description) with one
+    pattern applied to all distinct descriptions at once
+
+    params:
+        descs series: descriptions to flag
+
+    returns:
+        boolean series: True if description contains any SUD word
+
+    """
+
+    codes, uniques = distinct_lower(descs)
+
+    return pd.Series(pd.Series(uniques, dtype=object).str.contains(SUD_PATTERN).to_numpy(dtype=bool)[codes], index=descs.index)
+
+def find_sud_words(descs):
+    """
+    Function find_sud_words to list SUD_WORDS found in each description, e.g. for descriptions flagged with flag_sud_words
+
+    params:
+        descs series: descriptions to search
+
+    returns:
+        str series: SUD words found in description, separated by commas in order found (empty if none)
+
+    """
+
+    codes, uniques = distinct_lower(descs)
+
+    found = pd.Series(uniques, dtype=object).str.findall(SUD_WORDS_FOUND).map(lambda words: ', '.join(dict.fromkeys(words)))
+
+    return pd.Series(found.to_numpy(dtype=object)[codes], index=descs.index)
 
 def extract(row):
     
@@ -35,14 +92,131 @@ def extract(row):
     else:
         return None
 
-def main(args=None):
+def parse_years(years):
+    """
+    Function parse_years to parse year or range of years given as start-end (inclusive) into list of years
 
-    # add cli args and extract
+    """
 
-    parser = argparse.ArgumentParser()
+    start, _, end = years.partition('-')
+
+    return list(range(int(start), int(end or start) + 1))
+
+def read_extract(path):
+    """
+    Function read_extract to read SS codes extract saved as Excel, CSV or Parquet (format taken from file suffix), with codes and states read as text
+
+    params:
+        path Path: path to extract
+
+    returns:
+        df: SS codes
+
+    raises error if:
+        extract is not a supported format
+
+    """
+
+    reader = READERS.get(path.suffix.lower())
+
+    if reader is None:
+        raise ValueError(f"ERROR: Extract {path.name} must be one of {', '.join(READERS)} - FIX")
+
+    if reader == pd.read_parquet:
+        return reader(path).astype(TEXT_COLS)
+
+    return reader(path, dtype=TEXT_COLS)
+
+def parse_nat_codes(path):
+    """
+    Function parse_nat_codes to parse national code file (one code per line formatted as ('code'), see extract) into set of codes
+
+    """
+
+    with open(path) as f:
+        codes = (extract(line.rstrip('\n').split('\t')[0]) for line in f)
+
+        return frozenset(code for code in codes if code is not None)
+
+def read_cached_codes(cache_path):
+    """
+    Function read_cached_codes to return set of codes in cached entry (header line with cache version and sha256 digest of all codes,
+    then one code per line), or None if the entry cannot be read, was written by another cache version or does not match its digest
+    (e.g. a partly written or changed entry)
 
-    parser.add_argument('--year', required=True)
-    year = parser.parse_args().year
+    """
+
+    try:
+        with open(cache_path, encoding='utf-8', newline='\n') as f:
+            header, body = f.readline().rstrip('\n'), f.read()
+
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    if header != f"{NAT_CACHE_VERSION}\t{hashlib.sha256(body.encode('utf-8')).hexdigest()}":
+        return None
+
+    return frozenset(body.split('\n')[:-1])
+
+def nat_code_set(path, cache_dir):
+    """
+    Function nat_code_set to return set of national codes in given national code file, parsed once and cached (as text, one code per line)
+    in cache_dir keyed by hash of the file, so later runs read the cached set unless the file changes.
+    The file is parsed again if the cached entry cannot be read or verified (see read_cached_codes)
+
+    params:
+        path Path: path to national code file
+        cache_dir Path: directory of cached code sets
+
+    returns:
+        frozenset of codes
+
+    """
+
+    cache_path = cache_dir / f"{hashlib.sha256(path.read_bytes()).hexdigest()}.txt"
+
+    if cache_path.exists():
+
+        codes = read_cached_codes(cache_path)
+
+        if codes is not None:
+            return codes
+
+    codes = parse_nat_codes(path)
+
+    # codes with line breaks cannot be cached one per line, so are parsed on every run
+
+    if any('\n' in code for code in codes):
+        return codes
+
+    # write to temp file and then move so a partial entry is never read
+
+    body = ''.join(f"{code}\n" for code in sorted(codes))
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(f"{NAT_CACHE_VERSION}\t{hashlib.sha256(body.encode('utf-8')).hexdigest()}\n{body}")
+
+    os.replace(tmp, cache_path)
+
+    return codes
+
+def flag_codes(*, year, extract_file=SS_FILE):
+    """
+    Function flag_codes to read SS codes extract for given year, drop codes in national list for prior year, and write codes left with
+    any SUD word in description to excel
+
+    params:
+        year int: year of extract
+        extract_file str: name of extract in SS_DIR of year (Excel, CSV or Parquet), default is SS_FILE
+
+    returns:
+        df: codes written
+
+    """
 
     # assume always pull national codes from given year - 1
 
@@ -50,26 +224,42 @@ def main(args=None):
 
     # read in SS codes
 
-    ss_codes = pd.read_excel(SS_DIR(year) / SS_FILE)
+    ss_codes = read_extract(SS_DIR(year) / extract_file)
+
+    ss_codes['submtg_state_cd'] = ss_codes['submtg_state_cd'].str.zfill(2)
+
+    # read in set of nat codes, identify codes that are NOT in the national list
 
-    ss_codes['submtg_state_cd'] = ss_codes['submtg_state_cd'].apply(lambda x: str(x).zfill(2))
+    nat_codes = nat_code_set(NAT_DIR(natyear) / NAT_FILE(natyear), NAT_CACHEDIR(year))
 
-    # read in nat codes
+    ss_codes['not_nat'] = ~ss_codes['vld_val'].isin(nat_codes)
+
+    # create indicator for matching any of the SA words, and list words matched for codes output
         
-    nat_codes = pd.read_csv(NAT_DIR(natyear) / NAT_FILE(natyear), header=None, delimiter = "\t")
+    ss_codes['sud_word'] = flag_sud_words(ss_codes['vld_val_desc'])
 
-    nat_codes['code'] = nat_codes[0].apply(extract)
-    nat_codes.dropna(subset=['code'], inplace=True)
-    nat_codes.drop(columns=[0], inplace=True)
+    out = ss_codes[(ss_codes['sud_word']) & (ss_codes['not_nat'])].copy()
 
-    # join the two, identify codes that are NOT in the national list
+    out['sud_words'] = find_sud_words(out['vld_val_desc'])
 
-    joined = pd.merge(ss_codes, nat_codes, left_on='vld_val', right_on='code', how='left', indicator=True)
+    out = out[['submtg_state_cd','vld_val','vld_val_desc','sud_words']]
 
-    # create indicator for matching any of the SA words
-        
-    joined['sud_word'] = joined['vld_val_desc'].apply(is_sa)
+    out.to_excel(SS_DIR(year) / OUT_FILE, index=False)
+
+    return out
+
+def main(args=None):
+
+    # add cli args and extract (one year, or range of years given as start-end)
+
+    parser = argparse.ArgumentParser()
+
+    years = parser.add_mutually_exclusive_group(required=True)
+    years.add_argument('--year', type=parse_years)
+    years.add_argument('--years', type=parse_years)
+    parser.add_argument('--extract', required=False, default=SS_FILE)
 
-    out = joined[(joined['sud_word']) & (joined['_merge']=='left_only')]
+    args = parser.parse_args()
 
-    out[['submtg_state_cd','vld_val','vld_val_desc']].to_excel(SS_DIR(year) / OUT_FILE, index=False)
\ No newline at end of file
+    for year in (args.year or args.years):
+        flag_codes(year = year, extract_file = args.extract)
@@ -1,7 +1,9 @@
 import pandas as pd
 
 from ..tasks.data_transform import convert_fips
+from ..tasks.read_data import read_sas_cached, read_chunked_sums
 from ..tasks.small_cell_suppress import small_cell_suppress
+from ..tasks.planner import totals_node, state_node, joined_node, shared_node
 from common.utils.decorators import add_op_suffix
 from common.utils.params import FIPS_NAME_MAP
 
@@ -22,6 +24,13 @@ class BaseDataClass():
 
 
     """
+
+    # cols of totals df, step shared with other tables reading the same datasets to create init df (see plan_nodes),
+    # and whether class can stream input datasets in chunks (see read_sas_data)
+
+    tot_cols = ['pop_tot','pop_sud_tot']
+    shared_init = None
+    streams = False
     
     def __init__(self, year, sas_dir, totals_ds, table_type, workbook, use_sud_ds, dq_states_excl):
 
@@ -43,19 +52,106 @@ class BaseDataClass():
         self.prop_mult = 100
         self.suppress_second = False
         self.comparison_value = 'pct'
+        self.chunksize = None
+
+        # read in totals df to use in all with each creation of TableClass (prepped once for all tables using same totals, see planner)
+
+        self.totals_df = shared_node(totals_node(self.source(), self.tot_cols), lambda: self.prep_totals(tot_cols = self.tot_cols))
+
+    @classmethod
+    def plan_nodes(cls, config, *, source, chunksize=None):
+        """
+        Method plan_nodes to return steps (see planner) needed to prep table from given config entry, to share with other tables needing the same steps:
+            - totals df (all tables)
+            - main SAS ds with state names joined to totals (if shared_init is joined) or main SAS ds with state names (if shared_init is state),
+              only if the main SAS ds is read as is (no sas_ds_numer to join, no numer_col_any subsets, not streaming)
+
+        params:
+            config dict: config entry for table
+            source dict: source of datasets (see source)
+            chunksize int: optional chunksize table is run with, default is None
+
+        returns:
+            list of nodes
+
+        """
+
+        nodes = [totals_node(source, cls.tot_cols)]
+
+        if cls.shares_input(config.get('numer_col_any', []), chunksize) and ('sas_ds_numer' not in config):
+
+            state = state_node(source, config['sas_ds'])
+
+            if cls.shared_init == 'joined':
+                nodes.append(joined_node(state, totals_node(source, cls.tot_cols)))
+
+            elif cls.shared_init == 'state':
+                nodes.append(state)
+
+        return nodes
+
+    @classmethod
+    def shares_input(cls, numer_col_any, chunksize):
+        """
+        Method shares_input to return True if datasets read by class can be shared with other tables (not subset by numer_col_any or streamed in chunks)
+
+        """
+
+        return (not numer_col_any) and not (cls.streams and (chunksize is not None))
+
+    def source(self):
+        """
+        Method source to return dict of params identifying datasets read (SAS directory, year, table type, SUD only datasets, DQ states and totals ds)
 
-        # read in totals df to use in all with each creation of TableClass
+        """
+
+        return dict(sas_dir = self.sas_dir, year = self.year, table_type = self.table_type, use_sud_ds = self.use_sud_ds,
+                    dq_states = self.dq_states_excl, totals_ds = self.totals_ds)
+
+    def state_df(self, sas_ds):
+        """
+        Method state_df to read given SAS ds (see read_sas_data) and convert fips to state name, shared with other tables reading the same ds
+        if read as is (see shares_input and planner)
+
+        """
+
+        def read():
+            df = self.read_sas_data(filename = sas_ds)
+            df['state'] = convert_fips(df = df)
+            return df
+
+        return shared_node(state_node(self.source(), sas_ds) if self.shares_input(self.numer_col_any, self.chunksize) else None, read)
+
+    def joined_df(self, sas_ds):
+        """
+        Method joined_df to return given SAS ds with state names (see state_df) joined to totals, shared with other tables reading the same ds
+
+        """
 
-        self.totals_df = self.prep_totals(tot_cols = ['pop_tot','pop_sud_tot'])
+        state = state_node(self.source(), sas_ds) if self.shares_input(self.numer_col_any, self.chunksize) else None
+
+        return shared_node(joined_node(state, totals_node(self.source(), self.tot_cols)),
+                           lambda: self.state_df(sas_ds).merge(self.totals_df.drop(columns=['submtg_state_cd']), left_on='state', right_on='state', how='outer'))
 
     @add_op_suffix
-    def read_sas_data(self, filename=None, **kwargs):
+    def read_sas_data(self, filename=None, columns=None, **kwargs):
+
+        # if chunksize is set (streaming mode) and class sets stream_by (cols to sum counts by), stream dataset in chunks and
+        # drop DQ states and sum count to one rec per stream_by group as each chunk is read (with the number of recs summed in recs,
+        # so class can compute the same values as from the full dataset), otherwise read full (cached) dataset
+
+        if (self.chunksize is not None) & hasattr(self, 'stream_by'):
 
-        df = pd.read_sas(self.sas_dir / f"{filename}.sas7bdat", encoding = 'ISO-8859-1')
+            df = read_chunked_sums(sas_dir = self.sas_dir, filename = filename, chunksize = self.chunksize, by = self.stream_by, sum_cols = ['count'], recs_col = 'recs',
+                                   filters = [lambda chunk: ~chunk['submtg_state_cd'].isin(self.dq_states_excl)])
 
-        # drop any states identified as DQ exclude
+        else:
 
-        df = df.loc[~df['submtg_state_cd'].isin(self.dq_states_excl)]
+            df = read_sas_cached(sas_dir = self.sas_dir, filename = filename, year = self.year, columns = columns)
+
+            # drop any states identified as DQ exclude
+
+            df = df.loc[~df['submtg_state_cd'].isin(self.dq_states_excl)]
 
         if 'copies' in kwargs.keys():
 
@@ -79,7 +175,7 @@ class BaseDataClass():
         Rename totals to have _base suffix to avoid same named columns if joining to same ds
         """
         
-        df = self.read_sas_data(filename=self.totals_ds)[['submtg_state_cd'] + tot_cols]
+        df = self.read_sas_data(filename=self.totals_ds, columns=['submtg_state_cd'] + tot_cols)[['submtg_state_cd'] + tot_cols]
 
         df['state'] = convert_fips(df=df)
 
@@ -89,19 +185,23 @@ class BaseDataClass():
 
     def fill_dq_unusable(self, df):
         """
-        Method fill_dq_unusable to take input df, add rows for DQ unusable states if they do not exist, and fill with DQ
-        
+        Method fill_dq_unusable to take input df and add rows for DQ unusable states if they do not exist (values left as nan,
+        cells are given DQ status with build_status)
+
         """
 
-        # identify any states marked as DQ and create dummy df with one rec per state - merge on so the state recs are there if they were not before
+        # identify any states marked as DQ and create dummy df with one rec per state for any states not already on df
 
         dq_state_names_excl = [FIPS_NAME_MAP.get(state) for state in self.dq_states_excl]
 
-        df = df.merge(pd.DataFrame(data = dq_state_names_excl, columns = ['state']), left_on='state', right_on='state', how='outer')
-
-        df.loc[df['state'].isin(dq_state_names_excl)] = df.loc[df['state'].isin(dq_state_names_excl)].fillna('DQ')
+        missing = [state for state in dq_state_names_excl if state not in set(df['state'])]
 
-        return df
+        return pd.concat([df, pd.DataFrame(data = missing, columns = ['state'])], ignore_index=True)
 
+    def dq_rows(self, df):
+        """
+        Method dq_rows to return boolean series flagging rows of states excluded for DQ reasons
 
+        """
 
+        return df['state'].isin([FIPS_NAME_MAP.get(state) for state in self.dq_states_excl])
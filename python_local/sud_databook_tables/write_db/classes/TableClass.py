@@ -5,8 +5,10 @@ import numpy as np
 from .BaseDataClass import BaseDataClass
 from ..tasks.national_values import get_national_values
 from ..tasks.data_transform import convert_fips, create_stats, zero_fill_cond
-from ..tasks.small_cell_suppress import small_cell_suppress, suppress_match_numer
-from ..tasks.write_excel import read_template_col, write_sheet
+from ..tasks.small_cell_suppress import suppression_mask
+from ..tasks.write_excel import TemplateIndex, read_template_col, prepare_sheet, write_plan
+from ..tasks.predicates import config_predicates
+from common.utils.cell_status import build_status
 from common.utils.text_funcs import stat_list, create_text_list
 from common.utils.df_funcs import list_dup_cols
 from common.utils.params import STATE_LIST, FIPS_NAME_MAP
@@ -21,10 +23,13 @@ class TableClass(BaseDataClass):
         kwargs to use for TableClass to set all attributes (variable based on params passed in config)
 
     """
+
+    shared_init = 'joined'
     
     def __init__(self, *args, **kwargs):
         """
-        Initialize with BaseDataClass instance and pass args, create attributes from all passed kwargs
+        Initialize with BaseDataClass instance and pass args, create attributes from all passed kwargs,
+        and compile any row filters given in kwargs (subset and numer, see config_predicates)
 
         """
         super().__init__(*args)
@@ -32,6 +37,39 @@ class TableClass(BaseDataClass):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+        self.predicates = config_predicates(kwargs)
+
+    @classmethod
+    def required_columns(cls, config):
+        """
+        Method required_columns to return list of cols needed from input SAS datasets to create table from given config entry
+        (used to project reads to only needed cols). Lists every col named in the config entry that may come from an input dataset,
+        cols not on a given dataset are ignored at read
+
+        params:
+            config dict: config entry for table
+
+        returns:
+            list of col names
+
+        """
+
+        cols = ['submtg_state_cd']
+
+        for param in ['group_cols','numerators','denominators','big_denom','count_cols','numer_col_any']:
+            cols += config.get(param, [])
+
+        for param in ['numer_col','subset_col']:
+            if param in config:
+                cols.append(config[param])
+
+        # numer_col_any cols are subset and count col renamed at read
+
+        if config.get('numer_col_any'):
+            cols.append('count')
+
+        return list(dict.fromkeys(cols))
+
     def set_initial_attribs(self):
         """
         Method to set initial attributes using attribs assigned at init
@@ -72,13 +110,13 @@ class TableClass(BaseDataClass):
 
     def prep_for_tables(self):
         """
-        Method prep_for_tables to call class methods to create initial and prepped dfs, and pull sheet name from Excel template, and
+        Method prep_for_tables to call class methods to create initial and prepped dfs (with prepped status df), and pull sheet name from Excel template, and
         assign to class attributes
 
         """
 
         self.init_df = self.create_init_df()
-        self.prepped_df = self.create_prepped_df(df = self.init_df)
+        self.prepped_df, self.prepped_status = self.create_prepped_df(df = self.init_df)
 
         self.sheet_name = self.get_sheet_name()
 
@@ -89,21 +127,33 @@ class TableClass(BaseDataClass):
                 - If additional param sas_ds_numer (SAS dataset with only numerators) was passed, must read in and join to base, creating numerator flag
             - Convert fips to name
             - Join to totals
+
+        If there is no sas_ds_numer, the SAS ds converted and joined to totals is shared with other tables reading the same ds (see joined_df),
+        and main_copies are added after the join
             
         Returns:
             df to be assigned to init_df
         
         """
+
+        if not hasattr(self, 'sas_ds_numer'):
+
+            df = self.joined_df(self.sas_ds)
+
+            for copy, orig in self.main_copies.items():
+                df[copy] = df[orig]
+
+            return df
+
         df = self.read_sas_data(filename = self.sas_ds, copies = self.main_copies)
 
-        if hasattr(self, 'sas_ds_numer'):
-            for sas_ds in self.sas_ds_numer:
-                df = df.merge(self.read_sas_data(filename=sas_ds, copies=self.numer_copies),
-                     left_on=self.join_cols, right_on=self.join_cols, how='outer')
+        for sas_ds in self.sas_ds_numer:
+            df = df.merge(self.read_sas_data(filename=sas_ds, copies=self.numer_copies),
+                 left_on=self.join_cols, right_on=self.join_cols, how='outer')
 
-            # drop any dup columns (non-needed columns that joined on with multiple ds merges) - these cause concat to error
+        # drop any dup columns (non-needed columns that joined on with multiple ds merges) - these cause concat to error
 
-            df.drop(columns = list_dup_cols(df), inplace=True)
+        df.drop(columns = list_dup_cols(df), inplace=True)
 
         df['state'] = convert_fips(df = df)
 
@@ -115,34 +165,39 @@ class TableClass(BaseDataClass):
         Method create_prepped_df to do the following on input df to prep to write to tables:
             
             - Fill denominators and conditionally fill numerators with 0s (only fill numer with 0 if denom > 0)
-            - Apply small cell suppression to all counts (numerators and denominators separately)
-                - if have indiv_denoms, must then loop over each pair of num/denom and suppress num if denom is suppressed based on second lowest suppression
+            - Identify small cells to suppress in all counts (numerators and denominators separately), and set suppressed counts to nan
+                - if have indiv_denoms, must then suppress num if denom is suppressed based on second lowest suppression
             - Get national sum of all counts
             - Create percents, will be suppressed if numerator is already suppressed
-            - Fill any states excluded for DQ concerns with DQ
-            - Fill all nan values with period
+            - Add rows for any states excluded for DQ concerns
+            - Create status df to identify suppressed, DQ and missing cells (status strings are only set when writing to excel)
 
         params:
             df: df to prep
 
         Returns:
-            df to be assigned to prepped_df
+            tuple of numeric df to be assigned to prepped_df and status df to be assigned to prepped_status
         
         """
 
         df = zero_fill_cond(df = df, base_cols = self.denominators, cond_cols = self.numerators)
 
-        df = small_cell_suppress(df, self.numerators, self.denominators,
-                                 suppress_second = self.suppress_second, match_numer = self.indiv_denoms).reset_index(drop=True)
+        values, suppressed = suppression_mask(df, self.numerators, self.denominators, include_cols = self.count_cols,
+                                              suppress_second = self.suppress_second, match_numer = self.indiv_denoms)
+
+        df[values.columns] = values.mask(suppressed)
+        df = df.reset_index(drop=True)
 
         df = pd.concat([df, get_national_values(df = df, calc_cols = self.count_cols, op='sum').reset_index(drop=True)], ignore_index=True)
 
-        df = create_stats(df = df, numerators = self.numerators, denominators = self.denominators, prop_mult = self.prop_mult)
+        suppressed = suppressed.reset_index(drop=True).reindex(df.index, fill_value=False)
+
+        df = create_stats(df = df, numerators = self.numerators, denominators = self.denominators, prop_mult = self.prop_mult, suppressed = suppressed)
 
         if len(self.dq_states_excl) > 0:
             df = self.fill_dq_unusable(df = df)
 
-        return df.fillna('.').reset_index(drop=True)
+        return df, build_status(df, suppressed = suppressed.reindex(df.index, fill_value=False), dq_rows = self.dq_rows(df))
 
 
     def get_sheet_name(self):
@@ -159,30 +214,50 @@ class TableClass(BaseDataClass):
 
         """
 
+        # if reading from template index, look up sheet name kept by index
+
+        if isinstance(self.workbook, TemplateIndex):
+            return self.workbook.sheet_name(self.sheet_num)
+
         match = [name for name in self.workbook.sheetnames if name.startswith(self.sheet_num)]
 
         assert len(match)==1, f"ERROR: {len(match)} sheet names start with given sheet number ({self.sheet_num}), requires exactly 1 - FIX"
 
         return match[0]
 
-    def write_excel_sheet(self):
+    def excel_plan(self):
         """
-        Method write_excel_sheet to write self.prepped_df to excel sheet using state-order df extracted from sheet
+        Method excel_plan to create list of cells to write self.prepped_df to excel sheet using state-order df extracted from sheet,
+        with status of each cell given by self.prepped_status (workbook is only read, so can be TemplateIndex of workbook)
         params:
             self
 
         returns:
-            none
+            tuple of sheet name and list of (row, column, value, format class) tuples
         """
 
         order_df = read_template_col(workbook = self.workbook, sheet_name = self.sheet_name, state_list = STATE_LIST, strip_chars=['*'])
 
-        # join order_df to table df, assert all values of state in order_df
+        # join order_df to table df (keeping position of each rec in prepped_df to pull matching status), assert all values of state in order_df
 
-        to_table = self.prepped_df.merge(order_df, left_on='state', right_on='state', how='outer', indicator = '_merged')
+        to_table = self.prepped_df.rename_axis('_pos').reset_index().merge(order_df, left_on='state', right_on='state', how='outer', indicator = '_merged')
 
         assert set(to_table['_merged']) == set(['both']), f"ERROR: Values of state not on both table and template {self.sheet_name} - FIX"
 
-        # write to sheet
+        status = self.prepped_status.iloc[to_table['_pos']].set_axis(to_table.index)
+
+        return self.sheet_name, prepare_sheet(df = to_table, cols = self.excel_cols, scol=self.scol, row_col = 'rownum', status = status)
+
+    def write_excel_sheet(self):
+        """
+        Method write_excel_sheet to write self.prepped_df to excel sheet (see excel_plan)
+        params:
+            self
+
+        returns:
+            none
+        """
+
+        sheet_name, plan = self.excel_plan()
 
-        write_sheet(workbook = self.workbook, df = to_table, sheet_name = self.sheet_name, cols = self.excel_cols, scol=self.scol, row_col = 'rownum')
+        write_plan(workbook = self.workbook, sheet_name = sheet_name, plan = plan)
@@ -1,7 +1,8 @@
 import pandas as pd
 
 from .TableClass import TableClass
-from common.utils.calc_comparisons import calc_comparisons
+from common.utils.calc_comparisons import calc_comparisons_years
+from common.utils.cell_status import MISSING
 
 class TableClassCompYears(TableClass):
     """
@@ -10,17 +11,19 @@ class TableClassCompYears(TableClass):
 
     """
     
-    def __init__(self, _tableclass, prepped_df_p, workbook):
+    def __init__(self, _tableclass, prepped_df_p, prepped_status_p, workbook):
         """
         Initialize with params:
             _tableclass instance of TableClass: current year TableClass instance
             prepped_df_p df: prior year prepped df
+            prepped_status_p df: prior year prepped status df
             workbook excel obj: template to write to
 
         """
 
         self._tableclass = _tableclass
         self.prepped_df_p = prepped_df_p
+        self.prepped_status_p = prepped_status_p
         self.workbook = workbook
         self.sheet_name = _tableclass.sheet_num
         
@@ -57,11 +60,12 @@ class TableClassCompYears(TableClass):
 
     def prep_for_tables(self):
         """
-        Method prep_for_tables to create prepped df (comparisons dfs)
+        Method prep_for_tables to create prepped df and status df (comparisons dfs), comparing current year to prior year (see calc_comparisons_years)
 
         """
 
         keep_cols = ['state'] + self.comp_cols
 
-        self.prepped_df = calc_comparisons(data1 = self._tableclass.prepped_df[keep_cols], data2 = self.prepped_df_p[keep_cols], 
-                                           join_on = 'state', diff_types = 'both', join_suffixes = ('_cy','_py'), fill_na='.')
\ No newline at end of file
+        self.prepped_df, self.prepped_status = calc_comparisons_years(datas = [self._tableclass.prepped_df[keep_cols], self.prepped_df_p[keep_cols]],
+                                                                      statuses = [self._tableclass.prepped_status[keep_cols], self.prepped_status_p[keep_cols]],
+                                                                      join_on = 'state', suffixes = ['_cy','_py'], diff_types = 'both', fill_status = MISSING)
\ No newline at end of file
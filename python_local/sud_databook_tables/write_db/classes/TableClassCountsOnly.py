@@ -2,8 +2,8 @@
 import pandas as pd
 
 from .TableClass import TableClass
-from ..tasks.data_transform import convert_fips
 from ..tasks.national_values import get_national_values
+from common.utils.cell_status import build_status
 
 
 class TableClassCountsOnly(TableClass):
@@ -12,6 +12,8 @@ class TableClassCountsOnly(TableClass):
 
     """
 
+    shared_init = 'state'
+
     def set_initial_attribs(self):
 
         """
@@ -27,7 +29,7 @@ class TableClassCountsOnly(TableClass):
 
         """
 
-        self.prepped_df = self.create_prepped_df() 
+        self.prepped_df, self.prepped_status = self.create_prepped_df()
 
         self.sheet_name = self.get_sheet_name()
 
@@ -41,21 +43,22 @@ class TableClassCountsOnly(TableClass):
             - Convert fips to name
             - Convert counts to set > 0 to 1, otherwise 0
             - Sum to get first total row
+            - Add rows for any states excluded for DQ concerns and create status df
 
         Returns:
-            df to be assigned to table_df
+            tuple of df to be assigned to prepped_df and status df to be assigned to prepped_status
         
         """
 
-        df = self.read_sas_data(filename=self.sas_ds)
-
-        df['state'] = convert_fips(df = df)
+        df = self.state_df(self.sas_ds)
 
-        df[self.count_cols] = df[self.count_cols].applymap(lambda x: 1 if x > 0 else 0)
+        df[self.count_cols] = (df[self.count_cols] > 0).astype(int)
 
         df = pd.concat([df, get_national_values(df = df, calc_cols = self.count_cols, op='sum', state_name='Total number of states').reset_index(drop=True)], ignore_index=True)
 
         if len(self.dq_states_excl) > 0:
             df = self.fill_dq_unusable(df = df)
 
-        return df.reset_index(drop=True)
\ No newline at end of file
+        df = df.reset_index(drop=True)
+
+        return df, build_status(df, dq_rows = self.dq_rows(df))
\ No newline at end of file
@@ -3,8 +3,11 @@ import pandas as pd
 from .TableClass import TableClass
 from ..tasks.data_transform import convert_fips, zero_fill_cond, create_stats
 from ..tasks.national_values import get_national_values
-from ..tasks.small_cell_suppress import small_cell_suppress
+from ..tasks.small_cell_suppress import suppression_mask
+from ..tasks.read_data import read_sas_cached, iter_dataset_chunks, add_group_sums
 from common.utils.decorators import add_op_suffix
+from common.utils.cell_status import build_status
+from common.utils.timing import timed_stage
 
 
 class TableClassDuals(TableClass):
@@ -13,6 +16,17 @@ class TableClassDuals(TableClass):
 
     """
 
+    shared_init = None
+
+    @classmethod
+    def required_columns(cls, config):
+        """
+        Method required_columns to add to parent class method the count col summed and renamed to count_cols at read
+
+        """
+
+        return super().required_columns(config) + ['count']
+
     def set_initial_attribs(self):
 
         """
@@ -24,6 +38,7 @@ class TableClassDuals(TableClass):
 
         self.group_cols = ['submtg_state_cd']
 
+    @timed_stage('read')
     @add_op_suffix
     def read_sas_duals(self, filename):
         """
@@ -33,17 +48,33 @@ class TableClassDuals(TableClass):
             - Get total and join back on to get total dual count (first col given in self.count_cols)
             - subset to numer population (SUD only) and rename count to name of second col given in self.count_cols
 
+        The subset filter is pushed down into the read (see predicates), so only dual recs are read.
+        If chunksize is set (streaming mode), dataset is read in chunks and the DQ filter, sums of count by group_cols and the numer subset are
+        applied to each chunk, returning the numer population recs with the total of their group (as from the full dataset)
+
         """
 
-        df = pd.read_sas(self.sas_dir / f"{filename}.sas7bdat", encoding = 'ISO-8859-1')
-        df = df.loc[~df['submtg_state_cd'].isin(self.dq_states_excl)]
+        if self.chunksize is not None:
 
-        df = df.loc[eval(f"df.{self.subset_col} {self.subset_value}")]
+            totals, numers = None, []
+
+            for df in iter_dataset_chunks(sas_dir = self.sas_dir, filename = filename, chunksize = self.chunksize, predicates = [self.predicates['subset']]):
+
+                df = df.loc[~df['submtg_state_cd'].isin(self.dq_states_excl)]
+
+                totals = add_group_sums(totals, df, self.group_cols, ['count'])
+                numers.append(df.loc[self.predicates['numer'].mask(df), self.group_cols + ['count']])
+
+            return pd.concat(numers, ignore_index=True).rename(columns = {'count' : self.count_cols[1]}).merge(totals.rename(columns = {'count' : self.count_cols[0]}),
+                                                                                                               left_on = self.group_cols, right_index = True, how = 'left')
+
+        df = read_sas_cached(sas_dir = self.sas_dir, filename = filename, year = self.year, predicates = [self.predicates['subset']])
+        df = df.loc[~df['submtg_state_cd'].isin(self.dq_states_excl)]
 
         grouped = df.groupby(self.group_cols)
         df[self.count_cols[0]] = grouped['count'].transform(sum)
 
-        return df.loc[eval(f"df.{self.numer_col} {self.numer_value}")].rename(columns = {'count' : self.count_cols[1]})
+        return df.loc[self.predicates['numer'].mask(df)].rename(columns = {'count' : self.count_cols[1]})
 
     def prep_for_tables(self):
         """
@@ -51,7 +82,7 @@ class TableClassDuals(TableClass):
 
         """
 
-        self.prepped_df = self.create_prepped_df() 
+        self.prepped_df, self.prepped_status = self.create_prepped_df()
 
         self.sheet_name = self.get_sheet_name()
 
@@ -64,13 +95,14 @@ class TableClassDuals(TableClass):
             - Convert fips to name
             - Join to totals
             - Fill denominators and conditionally fill numerators with 0s (only fill numer with 0 if denom > 0)
-            - Apply small cell suppression to all counts
+            - Identify small cells to suppress in all counts, and set suppressed counts to nan
             - Get national sum of all counts
             - Create percents, will be suppressed if numerator is already suppressed
-            - Fill all nan values with period
+            - Add rows for any states excluded for DQ concerns
+            - Create status df to identify suppressed, DQ and missing cells
 
         Returns:
-            df to be assigned to table_df
+            tuple of numeric df to be assigned to prepped_df and status df to be assigned to prepped_status
         
         """
 
@@ -82,14 +114,19 @@ class TableClassDuals(TableClass):
 
         df = zero_fill_cond(df = df, base_cols = [self.count_cols[0]], cond_cols = [self.count_cols[1]])
 
-        df = small_cell_suppress(df, self.count_cols).reset_index(drop=True)
+        values, suppressed = suppression_mask(df, self.count_cols, include_cols = self.big_denom)
+
+        df[values.columns] = values.mask(suppressed)
+        df = df.reset_index(drop=True)
 
         df = pd.concat([df, get_national_values(df = df, calc_cols = self.count_cols + self.big_denom, op='sum').reset_index(drop=True)], ignore_index=True)
 
+        suppressed = suppressed.reset_index(drop=True).reindex(df.index, fill_value=False)
+
         df = create_stats(df = df, numerators = [self.numerator] * len(self.denominators), denominators = self.denominators, 
-                          prop_mult = self.prop_mult, stat_name_use=1)
+                          prop_mult = self.prop_mult, stat_name_use=1, suppressed = suppressed)
 
         if len(self.dq_states_excl) > 0:
             df = self.fill_dq_unusable(df = df)
 
-        return df.fillna('.').reset_index(drop=True)
\ No newline at end of file
+        return df, build_status(df, suppressed = suppressed.reindex(df.index, fill_value=False), dq_rows = self.dq_rows(df))
\ No newline at end of file
@@ -2,8 +2,10 @@ import pandas as pd
 import numpy as np
 
 from .TableClass import TableClass
-from common.utils.calc_comparisons import calc_comparisons
-from common.utils.stats import two_proportions_confint, two_proportions_test, p_adjust_bh, format_p
+from common.utils.calc_comparisons import calc_comparisons_status
+from common.utils.stats import two_proportions_confints, two_proportions_tests, p_adjust, format_pvalues, format_confints
+from common.utils.cell_status import VALUE, SUPPRESSED, MISSING, NOT_APPLICABLE
+from common.utils.timing import timed_stage
 
 class TableClassG(TableClass):
     """
@@ -11,12 +13,18 @@ class TableClassG(TableClass):
     Must be initialized with current and prior year prepped dfs to write specific numbers for both years and comparisons to given G table
 
     """
+
+    # correction for multiple testing applied to pvalues of all states in sheet (see p_adjust)
+
+    p_adjust_method = 'bh'
     
-    def __init__(self, prepped_df, prepped_df_p, workbook, sheet_num, write_cols):
+    def __init__(self, prepped_df, prepped_status, prepped_df_p, prepped_status_p, workbook, sheet_num, write_cols):
         """
         Initialize with params:
             prepped_df df: current year prepped df
+            prepped_status df: current year prepped status df
             prepped_df_p df: prior year prepped df
+            prepped_status_p df: prior year prepped status df
             workbook excel obj: template to write to
             sheet_num str: sheet number from G tables to write to
             write_cols list: list of cols to write both years to table, assumes first col will NOT have diff calculated
@@ -24,7 +32,9 @@ class TableClassG(TableClass):
         """
 
         self.prepped_df = prepped_df
+        self.prepped_status = prepped_status
         self.prepped_df_p = prepped_df_p
+        self.prepped_status_p = prepped_status_p
         self.workbook = workbook
         self.sheet_num = sheet_num
         self.base_cols, self.comp_cols = [write_cols.pop(0)], write_cols
@@ -38,9 +48,11 @@ class TableClassG(TableClass):
 
         self.prep_for_tables()
 
+    @timed_stage('stats')
     def get_stats(self):
         """
-        Method get_stats to run tests on proportions to get confidence interval and pvalue and add cols to prepped_df
+        Method get_stats to run tests on proportions to get confidence interval and pvalue and add cols to prepped_df (and their status to prepped_status)
+        Stats are only run for recs with all four input values available (not suppressed/DQ/missing) and non-zero sizes, all other recs are suppressed
 
         """
 
@@ -48,36 +60,42 @@ class TableClassG(TableClass):
 
         stats_cols = [self.excel_cols[2], self.excel_cols[0], self.excel_cols[3], self.excel_cols[1]]
 
-        # get pvalues (must get individual pvalues then apply correction for multiple testing) and reformat
+        values = self.prepped_df_pre[stats_cols].to_numpy(dtype=float)
+
+        valid = (self.prepped_status_pre[stats_cols].to_numpy() == VALUE).all(axis=1) & (values[:, 1] != 0) & (values[:, 3] != 0)
+
+        # get pvalues for all states at once (must get individual pvalues then apply correction for multiple testing) and reformat
 
-        pvalues = p_adjust_bh(self.prepped_df_pre[stats_cols].apply(lambda x: two_proportions_test(*x, default_exception='DS'), axis=1))
+        pvalues = np.where(valid, two_proportions_tests(*values.T).filled(np.nan), np.nan)
 
-        self.prepped_df_pre['pval'] = pd.Series(pvalues).apply(lambda x: format_p(x))
+        self.prepped_df_pre['pval'] = format_pvalues(p_adjust(pvalues, method = self.p_adjust_method))
 
-        # get CI (returned as series of lists) and reformat to be in format of (0.00, 0.00)
+        # get CI for all states at once and reformat to be in format of (0.00, 0.00)
 
-        confint = self.prepped_df_pre[stats_cols].apply(lambda x: two_proportions_confint(*x, default_exception='DS'), axis=1)
+        self.prepped_df_pre['ci'] = np.where(valid, format_confints(two_proportions_confints(*values.T)), np.nan)
 
-        self.prepped_df_pre['ci'] = confint.apply(lambda x: f'({"{:0.2f}".format(x[0]*100)}, {"{:0.2f}".format(x[1]*100)})' if type(x) == list else x)
+        # set status: suppressed if stats could not be run, missing if pvalue could not be calculated,
+        # and add specific hard coding if both numerators == 0: will set CI and pval to NA
 
-        # add specific hard coding if both numerators == 0: will set CI and pval to NA
+        status = np.select([(values[:, 0] == 0) & (values[:, 2] == 0), ~valid, np.isnan(pvalues)], [NOT_APPLICABLE, SUPPRESSED, MISSING], VALUE).astype('int8')
 
-        self.prepped_df_pre.loc[(self.prepped_df_pre[stats_cols[0]]==0) & (self.prepped_df_pre[stats_cols[2]]==0), ['pval','ci']]='NA'
+        self.prepped_status_pre['pval'], self.prepped_status_pre['ci'] = status, status
 
-        return self.prepped_df_pre
+        return self.prepped_df_pre, self.prepped_status_pre
 
     def prep_for_tables(self):
         """
-        Method prep_for_tables to create prepped df (comparisons and stat tests), pull sheet name from Excel template, and
+        Method prep_for_tables to create prepped df and status df (comparisons and stat tests), pull sheet name from Excel template, and
         assign to class attributes
 
         """
 
         keep_cols = ['state'] + self.base_cols + self.comp_cols
 
-        self.prepped_df_pre = calc_comparisons(data1 = self.prepped_df[keep_cols], data2 = self.prepped_df_p[keep_cols], 
-                                               join_on = 'state', diff_types = 'raw', join_suffixes = ('_cy','_py'), fill_na='DS')
+        self.prepped_df_pre, self.prepped_status_pre = calc_comparisons_status(data1 = self.prepped_df[keep_cols], status1 = self.prepped_status[keep_cols],
+                                                                               data2 = self.prepped_df_p[keep_cols], status2 = self.prepped_status_p[keep_cols],
+                                                                               join_on = 'state', diff_types = 'raw', join_suffixes = ('_cy','_py'), fill_status = SUPPRESSED)
 
-        self.prepped_df = self.get_stats()
+        self.prepped_df, self.prepped_status = self.get_stats()
 
-        self.sheet_name = self.get_sheet_name()
\ No newline at end of file
+        self.sheet_name = self.get_sheet_name()
@@ -5,6 +5,7 @@ from ..tasks.data_transform import convert_fips, zero_fill_cond, create_stats
 from ..tasks.national_values import get_national_values
 from ..tasks.small_cell_suppress import small_cell_suppress
 from common.utils.text_funcs import list_mapper, underscore_join
+from common.utils.timing import timed_stage
 
 class TableClassWideTransform(TableClass):
     """
@@ -12,6 +13,17 @@ class TableClassWideTransform(TableClass):
 
     """
 
+    streams = True
+
+    @classmethod
+    def required_columns(cls, config):
+        """
+        Method required_columns to add to parent class method the cols copied to numer and denom before transpose
+
+        """
+
+        return list(dict.fromkeys(super().required_columns(config) + [config[param] for param in ['numer','denom'] if param in config]))
+
     def set_initial_attribs(self):
 
         """
@@ -24,6 +36,11 @@ class TableClassWideTransform(TableClass):
 
         self.index_cols = ['state'] + self.big_denom
 
+        # in streaming mode, input datasets are summed to one rec per join_cols (and numer_col if given) as they are read,
+        # with the number of recs summed (see read_sas_data and wide_transform)
+
+        self.stream_by = self.join_cols + ([self.numer_col] if hasattr(self, 'numer_col') else [])
+
         if hasattr(self, 'sas_ds_numer'):
             self.main_copies = {k : v for k,v in self.__dict__.items() if k  == 'denom'}
             self.numer_copies = {k : v for k,v in self.__dict__.items() if k  == 'numer'}
@@ -37,6 +54,20 @@ class TableClassWideTransform(TableClass):
                 self.main_copies.pop('denom', None)
                 self.values_transpose.remove('denom')
     
+    def read_sas_data(self, filename=None, columns=None, **kwargs):
+        """
+        Method read_sas_data to add to parent class method: in streaming mode, the number of recs summed in each rec of numerator datasets (sas_ds_numer)
+        is renamed to numer_recs, so it is kept apart from the recs of the main dataset when joined
+
+        """
+
+        df = super().read_sas_data(filename = filename, columns = columns, **kwargs)
+
+        if (self.chunksize is not None) and (filename in getattr(self, 'sas_ds_numer', [])):
+            df = df.rename(columns = {'recs' : 'numer_recs'})
+
+        return df
+
     def prep_for_tables(self):
         """
         Method prep_for_tables to override parent class method to add transform from long to wide between init and prep dfs
@@ -45,10 +76,11 @@ class TableClassWideTransform(TableClass):
 
         self.init_df_long = self.create_init_df()
         self.init_df = self.wide_transform(df = self.init_df_long)
-        self.prepped_df = self.create_prepped_df(df = self.init_df) 
+        self.prepped_df, self.prepped_status = self.create_prepped_df(df = self.init_df)
 
         self.sheet_name = self.get_sheet_name()
 
+    @timed_stage('transform')
     def wide_transform(self, df):
         """
         Function wide_transform to take input df from wide to long
@@ -60,6 +92,14 @@ class TableClassWideTransform(TableClass):
 
         """
 
+        # in streaming mode, each rec holds the sums of count over recs of the full dataset (see read_sas_data), so weight each rec by the
+        # recs of the full df it stands for, so the steps below give the same values as for the full df
+
+        streamed = self.chunksize is not None
+
+        if streamed:
+            df = self.weight_streamed_recs(df)
+
         # if have individual denoms, get totals across index_cols and group_cols - assume must sum and join back on
 
         if self.indiv_denoms == True:
@@ -74,9 +114,21 @@ class TableClassWideTransform(TableClass):
             join_cols = self.index_cols + self.group_cols
 
             base_df = df[join_cols + [col for col in self.values_transpose if col != 'numer']].drop_duplicates()
-            num_df = df.loc[eval(f"df.{self.numer_col} {self.numer_value}")]
+            num_df = df.loc[self.predicates['numer'].mask(df)]
 
-            df = base_df.merge(num_df[self.index_cols + self.group_cols + ['numer']], left_on=join_cols, right_on=join_cols, how='left').fillna(0)
+            df = base_df.merge(num_df[self.index_cols + self.group_cols + ['numer'] + (['recs'] if streamed else [])], left_on=join_cols, right_on=join_cols, how='left')
+
+            # groups with no numerator recs stand for one rec of the full df (base rec joined to nothing)
+
+            if streamed:
+                df['recs'] = df['recs'].fillna(1)
+
+            df = df.fillna(0)
+
+        # in streaming mode, take the mean of numer over the recs of the full df, as pivot_table does for the full df
+
+        if streamed:
+            df = self.mean_streamed_recs(df)
 
         wide = df.pivot_table(index=self.index_cols, columns=self.group_cols, values=self.values_transpose)
 
@@ -84,4 +136,53 @@ class TableClassWideTransform(TableClass):
 
         wide.columns = list_mapper(underscore_join, wide.columns)
         
-        return wide.reset_index()
\ No newline at end of file
+        return wide.reset_index()
+
+    def weight_streamed_recs(self, df):
+        """
+        Method weight_streamed_recs to set recs (streaming mode) to the number of recs of the full df each streamed rec stands for, with numer and
+        denom set to their sums over those recs:
+            - without sas_ds_numer, each rec stands for the recs of the main dataset summed in it
+            - with sas_ds_numer, each rec stands for every pair of recs of the main and numerator datasets joined on join_cols (see create_init_df),
+              so stands for main recs times numerator recs (1 for a dataset with no recs in the group, as with an outer join)
+
+        params:
+            df: streamed df (see read_sas_data) with main_copies and numer_copies
+
+        returns:
+            df: df with recs and weighted numer and denom
+
+        """
+
+        if hasattr(self, 'sas_ds_numer'):
+
+            main_recs, numer_recs = df['recs'].fillna(1), df['numer_recs'].fillna(1)
+
+            df['numer'] = df['numer'] * main_recs
+            df['denom'] = df['denom'] * numer_recs
+            df['recs'] = main_recs * numer_recs
+
+        return df
+
+    def mean_streamed_recs(self, df):
+        """
+        Method mean_streamed_recs to reduce weighted df (streaming mode, see weight_streamed_recs) to one rec per index_cols and group_cols, with numer
+        the mean over the recs of the full df with a numer (sum of numer over sum of recs) and all other values_transpose cols (the same for every rec
+        of a group) the mean
+
+        params:
+            df: weighted df
+
+        returns:
+            df: one rec per index_cols and group_cols
+
+        """
+
+        df['recs'] = df['recs'].where(df['numer'].notna())
+
+        grouped = df.groupby(self.index_cols + self.group_cols)
+
+        means = grouped[[col for col in self.values_transpose if col != 'numer']].mean()
+        means['numer'] = grouped['numer'].sum(min_count=1) / grouped['recs'].sum()
+
+        return means.reset_index()
@@ -3,13 +3,114 @@ cli script to run write_db_tables from command line
 """
 
 import os
+import json
 import argparse
+import traceback
 import openpyxl as xl
 from pathlib import Path
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from common.utils.params import SPECDIR, SHELL, SHELL_OUD, OUTDIR, OUTFILE, OUTFILE_OUD, SHELL_PYEAR, OUTFILE_PYEAR
-from common.utils.general_funcs import variable_matcher, variable_constructor, read_config, get_current_path
-from .gen_tables import gen_tables
+import pandas as pd
+
+from common.utils.params import SPECDIR, SASDIR, SHELL, SHELL_OUD, OUTDIR, OUTFILE, OUTFILE_OUD, SHELL_PYEAR, OUTFILE_PYEAR, FINGERPRINTS, TEMPLATE_CACHEDIR, \
+                                LOGDIR, DATE_NOW, PROFILE_LOG
+from common.utils.general_funcs import variable_matcher, variable_constructor, read_config, get_current_path, generate_logger, print_to_log
+from common.utils.timing import STAGE_STATS, METRICS, enable_profiling, clear_stage_stats, table_timer, stage_timer, stats_records
+from .gen_tables import gen_tables, table_fingerprints, plan_shared_work
+from .tasks.read_data import CACHE_STATS, ingest_sas_dir
+from .tasks.incremental import read_fingerprints, write_fingerprints, plan_rebuild
+from .tasks.template_cache import load_template
+from .tasks.planner import NODE_STATS, release_tables
+
+def save_workbook(workbook, outfile, table):
+    """
+    Function save_workbook to save workbook to outfile, timed as save stage of given table (see stage_timer)
+
+    """
+
+    with table_timer(table), stage_timer('save'):
+        workbook.save(outfile)
+
+def run_pipeline(*, shells, outfiles, fingerprints_path=None, template_cache_dir=None, profile=None, **kwargs):
+    """
+    Function run_pipeline to open shells (from template cache if given), call gen_tables to write all tables for one table type and save, saving all workbooks at once.
+    Run in worker process for each table type in concurrent mode, so each pipeline has its own workbooks
+
+    If fingerprints_path is given (incremental run), each table is fingerprinted (see table_fingerprints) and only tables with a fingerprint
+    different from the previous run are rebuilt and written to the previous output workbooks (see plan_rebuild), then fingerprints are recorded
+
+    params:
+        shells dict: path to shell for each workbook arg to gen_tables (workbook, and workbook_pyear if pyr_comp)
+        outfiles dict: path to save each workbook to, same keys as shells
+        fingerprints_path Path: optional path to fingerprints file for incremental run, default is None (build all tables)
+        template_cache_dir Path: optional directory of cached templates (see load_template), default is None (parse shells)
+        profile dict: optional args to enable_profiling (memory, dump_dir) to record metrics of each stage of each table, default is None (no profiling)
+        kwargs: all other args to pass to gen_tables
+
+    returns:
+        dict: (outfile, exception or None) for each workbook, SAS dataset cache stats for pipeline (cache_stats),
+            steps shared between tables computed and reused (shared_steps, see planner),
+            and for incremental runs, tables reused and reasons for each table rebuilt (tables)
+            and if profiling, stage stats of each table and saved workbook (profile)
+
+    """
+
+    cache_start, steps_start = dict(CACHE_STATS), dict(NODE_STATS)
+    report = {}
+
+    if profile is not None:
+        enable_profiling(**profile)
+        clear_stage_stats()
+
+    # load each shell with index of its sheets, prepping tables from the index and writing to the workbook
+
+    workbooks, templates = {}, {}
+
+    for key, shell in shells.items():
+        workbooks[key], templates[key] = load_template(shell, cache_dir = template_cache_dir)
+
+    if fingerprints_path is not None:
+
+        fingerprints = table_fingerprints(template_hashes = {key : template.hashes for key, template in templates.items()},
+                                          **{key : value for key, value in kwargs.items() if key in ['year','table_details','config_sheet_num','table_type','pyr_comp','g_table_details','sas_root']})
+
+        previous = read_fingerprints(fingerprints_path)
+
+        patch, rebuild = plan_rebuild(previous, fingerprints, list(shells))
+
+        # patch previous output workbooks if possible, only running tables to rebuild
+
+        if patch:
+            workbooks = {key : xl.load_workbook(previous['outfiles'][key]) for key in shells}
+
+        kwargs = dict(kwargs, table_details = {table : details for table, details in kwargs['table_details'].items() if table in rebuild})
+
+        # release tables not rebuilt from any steps planned for the whole run, so steps they share are not kept
+
+        release_tables([f"{kwargs['table_type']}/{table}" for table in fingerprints if table not in rebuild])
+
+        report['tables'] = {'reused' : [table for table in fingerprints if table not in rebuild], 'rebuilt' : rebuild}
+
+    gen_tables(**workbooks, **kwargs, templates = templates)
+
+    with ThreadPoolExecutor(max_workers = len(workbooks)) as pool:
+        saves = {key : pool.submit(save_workbook, workbook, outfiles[key], f"{kwargs['table_type']}/{key}") for key, workbook in workbooks.items()}
+
+    # only record fingerprints if all workbooks saved, so next run patches complete output
+
+    if (fingerprints_path is not None) and all(save.exception() is None for save in saves.values()):
+        write_fingerprints(fingerprints_path, outfiles, fingerprints)
+
+    report.update({key : (outfiles[key], save.exception()) for key, save in saves.items()})
+    report['cache_stats'] = {stat : CACHE_STATS[stat] - cache_start[stat] for stat in CACHE_STATS}
+    report['shared_steps'] = {stat : NODE_STATS[stat] - steps_start[stat] for stat in NODE_STATS}
+
+    if profile is not None:
+        report['profile'] = {table : stages for table, stages in STAGE_STATS.items() if (table or '').startswith(f"{kwargs['table_type']}/")}
+
+    return report
 
 def main(args=None):
     
@@ -20,12 +121,20 @@ def main(args=None):
 
     parser.add_argument('--year', required=True)
     parser.add_argument('--pyr_comp', required=False, default=True)
+    parser.add_argument('--chunksize', required=False, type=int, default=None)
+    parser.add_argument('--jobs', required=False, type=int, default=None)
+    parser.add_argument('--concurrent', required=False, action='store_true')
+    parser.add_argument('--no_store', required=False, action='store_true')
+    parser.add_argument('--incremental', required=False, action='store_true')
+    parser.add_argument('--profile', required=False, action='store_true')
+    parser.add_argument('--profile_dump', required=False, action='store_true')
 
     # extract arguments from parser
 
     args = parser.parse_args()
     
-    YEAR, PYR_COMP = args.year, args.pyr_comp
+    YEAR, PYR_COMP, CHUNKSIZE, JOBS, CONCURRENT, USE_STORE, INCREMENTAL = args.year, args.pyr_comp, args.chunksize, args.jobs, args.concurrent, not args.no_store, args.incremental
+    PROFILE, PROFILE_DUMP = args.profile or args.profile_dump, args.profile_dump
 
     # read in measures config file to get dictionary with details to run each main table and G tables mapping (prior year comp tables)
 
@@ -33,25 +142,110 @@ def main(args=None):
 
     table_details, g_table_details = CONFIG['TABLE_MAPPINGS'], CONFIG['G_TABLE_MAPPINGS']
 
-    # open shells (regular and OP/OUD, comp if requested)
+    # convert any new or changed SAS datasets to columnar copies (current and prior year if requested) - unchanged datasets are skipped
+
+    for year in [YEAR, int(YEAR)-1] if PYR_COMP else [YEAR]:
+        converted = ingest_sas_dir(SASDIR(year))
+        print(f"{year} SAS datasets converted to columnar: {len(converted)}")
+
+    # create params to run SUD (with comp if requested) and OUD pipelines, each opening, writing and saving its own workbooks
+    # if incremental, give each pipeline fingerprints file to patch previous output
+
+    sud_books = ['workbook', 'workbook_pyear'] if PYR_COMP else ['workbook']
+
+    shells = {'workbook' : SPECDIR(YEAR) / SHELL, 'workbook_pyear' : SPECDIR(YEAR) / SHELL_PYEAR}
+    outfiles = {'workbook' : OUTDIR(YEAR) / OUTFILE(YEAR), 'workbook_pyear' : OUTDIR(YEAR) / OUTFILE_PYEAR(YEAR)}
+
+    pipelines = {'SUD' : dict(shells = {key : shells[key] for key in sud_books}, outfiles = {key : outfiles[key] for key in sud_books},
+                              year = YEAR, table_details = table_details, config_sheet_num='sheet_num_sud', table_type='SUD', pyr_comp = PYR_COMP,
+                              g_table_details=g_table_details, chunksize = CHUNKSIZE, jobs = JOBS, use_store = USE_STORE),
+                 'OUD' : dict(shells = {'workbook' : SPECDIR(YEAR) / SHELL_OUD}, outfiles = {'workbook' : OUTDIR(YEAR) / OUTFILE_OUD(YEAR)},
+                              year = YEAR, table_details = table_details, config_sheet_num='sheet_num_op', table_type='OUD', pyr_comp = False,
+                              chunksize = CHUNKSIZE, jobs = JOBS, use_store = USE_STORE)}
+
+    if INCREMENTAL:
+        for table_type, params in pipelines.items():
+            params['fingerprints_path'] = OUTDIR(YEAR) / FINGERPRINTS(table_type)
+
+    for params in pipelines.values():
+        params['template_cache_dir'] = TEMPLATE_CACHEDIR(YEAR)
+
+    # if profiling, record metrics of each stage of each table (with cProfile stats of each table dumped to log dir if requested)
+
+    if PROFILE:
+        for params in pipelines.values():
+            params['profile'] = {'memory' : True, 'dump_dir' : LOGDIR(YEAR) / f"profiles_{DATE_NOW}" if PROFILE_DUMP else None}
+
+    # if running pipelines in turn, plan steps shared between tables for both pipelines before running either, so steps shared by SUD and OUD tables
+    # (e.g. datasets in use_sud_ds) are only computed once (each pipeline also plans its own tables, see gen_tables)
+
+    if not CONCURRENT:
+        for params in pipelines.values():
+            plan_shared_work(**{key : params[key] for key in ['year','table_details','config_sheet_num','table_type','pyr_comp','chunksize']})
+
+    # if concurrent, run pipelines in separate worker processes, otherwise run each in turn
+    # report outcome for each workbook (a failure in one pipeline does not stop the other pipeline from saving)
+
+    with ProcessPoolExecutor(max_workers = 2) if CONCURRENT else nullcontext() as pool:
+
+        if CONCURRENT:
+            results = {table_type : pool.submit(run_pipeline, **params).result for table_type, params in pipelines.items()}
+        else:
+            results = {table_type : partial(run_pipeline, **params) for table_type, params in pipelines.items()}
+
+        failed = False
+        profiles = []
+
+        for table_type, result in results.items():
+
+            try:
+                report = result()
+
+            except Exception as err:
+                failed = True
+                print(f"{table_type} tables FAILED, no workbooks saved: {err!r}")
+                traceback.print_exception(type(err), err, err.__traceback__)
+                continue
+
+            cache_stats, shared_steps, tables = report.pop('cache_stats'), report.pop('shared_steps'), report.pop('tables', None)
+
+            profiles += stats_records(report.pop('profile', {}), year = YEAR)
+
+            if tables is not None:
+                print(f"{table_type} tables reused from previous output: {len(tables['reused'])}, rebuilt: {len(tables['rebuilt'])}")
+                for table, reasons in tables['rebuilt'].items():
+                    print(f"    {table} rebuilt: {'; '.join(reasons)}")
+
+            for key, (outfile, err) in report.items():
+                if err is None:
+                    print(f"{table_type} tables saved to {outfile}")
+                else:
+                    failed = True
+                    print(f"{table_type} tables FAILED to save to {outfile}: {err!r}")
+
+            # report SAS dataset cache usage (each dataset should only be decoded once per run)
+
+            print(f"{table_type} SAS dataset cache: {cache_stats['misses']} datasets decoded, {cache_stats['hits']} reads served from cache")
+            print(f"{table_type} shared steps: {shared_steps['computed']} computed, {shared_steps['reused']} reused by other tables")
+
+    # write metrics of each stage of each table to log and to json lines file (one record per table and stage)
 
-    workbook = xl.load_workbook(SPECDIR(YEAR) / SHELL)
-    workbook_oud = xl.load_workbook(SPECDIR(YEAR) / SHELL_OUD)
+    if PROFILE and profiles:
 
-    if PYR_COMP:
-        workbook_pyear = xl.load_workbook(SPECDIR(YEAR) / SHELL_PYEAR)
+        LOGDIR(YEAR).mkdir(parents=True, exist_ok=True)
 
-    # call gen_tables to do all processing for both sets of tables (regular and OP/OUD)
+        log = generate_logger(logdir = LOGDIR(YEAR), logname = f"write_db_tables_{DATE_NOW}.log")
 
-    gen_tables(year = YEAR, workbook = workbook, table_details = table_details, config_sheet_num='sheet_num_sud', table_type='SUD', pyr_comp = PYR_COMP, 
-               g_table_details=g_table_details, workbook_pyear=workbook_pyear)
+        records = pd.DataFrame(profiles)[['table_type', 'table', 'stage'] + METRICS]
 
-    gen_tables(year = YEAR, workbook = workbook_oud, table_details = table_details, config_sheet_num='sheet_num_op', table_type='OUD', pyr_comp = False)
+        for table_type, type_records in records.groupby('table_type', sort=False):
+            print_to_log(log = log, message = f"{table_type} stage metrics per table (seconds, rows, cells, peak bytes)", records = type_records.round(4))
 
-    # save tables
+        with open(LOGDIR(YEAR) / PROFILE_LOG, 'a') as f:
+            for record in profiles:
+                f.write(json.dumps(dict(record, run_date = DATE_NOW)) + '\n')
 
-    workbook.save(OUTDIR(YEAR) / OUTFILE(YEAR))
-    workbook_oud.save(OUTDIR(YEAR) / OUTFILE_OUD(YEAR))
+        print(f"Stage metrics of {records['table'].nunique()} tables written to {LOGDIR(YEAR) / PROFILE_LOG}")
 
-    if PYR_COMP:
-        workbook_pyear.save(OUTDIR(YEAR) / OUTFILE_PYEAR(YEAR))
\ No newline at end of file
+    if failed:
+        raise SystemExit(1)
@@ -1,5 +1,7 @@
 
-from common.utils.params import SASDIR, TOTALS_DS, DQ_STATES, DQ_STATES_PYEAR
+from concurrent.futures import ProcessPoolExecutor
+
+from common.utils.params import SASDIR, STOREDIR, TOTALS_DS, DQ_STATES, DQ_STATES_PYEAR
 from .classes.BaseDataClass import BaseDataClass
 from .classes.TableClass import TableClass
 from .classes.TableClassWideTransform import TableClassWideTransform
@@ -7,8 +9,280 @@ from .classes.TableClassCountsOnly import TableClassCountsOnly
 from .classes.TableClassDuals import TableClassDuals
 from .classes.TableClassG import TableClassG
 from .classes.TableClassCompYears import TableClassCompYears
+from common.utils.decorators import op_name
+from common.utils.timing import PROFILE, table_timer, profile_table, enable_profiling, pop_stats, merge_stats
+from .tasks.read_data import CACHE_STATS, register_columns, registered_columns, register_all, dataset_fingerprint
+from .tasks.write_excel import TemplateIndex, write_plan
+from .tasks.result_store import STORE_VERSION, code_hash, config_hash, store_key, load_prepped, save_prepped
+from .tasks.planner import NODE_STATS, compile_plan, register_plan, registered_plan, release_tables
+from .tasks.predicates import config_predicates
+
+def table_datasets(*, kwargs, table_type, use_sud_ds):
+    """
+    Function table_datasets to return names of all SAS datasets read for table, with _op suffix added for OUD tables (same rule as add_op_suffix)
+
+    """
+
+    return [op_name(sas_ds, table_type, use_sud_ds) for sas_ds in [TOTALS_DS, kwargs['sas_ds']] + kwargs.get('sas_ds_numer', [])]
+
+def sas_dir_year(year, sas_root=None):
+    """
+    Function sas_dir_year to return directory of SAS datasets for given year, from SASDIR unless sas_root is given
+    (then subfolder of sas_root named for year, e.g. for benchmark fixtures)
+
+    """
+
+    return SASDIR(year) if sas_root is None else sas_root / str(year)
+
+def plan_shared_work(*, year, table_details, config_sheet_num, table_type, pyr_comp, chunksize=None, sas_root=None):
+    """
+    Function plan_shared_work to compile steps needed by each table to run for table type (for year and prior year if pyr_comp, see plan_nodes)
+    into a plan of steps to share between tables (see planner), and register the plan so shared steps are computed once.
+    Tables are keyed by table type and table, and are released once prepped (see table_plans)
+
+    params:
+        year str: year to run
+        table_details dict: dictionary with one table per key with details to write table
+        config_sheet_num str: name of sheet num param in config to pull for given table (sheet_num_sud or sheet_num_op)
+        table_type str: table to write (SUD or OUD)
+        pyr_comp bool: boolean to specify prior year tables are prepped
+        chunksize int: optional chunksize tables are run with, default is None
+        sas_root Path: optional directory with a subfolder of SAS datasets for each year (see sas_dir_year), default is None (SASDIR)
+
+    returns:
+        dict of set of tables needing each shared step (see compile_plan)
+
+    """
+
+    years = [(year, DQ_STATES)] + ([(int(year)-1, DQ_STATES_PYEAR)] if pyr_comp == True else [])
+
+    table_nodes = {}
+
+    for table, kwargs in table_details.items():
+        if kwargs.get(config_sheet_num, None):
+
+            sources = [dict(sas_dir = sas_dir_year(pyear, sas_root), year = pyear, table_type = table_type, use_sud_ds = kwargs.get('use_sud_ds', []),
+                            dq_states = dq_states, totals_ds = TOTALS_DS) for pyear, dq_states in years]
+
+            table_nodes[f"{table_type}/{table}"] = [node for source in sources
+                                                    for node in eval(kwargs.get('use_class', 'TableClass')).plan_nodes(kwargs, source = source, chunksize = chunksize)]
+
+    plan = compile_plan(table_nodes)
+
+    register_plan(plan)
+
+    return plan
+
+def init_worker(projections, plan):
+    """
+    Function init_worker to register cols needed from each dataset (see register_all) and shared steps (see register_plan) in worker process
+
+    """
+
+    register_all(projections)
+    register_plan(plan)
+
+def gen_table_plans(*, year, table, kwargs, sheet_num, use_class, use_sud_ds, table_type, pyr_comp, g_sheets, workbook, workbook_pyear, chunksize, use_store=False, sas_root=None):
+    """
+    Function gen_table_plans to prep all sheets for a single table, returning the cells to write to each sheet rather than writing them
+    (workbooks are only read, so can be passed as TemplateIndex of each workbook)
+    params:
+        year str: year to run
+        table str: name of table (key in table_details)
+        kwargs dict: table details for table from config
+        sheet_num str: sheet num for table type
+        use_class str: name of class to use for table
+        use_sud_ds list: list of any SAS datasets that should use SUD only
+        table_type str: table to write (SUD or OUD)
+        pyr_comp bool: boolean to specify read in prior year SAS datasets and create comparison and G tables
+        g_sheets dict: G sheets to write for table, with comp cols for each G sheet (empty dict if none)
+        workbook excel obj/TemplateIndex: template to write to
+        workbook_pyear excel obj/TemplateIndex: template to write comparison tables to if pyr_comp
+        chunksize int: if given, tables that support streaming read input datasets in chunks of this many rows
+        use_store bool: if True, prepped dfs are saved to the result store for the year, and prior year prepped dfs are loaded from the
+            store if stored for the same table, table type, DQ states, config entry and input datasets (otherwise rebuilt and stored), default is False
+        sas_root Path: optional directory with a subfolder of SAS datasets for each year (see sas_dir_year), default is None (SASDIR)
+
+    returns:
+        list of (workbook key, sheet name, plan) tuples in order to write, where workbook key is workbook or workbook_pyear
+
+    """
+
+    plans = []
+
+    # create params for result store keys (config entry and input datasets are the same for both years)
+
+    store_params = dict(table = table, table_type = table_type, config = dict(kwargs, use_sud_ds = use_sud_ds),
+                        datasets = table_datasets(kwargs = kwargs, table_type = table_type, use_sud_ds = use_sud_ds))
+
+    # create table class, set initial attributes, add sheet_num to pass with kwargs to set class attributes
+
+    _tableclass = eval(use_class)(year, sas_dir_year(year, sas_root), TOTALS_DS, table_type, workbook, use_sud_ds, DQ_STATES, **dict(kwargs, sheet_num=sheet_num, chunksize=chunksize))
+
+    _tableclass.set_initial_attribs()
+
+    # prep to write to tables
+
+    _tableclass.prep_for_tables()
+
+    if use_store:
+        save_prepped(STOREDIR(year), store_key(year = year, dq_states = DQ_STATES, sas_dir = sas_dir_year(year, sas_root), **store_params),
+                     _tableclass.prepped_df, _tableclass.prepped_status)
+
+    plans.append(('workbook',) + _tableclass.excel_plan())
+
+    # if pyr_comp == True (prior year stand-alone tables and comparison G tables are requested), create prior year TableClass with prepped df,
+    # then write two sets of comparisons:
+    #   1. Comparisons specified in main config for stand-alone tables (if exists)
+    #   2. Loop over any G sheets specified for given table in g_table_details (if there are any - most sheets do not contribute to any G tables)
+
+    if pyr_comp == True:
+
+        pyear = int(year)-1
+
+        # load prior year prepped dfs from result store if stored, otherwise build prior year TableClass (and store)
+
+        if use_store:
+            key_p = store_key(year = pyear, dq_states = DQ_STATES_PYEAR, sas_dir = sas_dir_year(pyear, sas_root), **store_params)
+            stored_p = load_prepped(STOREDIR(pyear), key_p)
+
+        if use_store and stored_p is not None:
+            prepped_df_p, prepped_status_p = stored_p
+
+        else:
+            _tableclass_p = eval(use_class)(pyear, sas_dir_year(pyear, sas_root), TOTALS_DS, table_type, workbook, use_sud_ds, DQ_STATES_PYEAR, **dict(kwargs, sheet_num=sheet_num, chunksize=chunksize))
+
+            _tableclass_p.set_initial_attribs()
+
+            _tableclass_p.prep_for_tables()
+
+            prepped_df_p, prepped_status_p = _tableclass_p.prepped_df, _tableclass_p.prepped_status
+
+            if use_store:
+                save_prepped(STOREDIR(pyear), key_p, prepped_df_p, prepped_status_p)
+
+        # write comparison sheet if _tableclass attrib for comparison_value is not None (i.e. no corresponding comparison sheet for sheet)
+
+        if _tableclass.comparison_value != 'None':
+
+            _tableclassCompYears = TableClassCompYears(_tableclass, prepped_df_p, prepped_status_p, workbook_pyear)
+
+            plans.append(('workbook_pyear',) + _tableclassCompYears.excel_plan())
+
+        # write all G sheets for given G details key if exists
+
+        for g_sheet_num, comp_cols in g_sheets.items():
+
+            _tableclassG = TableClassG(_tableclass.prepped_df, _tableclass.prepped_status, prepped_df_p, prepped_status_p, workbook, g_sheet_num, comp_cols)
 
-def gen_tables(*, year, workbook, table_details, config_sheet_num, table_type, pyr_comp, g_table_details={}, workbook_pyear=None):
+            plans.append(('workbook',) + _tableclassG.excel_plan())
+
+    return plans
+
+def table_plans(*, table_key, profile=None, **kwargs):
+    """
+    Function table_plans to call gen_table_plans for a single table as prep stage of table (see timing), returning plans with stage stats of table
+    and counts of SAS datasets decoded/read from cache and shared steps computed/reused while prepping table, so stats and counts of tables prepped
+    in worker processes can be added to those of main process (see merge_counts). Once prepped, table is released from shared steps (see planner)
+
+    params:
+        table_key str: name to record stage stats under (table type and table)
+        profile dict: optional profiling settings to enable in process (see enable_profiling), default is None
+        kwargs: all args to pass to gen_table_plans
+
+    returns:
+        tuple of list of plans (see gen_table_plans), dict of stage stats of table (see pop_stats) and dict of counts
+            (cache_stats and shared_steps, keyed as CACHE_STATS and NODE_STATS)
+
+    """
+
+    if (profile is not None) and not PROFILE['enabled']:
+        enable_profiling(**profile)
+
+    cache_start, steps_start = dict(CACHE_STATS), dict(NODE_STATS)
+
+    try:
+        with profile_table(table_key, 'prep'):
+            plans = gen_table_plans(**kwargs)
+
+    finally:
+        release_tables([table_key])
+
+    counts = {'cache_stats' : {stat : CACHE_STATS[stat] - cache_start[stat] for stat in CACHE_STATS},
+              'shared_steps' : {stat : NODE_STATS[stat] - steps_start[stat] for stat in NODE_STATS}}
+
+    return plans, pop_stats(table_key), counts
+
+def merge_counts(counts):
+    """
+    Function merge_counts to add counts returned by table_plans run in a worker process to counts of main process (CACHE_STATS and NODE_STATS)
+
+    """
+
+    for totals, name in [(CACHE_STATS, 'cache_stats'), (NODE_STATS, 'shared_steps')]:
+        for stat, value in counts[name].items():
+            totals[stat] += value
+
+def template_sheets(workbook, sheet_nums):
+    """
+    Function template_sheets to return names of all sheets in workbook (or iterable of sheet names) starting with any of given sheet nums
+
+    """
+
+    sheetnames = workbook.sheetnames if hasattr(workbook, 'sheetnames') else workbook
+
+    return [name for name in sheetnames if name.startswith(tuple(sheet_nums))]
+
+def table_fingerprints(*, year, table_details, config_sheet_num, table_type, pyr_comp, template_hashes, g_table_details={}, sas_root=None):
+    """
+    Function table_fingerprints to create fingerprint of each table to run from everything its sheets depend on (used for incremental runs)
+    params:
+        year str: year to run
+        table_details dict: dictionary with one table per key with details to write table
+        config_sheet_num str: name of sheet num param in config to pull for given table (sheet_num_sud or sheet_num_op)
+        table_type str: table to write (SUD or OUD)
+        pyr_comp bool: boolean to specify prior year comparison and G tables are written
+        template_hashes dict: hash of each template sheet (see index_template) keyed by sheet name, for each workbook (keyed by gen_tables workbook arg)
+        g_table_details dict: dictionary of G table mappings, default is empty dict
+        sas_root Path: optional directory with a subfolder of SAS datasets for each year (see sas_dir_year), default is None (SASDIR)
+
+    returns:
+        dict of fingerprint for each table (store version, hash of code (see code_hash), class, hash of config entry, hash of each input dataset, DQ lists and hash of each template sheet written)
+
+    """
+
+    years = [(year, DQ_STATES)] + ([(int(year)-1, DQ_STATES_PYEAR)] if pyr_comp == True else [])
+
+    fingerprints = {}
+
+    for table, kwargs in table_details.items():
+
+        sheet_num = kwargs.get(config_sheet_num, None)
+
+        if sheet_num:
+
+            g_sheets = g_table_details.get(sheet_num, {}) if pyr_comp == True else {}
+
+            # get names of all sheets written for table (main sheet, comparison sheet and G sheets)
+
+            sheets = {'workbook' : template_sheets(template_hashes['workbook'], [sheet_num] + list(g_sheets))}
+
+            if (pyr_comp == True) & (kwargs.get('comparison_value', 'pct') != 'None'):
+                sheets['workbook_pyear'] = [sheet_num]
+
+            datasets = table_datasets(kwargs = kwargs, table_type = table_type, use_sud_ds = kwargs.get('use_sud_ds', []))
+
+            fingerprints[table] = {'version' : STORE_VERSION,
+                                   'code' : code_hash(),
+                                   'class' : kwargs.get('use_class', 'TableClass'),
+                                   'config' : config_hash(dict({key : value for key, value in kwargs.items() if key != 'use_sud_ds'}, g_sheets = g_sheets)),
+                                   'inputs' : {f"{pyear}/{sas_ds}" : dataset_fingerprint(sas_dir_year(pyear, sas_root), sas_ds) for pyear, dq_states in years for sas_ds in sorted(set(datasets))},
+                                   'dq_states' : [sorted(dq_states) for pyear, dq_states in years],
+                                   'templates' : {f"{key}/{name}" : template_hashes[key].get(name) for key, names in sheets.items() for name in names}}
+
+    return fingerprints
+
+def gen_tables(*, year, workbook, table_details, config_sheet_num, table_type, pyr_comp, g_table_details={}, workbook_pyear=None, chunksize=None, jobs=None, use_store=False, templates=None, sas_root=None):
     """
     Function gen_tables to generate excel tables
     params:
@@ -20,13 +294,41 @@ def gen_tables(*, year, workbook, table_details, config_sheet_num, table_type, p
         pyr_comp bool: boolean to specify read in prior year SAS datasets and create G tables (will only ever be run for SUD tables, if requested)
         g_table_details dict: dictionary of G table mappings with one input SUD sheet per key with details to write each corresponding G table, default is empty dict
         workbook_pyear excel obj: excel obj to write comparison tables to if pyrcomp, default is None
+        chunksize int: if given, tables that support streaming read input datasets in chunks of this many rows, default is None (read full datasets)
+        jobs int: if given and > 1, tables are prepped in parallel in this many worker processes, default is None (prep each table in turn)
+            sheets are always written in config order in the main process, so output is the same as prepping each table in turn
+        use_store bool: if True, save prepped dfs to result store and load prior year prepped dfs from store if stored (see gen_table_plans), default is False
+        templates dict: optional TemplateIndex of each workbook (keyed by workbook arg) to read templates from when prepping tables (see load_template),
+            default is None (read from workbooks, or index the sheets read if prepping in parallel)
+        sas_root Path: optional directory with a subfolder of SAS datasets for each year (see sas_dir_year), default is None (SASDIR)
 
 
     """
 
-    # loop over all tables in table_details to create regular TableClass (default) or child class if specified
+    # register the cols each table needs from its SAS datasets before any reads, so each dataset is read once
+    # with only the union of cols needed across all tables that use it, and check row filters in config are valid before any tables are prepped
+
+    for table, kwargs in table_details.items():
+
+        if kwargs.get(config_sheet_num, None):
+
+            config_predicates(kwargs)
+
+            columns = eval(kwargs.get('use_class', 'TableClass')).required_columns(kwargs)
+
+            for sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', []):
+                register_columns(sas_ds, columns)
+
+    # plan steps shared between tables (e.g. totals), so each is computed once for all tables that need it
+
+    plan_shared_work(year = year, table_details = table_details, config_sheet_num = config_sheet_num, table_type = table_type, pyr_comp = pyr_comp,
+                     chunksize = chunksize, sas_root = sas_root)
+
+    # create list of tables to run with all params to prep each table
     # only run if specific config_sheet_num given in kwargs (not all tables run for OUD, and some few tables specified separately for SUD/OUD)
 
+    tables = []
+
     for table, kwargs in table_details.items():
 
         sheet_num = kwargs.get(config_sheet_num, None)
@@ -35,60 +337,75 @@ def gen_tables(*, year, workbook, table_details, config_sheet_num, table_type, p
 
         if sheet_num:
 
-            # identify class to use for given measure - TableClass is default
-
-            use_class = kwargs.get('use_class', 'TableClass')
-
             # extract optional list of DS names to hard-code use of SUD counts (i.e. for OUD tables, will not append _op suffix to get full population counts)
             # must extract here to pass as arg to create BaseDataClass
 
             use_sud_ds = kwargs.pop('use_sud_ds', [])
 
-            # create table class, set initial attributes, add sheet_num to pass with kwargs to set class attributes
+            # identify class to use for given measure - TableClass is default
+
+            tables.append(dict(table = table, kwargs = kwargs, sheet_num = sheet_num, use_class = kwargs.get('use_class', 'TableClass'), use_sud_ds = use_sud_ds,
+                               g_sheets = g_table_details.get(sheet_num, {}) if pyr_comp == True else {}))
+
+    workbooks = {'workbook' : workbook, 'workbook_pyear' : workbook_pyear}
+
+    params = dict(year = year, table_type = table_type, pyr_comp = pyr_comp, chunksize = chunksize, use_store = use_store, sas_root = sas_root)
+
+    parallel = (jobs is not None) and (jobs > 1)
+
+    # if prepping in parallel without given templates, index the sheets read from each workbook to pass to worker processes in place of the workbooks
 
-            _tableclass = eval(use_class)(year, SASDIR(year), TOTALS_DS, table_type, workbook, use_sud_ds, DQ_STATES, **dict(kwargs, sheet_num=sheet_num))
+    if parallel and (templates is None):
 
-            _tableclass.set_initial_attribs()
+        templates = {'workbook' : TemplateIndex(workbook, template_sheets(workbook, [table['sheet_num'] for table in tables] +
+                                                                          [g_sheet_num for table in tables for g_sheet_num in table['g_sheets']]))}
 
-            # prep to write to tables
+        if pyr_comp == True:
+            templates['workbook_pyear'] = TemplateIndex(workbook_pyear, [table['sheet_num'] for table in tables if table['kwargs'].get('comparison_value', 'pct') != 'None'])
 
-            _tableclass.prep_for_tables()
+    templates = templates if templates is not None else workbooks
 
-            # write to excel
+    # stage stats of each table are recorded under table type and table (see timing), passing profiling settings to worker processes
 
-            _tableclass.write_excel_sheet()
+    params = dict(params, workbook = templates['workbook'], workbook_pyear = templates.get('workbook_pyear'),
+                  profile = {'memory' : PROFILE['memory'], 'dump_dir' : PROFILE['dump_dir']} if PROFILE['enabled'] else None)
 
-            # if pyr_comp == True (prior year stand-alone tables and comparison G tables are requested), create prior year TableClass with prepped df,
-            # then write two sets of comparisons:
-            #   1. Comparisons specified in main config for stand-alone tables (if exists)
-            #   2. Loop over any G sheets specified for given table in g_table_details (if there are any - most sheets do not contribute to any G tables)
+    # prep each table in turn and write its sheets
 
-            if pyr_comp == True:
+    if not parallel:
 
-                pyear = int(year)-1
+        for table in tables:
 
-                _tableclass_p = eval(use_class)(pyear, SASDIR(pyear), TOTALS_DS, table_type, workbook, use_sud_ds, DQ_STATES_PYEAR, **dict(kwargs, sheet_num=sheet_num))
+            # counts are already added to counts of this process, so only stage stats are merged
 
-                _tableclass_p.set_initial_attribs()
+            plans, stats, counts = table_plans(table_key = f"{table_type}/{table['table']}", **table, **params)
 
-                _tableclass_p.prep_for_tables()
+            merge_stats(stats)
 
-                # write comparison sheet if _tableclass attrib for comparison_value is not None (i.e. no corresponding comparison sheet for sheet)
+            with table_timer(f"{table_type}/{table['table']}"):
+                for key, sheet_name, plan in plans:
+                    write_plan(workbook = workbooks[key], sheet_name = sheet_name, plan = plan)
 
-                if _tableclass.comparison_value != 'None':
+    # otherwise prep tables in worker processes, passing templates in place of the workbooks,
+    # and write the returned sheets in config order as each table in order is finished
 
-                    _tableclassCompYears = TableClassCompYears(_tableclass, _tableclass_p.prepped_df, workbook_pyear)
+    else:
 
-                    _tableclassCompYears.write_excel_sheet()
+        with ProcessPoolExecutor(max_workers = jobs, initializer = init_worker, initargs = (registered_columns(), registered_plan())) as pool:
 
-                # write all G sheets for given G details key if exists
+            futures = [(table, pool.submit(table_plans, table_key = f"{table_type}/{table['table']}", **table, **params)) for table in tables]
 
-                if _tableclass.sheet_num in g_table_details.keys():
+            for table, future in futures:
 
-                    for g_sheet_num, comp_cols in g_table_details[_tableclass.sheet_num].items():
+                plans, stats, counts = future.result()
 
-                        _tableclassG = TableClassG(_tableclass.prepped_df, _tableclass_p.prepped_df, workbook, g_sheet_num, comp_cols)
+                merge_stats(stats)
+                merge_counts(counts)
 
-                        _tableclassG.write_excel_sheet()
+                with table_timer(f"{table_type}/{table['table']}"):
+                    for key, sheet_name, plan in plans:
+                        write_plan(workbook = workbooks[key], sheet_name = sheet_name, plan = plan)
 
+        # tables were released from shared steps in worker processes, release in main process too
 
+        release_tables([f"{table_type}/{table['table']}" for table in tables])
@@ -2,33 +2,44 @@ import pandas as pd
 import numpy as np
 
 from common.utils.params import FIPS_NAME_MAP
+from common.utils.timing import timed_stage
 
 def convert_fips(*, df, incol='submtg_state_cd'):
 
     return df[incol].map(lambda x: FIPS_NAME_MAP[x])
     
-def calc_prop(num, denom, suppress_from_numer, suppress_value, prop_mult):
+def calc_props(*, num, denom, prop_mult, num_suppressed=None, denom_suppressed=None):
     """
-    Helper function calc_prop to be applied row-wise to each set of numerator/denominators
-    If suppress_from_numer == True, will return suppressed value if numer is suppressed
-    Otherwise, returns num/denom * prop_mult
+    Function calc_props to calculate all stats (num/denom multiplied by prop_mult) for 2-d arrays of numerators and denominators
+    in one pass (one col per stat, each num col paired with denom col in same position)
+
+    Stat is set to nan if denom is 0 or either value is nan, or if either num or denom is suppressed.
+    Stats with suppressed num are flagged in returned mask (to be set to suppressed value)
+
+    params:
+        num array: 2-d float array of numerators
+        denom array: 2-d float array of denominators, same shape as num
+        prop_mult int: int to multiply num/denom by
+        num_suppressed array: optional 2-d bool array flagging suppressed numerators, default is None (none suppressed)
+        denom_suppressed array: optional 2-d bool array flagging suppressed denominators, default is None (none suppressed)
+
+    returns:
+        tuple of 2-d float array of stats and 2-d bool array flagging stats to suppress
 
     """
-    
-    if suppress_from_numer == True:
-        if num == suppress_value:
-            return suppress_value
 
-        elif denom == suppress_value:
-            return np.nan
+    num_suppressed = np.zeros(num.shape, dtype=bool) if num_suppressed is None else num_suppressed
+    denom_suppressed = np.zeros(denom.shape, dtype=bool) if denom_suppressed is None else denom_suppressed
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = prop_mult * (num / denom)
 
-    try:
-        return prop_mult * (num / denom)
+    stats[(denom == 0) | num_suppressed | denom_suppressed] = np.nan
 
-    except ZeroDivisionError:
-        return np.nan
+    return stats, num_suppressed
 
-def create_stats(*, df, numerators, denominators, prop_mult, suffix='_stat', suppress_from_numer=True, suppress_value='DS', stat_name_use=0):
+@timed_stage('stats')
+def create_stats(*, df, numerators, denominators, prop_mult, suffix='_stat', suppress_from_numer=True, suppress_value='DS', stat_name_use=0, suppressed=None):
     """
     Function create_stats to create stats (num/denom multiplied by given value) based on passed numerator/denominator params
     params:
@@ -45,6 +56,9 @@ def create_stats(*, df, numerators, denominators, prop_mult, suffix='_stat', sup
         stat_name_use int: based on numerator/denominator pairs, indicates which to use to name the created stat (with specified suffix)
             if 0, will use numerator (default)
             if 1, will use denominator
+        suppressed df: optional boolean df flagging suppressed numerators/denominators for numeric dfs (suppressed values as nan), default is None
+            if given, is used to identify suppressed values instead of suppress_value, stats are left as nan where suppressed
+            and each stat col is added to suppressed (flagged where numerator is suppressed)
 
     returns:
         df with stats added
@@ -56,9 +70,38 @@ def create_stats(*, df, numerators, denominators, prop_mult, suffix='_stat', sup
 
     assert len(denominators) == len(numerators), "ERROR: Length of numerators != length of denominators passed to create_stats: FIX"
 
-    for pair in zip(numerators, denominators):
+    # pull all numerators and denominators as numeric arrays (with suppressed values flagged) to calculate all stats at once
+
+    num, denom = df[numerators], df[denominators]
+
+    masks = {}
+    if (suppress_from_numer == True) & (suppressed is not None):
+        masks = {'num_suppressed' : suppressed[numerators].to_numpy(), 'denom_suppressed' : suppressed[denominators].to_numpy()}
+
+    elif suppress_from_numer == True:
+        masks = {'num_suppressed' : (num == suppress_value).to_numpy(), 'denom_suppressed' : (denom == suppress_value).to_numpy()}
+
+    if suppressed is None:
+        num, denom = num.apply(pd.to_numeric, errors='coerce'), denom.apply(pd.to_numeric, errors='coerce')
+
+    stats, stats_suppressed = calc_props(num = num.to_numpy(dtype=float), denom = denom.to_numpy(dtype=float), prop_mult = prop_mult, **masks)
+
+    # add each stat col, setting to suppressed value where numerator is suppressed (or flagging in suppressed if given)
+
+    for i, pair in enumerate(zip(numerators, denominators)):
+
+        if suppressed is not None:
+            stat = stats[:, i]
+            suppressed[f"{pair[stat_name_use]}{suffix}"] = stats_suppressed[:, i]
+
+        elif stats_suppressed[:, i].any():
+            stat = stats[:, i].astype(object)
+            stat[stats_suppressed[:, i]] = suppress_value
+
+        else:
+            stat = stats[:, i]
 
-        df[f"{pair[stat_name_use]}{suffix}"] = df[list(pair)].apply(lambda x: calc_prop(*x, suppress_from_numer, suppress_value, prop_mult), axis=1)
+        df[f"{pair[stat_name_use]}{suffix}"] = stat
 
     return df
 
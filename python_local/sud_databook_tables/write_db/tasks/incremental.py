@@ -0,0 +1,98 @@
+"""
+funcs for incremental runs: each table is fingerprinted from everything its sheets depend on, and fingerprints are compared to those
+recorded by the previous run to find the tables that must be rebuilt (all other tables are kept from the previous output workbook)
+"""
+
+import os
+import json
+
+def read_fingerprints(path):
+    """
+    Function read_fingerprints to return fingerprints recorded by previous run (empty dict if no previous run)
+
+    """
+
+    if not path.exists():
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+def write_fingerprints(path, outfiles, fingerprints):
+    """
+    Function write_fingerprints to record output workbooks and table fingerprints for run (written to temp file and then moved)
+
+    params:
+        path Path: path to fingerprints file
+        outfiles dict: path of each output workbook, keyed by gen_tables workbook arg
+        fingerprints dict: fingerprint of each table
+
+    returns:
+        none
+
+    """
+
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(tmp, 'w') as f:
+        json.dump({'outfiles' : {key : str(outfile) for key, outfile in outfiles.items()}, 'tables' : fingerprints}, f, indent=2, sort_keys=True)
+
+    os.replace(tmp, path)
+
+def invalidated_reasons(previous, current):
+    """
+    Function invalidated_reasons to return list of reasons table fingerprint differs from previous fingerprint (empty list if unchanged)
+
+    params:
+        previous dict: fingerprint of table from previous run, None if table was not in previous run
+        current dict: fingerprint of table for this run
+
+    returns:
+        list of str
+
+    """
+
+    if previous is None:
+        return ['new table']
+
+    reasons = []
+
+    for part, reason in [('version', 'store version changed'), ('code', 'code changed'), ('class', 'class changed'), ('config', 'config entry changed'), ('dq_states', 'DQ states changed')]:
+        if previous.get(part) != current[part]:
+            reasons.append(reason)
+
+    for part, reason in [('inputs', 'input datasets changed'), ('templates', 'template sheets changed')]:
+        changed = sorted(name for name in set(previous.get(part, {})) | set(current[part]) if previous.get(part, {}).get(name) != current[part].get(name))
+        if changed:
+            reasons.append(f"{reason}: {', '.join(changed)}")
+
+    return reasons
+
+def plan_rebuild(previous, fingerprints, workbook_keys):
+    """
+    Function plan_rebuild to identify tables to rebuild by comparing fingerprints to those from previous run.
+    If any template sheet has changed (or any previous output workbook no longer exists) the previous output cannot be patched,
+    so all tables are rebuilt
+
+    params:
+        previous dict: fingerprints file from previous run (see write_fingerprints)
+        fingerprints dict: fingerprint of each table for this run
+        workbook_keys list: workbooks written by this run (gen_tables workbook args), all must be in previous output to patch
+
+    returns:
+        tuple of bool (True if previous output workbooks can be patched) and dict of list of reasons for each table to rebuild
+
+    """
+
+    rebuild = {table : invalidated_reasons(previous.get('tables', {}).get(table), fingerprint) for table, fingerprint in fingerprints.items()}
+    rebuild = {table : reasons for table, reasons in rebuild.items() if reasons}
+
+    outfiles = previous.get('outfiles', {})
+
+    if not all((key in outfiles) and os.path.exists(outfiles[key]) for key in workbook_keys):
+        return False, {table : rebuild.get(table, ['no previous output workbook']) for table in fingerprints}
+
+    if any(reason.startswith('template sheets changed') for reasons in rebuild.values() for reason in reasons):
+        return False, {table : rebuild.get(table, ['full rebuild for changed template sheets']) for table in fingerprints}
+
+    return True, rebuild
@@ -10,11 +10,11 @@ def get_national_values(*, df, calc_cols, op='sum', state_name = 'United States'
         op str: operational to perform, default is 'sum'
         state_name str: name to give to record in assigning value of col state, default = 'United States'
 
-    Allows for non-numeric values - will coerce to numeric
+    Expects numeric cols, with suppressed/non-applicable values as nan (nan values are skipped)
 
     returns:
         df with aggregate values with one column per input calc_cols
     """
 
 
-    return df[calc_cols].apply(pd.to_numeric, errors='coerce').agg([op]).assign(state = state_name)
\ No newline at end of file
+    return df[calc_cols].agg([op]).assign(state = state_name)
\ No newline at end of file
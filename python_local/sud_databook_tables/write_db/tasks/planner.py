@@ -0,0 +1,157 @@
+"""
+planner for work shared between tables: before any tables are prepped, the steps each table needs from its input datasets
+(see plan_nodes of each table class) are compiled into a DAG, where each node is one step keyed by the step and its inputs:
+
+    totals: totals df (read, fips converted and small cell suppressed, see prep_totals)
+    state: dataset read (DQ states dropped) with fips converted to state name
+    joined: state node joined to totals node
+
+Nodes needed by more than one table (across table types and years) are computed once when first requested (see shared_node),
+kept until every table that needs them is prepped (see release_tables), and a copy is given to each table
+"""
+
+from common.utils.decorators import op_name
+
+STEPS = ['totals', 'state', 'joined']
+
+# tables still to prep that need each shared node, and shared nodes computed so far, with counters of nodes computed and reused
+
+_PLAN = {}
+_NODES = {}
+NODE_STATS = {'computed' : 0, 'reused' : 0}
+
+def dataset_id(source, filename):
+    """
+    Function dataset_id to return tuple identifying dataset read for given source (see source of BaseDataClass):
+    SAS directory, filename (with _op suffix if applicable), year and DQ states dropped at read
+
+    """
+
+    return (str(source['sas_dir']), op_name(filename, source['table_type'], source['use_sud_ds']), str(source['year']), tuple(sorted(source['dq_states'])))
+
+def totals_node(source, columns):
+    """
+    Function totals_node to return node of totals df of source with given total cols
+
+    """
+
+    return ('totals',) + dataset_id(source, source['totals_ds']) + (tuple(columns),)
+
+def state_node(source, filename):
+    """
+    Function state_node to return node of given dataset of source with state names
+
+    """
+
+    return ('state',) + dataset_id(source, filename)
+
+def joined_node(state, totals):
+    """
+    Function joined_node to return node of state node joined to totals node (None if state node is None, i.e. not shared)
+
+    """
+
+    return ('joined', state, totals) if state is not None else None
+
+def node_inputs(node):
+    """
+    Function node_inputs to return nodes given node is computed from
+
+    """
+
+    return [item for item in node[1:] if isinstance(item, tuple) and item and (item[0] in STEPS)]
+
+def compile_plan(table_nodes):
+    """
+    Function compile_plan to compile nodes needed by each table (with their inputs) into the nodes to share, i.e. nodes needed by more than one table
+    that are not only needed as input to another shared node needed by the same tables (that node is shared instead)
+
+    params:
+        table_nodes dict: list of nodes needed by each table, keyed by table
+
+    returns:
+        dict of set of tables needing each shared node, keyed by node
+
+    """
+
+    tables, parents = {}, {}
+
+    def add(node, table):
+        tables.setdefault(node, set()).add(table)
+        for input_node in node_inputs(node):
+            parents.setdefault(input_node, set()).add(node)
+            add(input_node, table)
+
+    for table, nodes in table_nodes.items():
+        for node in nodes:
+            add(node, table)
+
+    return {node : needed_by for node, needed_by in tables.items()
+            if (len(needed_by) > 1) and not any(tables[parent] == needed_by for parent in parents.get(node, []))}
+
+def register_plan(plan):
+    """
+    Function register_plan to add tables needing each shared node in given plan (see compile_plan) to planned tables.
+    Registering the same tables again has no effect, so a plan can be registered both for a whole run and for each table type
+
+    """
+
+    for node, needed_by in plan.items():
+        _PLAN.setdefault(node, set()).update(needed_by)
+
+def registered_plan():
+    """
+    Function registered_plan to return copy of planned tables for each shared node, e.g. to pass to worker processes
+
+    """
+
+    return {node : set(needed_by) for node, needed_by in _PLAN.items()}
+
+def release_tables(tables):
+    """
+    Function release_tables to mark given tables as prepped, dropping any shared nodes no longer needed by any table
+
+    """
+
+    for node in list(_PLAN):
+
+        _PLAN[node].difference_update(tables)
+
+        if not _PLAN[node]:
+            del _PLAN[node]
+            _NODES.pop(node, None)
+
+def shared_node(node, compute):
+    """
+    Function shared_node to return df of given node, computed once if node is shared (see register_plan), otherwise computed for caller
+
+    params:
+        node tuple: node to return (None if step cannot be shared)
+        compute function: function with no args to compute df of node
+
+    returns:
+        df: copy of shared df (callers are free to modify)
+
+    """
+
+    if node not in _PLAN:
+        return compute()
+
+    if node in _NODES:
+        NODE_STATS['reused'] += 1
+
+    else:
+        NODE_STATS['computed'] += 1
+        _NODES[node] = compute()
+
+    return _NODES[node].copy()
+
+def clear_plan():
+    """
+    Function clear_plan to drop all planned tables and shared nodes, and reset counters
+
+    """
+
+    _PLAN.clear()
+    _NODES.clear()
+    NODE_STATS.update({'computed' : 0, 'reused' : 0})
@@ -0,0 +1,157 @@
+"""
+row filters given in config as a col and an expression (numer_col/numer_value, subset_col/subset_value, e.g. pop_sud and ==1),
+parsed once into a Predicate that can be applied to a df as a vectorized mask, to arrow batches read in chunks,
+or pushed down into parquet reads (see read_data)
+"""
+
+import re
+import ast
+import operator
+from functools import lru_cache
+from collections import namedtuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# comparison ops allowed in config expressions, with numpy/arrow funcs to apply each (in and not in take a list of values)
+
+OPS = {'==' : operator.eq, '!=' : operator.ne, '>=' : operator.ge, '<=' : operator.le, '>' : operator.gt, '<' : operator.lt}
+ARROW_OPS = {'==' : pc.equal, '!=' : pc.not_equal, '>=' : pc.greater_equal, '<=' : pc.less_equal, '>' : pc.greater, '<' : pc.less}
+
+EXPRESSION = re.compile(r"^\s*(==|!=|>=|<=|>|<|not in|in)\s*(.+?)\s*$")
+
+# filter params in config, with the col and expression params for each
+
+FILTER_PARAMS = {'subset' : ('subset_col', 'subset_value'), 'numer' : ('numer_col', 'numer_value')}
+
+class Predicate(namedtuple('Predicate', ['col', 'op', 'value'])):
+    """
+    Predicate to keep rows where col compared with op to value is True (rows with missing col values are never kept).
+    Immutable and hashable, so can be used in cache keys and passed to worker processes
+
+    """
+
+    __slots__ = ()
+
+    def mask(self, df):
+        """
+        Method mask to return boolean array of rows of df to keep
+
+        """
+
+        column = df[self.col]
+
+        if self.op in ['in', 'not in']:
+            mask = column.isin(self.value).to_numpy()
+            mask = ~mask if self.op == 'not in' else mask
+
+        else:
+            mask = np.asarray(OPS[self.op](column.to_numpy(), self.value), dtype=bool)
+
+        return mask & column.notna().to_numpy()
+
+    def __call__(self, df):
+
+        return self.mask(df)
+
+    def arrow_mask(self, batch):
+        """
+        Method arrow_mask to return boolean arrow array of rows of arrow batch/table to keep
+
+        """
+
+        column = batch.column(batch.schema.get_field_index(self.col))
+
+        if self.op in ['in', 'not in']:
+            mask = pc.is_in(column, value_set = pa.array(self.value))
+            mask = pc.invert(mask) if self.op == 'not in' else mask
+            mask = pc.and_(mask, pc.is_valid(column))
+
+        else:
+            mask = ARROW_OPS[self.op](column, pa.scalar(self.value))
+
+        return pc.fill_null(mask, False)
+
+    def arrow_filter(self):
+        """
+        Method arrow_filter to return filter tuple to push down into parquet reads (see pyarrow.parquet.read_table)
+
+        """
+
+        return (self.col, self.op, list(self.value) if self.op in ['in', 'not in'] else self.value)
+
+    def __str__(self):
+
+        return f"{self.col} {self.op} {self.value!r}"
+
+@lru_cache(maxsize=None)
+def compile_predicate(col, expression):
+    """
+    Function compile_predicate to parse col and expression from config (e.g. pop_sud and ==1) into a Predicate, parsing each distinct
+    col and expression only once per run. An expression that is a value rather than a string is compared with ==
+
+    params:
+        col str: name of col to filter on
+        expression str: comparison op followed by literal value (==, !=, >=, <=, >, <), or in/not in followed by list of literal values
+
+    returns:
+        Predicate
+
+    raises error if:
+        col is not a valid col name, or expression is not a supported op followed by literal value(s)
+
+    """
+
+    if not (isinstance(col, str) and col.isidentifier()):
+        raise ValueError(f"ERROR: Filter col {col!r} is not a valid col name - FIX")
+
+    if not isinstance(expression, str):
+        return Predicate(col, '==', expression)
+
+    match = EXPRESSION.match(expression)
+
+    if match is None:
+        raise ValueError(f"ERROR: Filter {col} {expression!r} must be a comparison op (==, !=, >=, <=, >, <, in, not in) followed by a value - FIX")
+
+    op, value = match.groups()
+
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise ValueError(f"ERROR: Filter {col} {expression!r} must compare to a literal value - FIX")
+
+    if op in ['in', 'not in']:
+
+        if not isinstance(value, (list, tuple, set)):
+            raise ValueError(f"ERROR: Filter {col} {expression!r} must give a list of values for {op} - FIX")
+
+        value = tuple(value)
+
+    return Predicate(col, op, value)
+
+def config_predicates(config):
+    """
+    Function config_predicates to return Predicate for each filter given in config entry (see FILTER_PARAMS), keyed by filter name (subset, numer)
+
+    params:
+        config dict: config entry for table
+
+    returns:
+        dict of Predicate
+
+    raises error if:
+        filter col is given without expression, or filter is not valid (see compile_predicate)
+
+    """
+
+    predicates = {}
+
+    for name, (col, expression) in FILTER_PARAMS.items():
+        if col in config:
+
+            assert expression in config, f"ERROR: {col} given without {expression} in config - FIX"
+
+            predicates[name] = compile_predicate(config[col], config[expression])
+
+    return predicates
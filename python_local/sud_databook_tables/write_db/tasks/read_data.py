@@ -0,0 +1,491 @@
+"""
+read funcs for input SAS datasets
+"""
+
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from common.utils.timing import timed_stage
+
+log = logging.getLogger(__name__)
+
+# session-scoped cache of decoded datasets (one entry per resolved path/suffix/year/mtime), with hit/miss counters
+# each entry holds the set of columns it was read with (None if all columns) and the df
+
+_DATASETS = {}
+CACHE_STATS = {'hits' : 0, 'misses' : 0}
+
+# columns registered as needed from each dataset (keyed by dataset name without _op suffix), used to project reads
+
+_PROJECTIONS = {}
+
+# columnar (parquet) copies of SAS datasets are written to a subfolder of the SAS directory, with a manifest
+# recording the size, modified time and content hash of each source file at time of conversion
+
+COLUMNAR_DIR = 'columnar'
+MANIFEST = 'manifest.json'
+
+def file_hash(path, block_size=2**20):
+    """
+    Function file_hash to return sha256 hex digest of file contents, read in blocks
+
+    """
+
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def source_path(sas_dir, filename):
+    """
+    Function source_path to return path of SAS dataset, or of parquet dataset with the same name in the SAS directory if there is
+    no SAS dataset (e.g. synthetic datasets written by benchmark fixtures, as SAS datasets cannot be written from python)
+
+    """
+
+    path = sas_dir / f"{filename}.sas7bdat"
+    parquet_path = sas_dir / f"{filename}.parquet"
+
+    return parquet_path if (not path.exists()) and parquet_path.exists() else path
+
+def read_parquet_cols(path, columns=None, predicates=()):
+    """
+    Function read_parquet_cols to read parquet file, only reading given columns that are in the file (in order of file),
+    and only rows meeting all given predicates (pushed down into the parquet read, see Predicate)
+
+    """
+
+    if columns is not None:
+        columns = [col for col in pq.read_schema(path).names if col in columns]
+
+    if predicates:
+        return pq.read_table(path, columns = columns, filters = [predicate.arrow_filter() for predicate in predicates]).to_pandas()
+
+    return pd.read_parquet(path, columns = columns)
+
+def predicate_mask(df, predicates):
+    """
+    Function predicate_mask to return boolean array of rows of df meeting all given predicates
+
+    """
+
+    mask = predicates[0].mask(df)
+
+    for predicate in predicates[1:]:
+        mask &= predicate.mask(df)
+
+    return mask
+
+def read_manifest(sas_dir):
+    """
+    Function read_manifest to return dict of manifest entries for given SAS directory (empty dict if no manifest written yet)
+
+    """
+
+    path = sas_dir / COLUMNAR_DIR / MANIFEST
+
+    if not path.exists():
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+def update_manifest(sas_dir, entries):
+    """
+    Function update_manifest to add/replace given entries in manifest, re-reading the manifest first so
+    entries written by other conversions are kept. Written to temp file and then moved so manifest is never partial
+
+    """
+
+    manifest = dict(read_manifest(sas_dir), **entries)
+
+    path = sas_dir / COLUMNAR_DIR / MANIFEST
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(tmp, path)
+
+def columnar_current(sas_dir, filename, manifest):
+    """
+    Function columnar_current to check whether columnar copy of given dataset is still valid:
+        - size and mtime of source both match manifest: valid
+        - size matches but mtime does not (e.g. file copied again): valid only if content hash matches, in which case mtime is updated
+
+    returns:
+        bool
+
+    """
+
+    entry = manifest.get(filename)
+    source = sas_dir / f"{filename}.sas7bdat"
+
+    if entry is None or not (sas_dir / COLUMNAR_DIR / entry['columnar']).exists():
+        return False
+
+    stat = source.stat()
+
+    if stat.st_size != entry['size']:
+        return False
+
+    if stat.st_mtime == entry['mtime']:
+        return True
+
+    if file_hash(source) == entry['sha256']:
+        update_manifest(sas_dir, {filename : dict(entry, mtime = stat.st_mtime)})
+        return True
+
+    return False
+
+def source_entry(sas_dir, filename):
+    """
+    Function source_entry to return manifest entry for SAS dataset (size, mtime and content hash of source, and name of columnar copy)
+
+    """
+
+    source = sas_dir / f"{filename}.sas7bdat"
+
+    stat = source.stat()
+
+    return {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'sha256' : file_hash(source), 'columnar' : f"{filename}.parquet"}
+
+def convert_to_columnar(*, sas_dir, filename, df=None, entry=None, encoding='ISO-8859-1'):
+    """
+    Function convert_to_columnar to write parquet copy of SAS dataset and add its entry to the manifest
+
+    params:
+        sas_dir Path: directory with SAS datasets
+        filename str: name of SAS dataset (without extension)
+        df df: optional already decoded df, if not given will read SAS dataset
+        entry dict: manifest entry of source (see source_entry), must be taken before df was decoded if df is given, default is None
+            (taken here before decoding, only valid if df is not given)
+        encoding str: encoding to pass to read_sas, default is ISO-8859-1
+
+    returns:
+        df: decoded df
+
+    """
+
+    source = sas_dir / f"{filename}.sas7bdat"
+
+    assert (df is None) or (entry is not None), f"ERROR: Must give manifest entry taken before decoding with decoded df for {filename} - FIX"
+
+    # take fingerprint before decoding so a file replaced during conversion is picked up as stale on next read
+
+    if entry is None:
+        entry = source_entry(sas_dir, filename)
+
+    if df is None:
+        df = pd.read_sas(source, encoding = encoding)
+
+    (sas_dir / COLUMNAR_DIR).mkdir(exist_ok=True)
+    df.to_parquet(sas_dir / COLUMNAR_DIR / entry['columnar'], index=False)
+
+    update_manifest(sas_dir, {filename : entry})
+
+    return df
+
+def dataset_fingerprint(sas_dir, filename):
+    """
+    Function dataset_fingerprint to return sha256 hex digest of SAS dataset contents, taken from the manifest if the columnar copy
+    is still valid (otherwise the SAS dataset is hashed)
+
+    """
+
+    manifest = read_manifest(sas_dir)
+
+    if columnar_current(sas_dir, filename, manifest):
+        return manifest[filename]['sha256']
+
+    return file_hash(source_path(sas_dir, filename))
+
+def ingest_sas_dir(sas_dir):
+    """
+    Function ingest_sas_dir to convert all SAS datasets in given directory to columnar copies,
+    skipping any whose copy is still valid per the manifest
+
+    params:
+        sas_dir Path: directory with SAS datasets
+
+    returns:
+        list: names of datasets (re)converted
+
+    """
+
+    manifest = read_manifest(sas_dir)
+
+    converted = []
+    for source in sorted(sas_dir.glob('*.sas7bdat')):
+        if not columnar_current(sas_dir, source.stem, manifest):
+            convert_to_columnar(sas_dir = sas_dir, filename = source.stem)
+            converted.append(source.stem)
+
+    return converted
+
+def sud_name(filename):
+    """
+    Function sud_name to return dataset name with any _op suffix removed
+
+    """
+
+    return filename[:-len('_op')] if filename.endswith('_op') else filename
+
+def register_columns(filename, columns):
+    """
+    Function register_columns to add given columns to the set of columns needed from given dataset.
+    All reads of the dataset (SUD and _op versions) are projected to the union of registered columns
+
+    params:
+        filename str: name of SAS dataset (without extension, _op suffix is ignored)
+        columns list: list of columns needed (cols not on the dataset are ignored at read)
+
+    returns:
+        none
+
+    """
+
+    _PROJECTIONS.setdefault(sud_name(filename), set()).update(columns)
+
+def registered_columns():
+    """
+    Function registered_columns to return copy of all registered columns (dict of set of cols keyed by dataset name), e.g. to pass to worker processes
+
+    """
+
+    return {filename : set(columns) for filename, columns in _PROJECTIONS.items()}
+
+def register_all(projections):
+    """
+    Function register_all to register all columns in given dict of set of cols keyed by dataset name (see registered_columns)
+
+    """
+
+    for filename, columns in projections.items():
+        register_columns(filename, columns)
+
+def read_dataset(*, sas_dir, filename, columns=None, predicates=(), encoding='ISO-8859-1'):
+    """
+    Function read_dataset to read columnar copy of SAS dataset if the manifest shows it is still valid,
+    otherwise decode the SAS dataset and (re)write the columnar copy.
+    If columnar copy cannot be written (e.g. read-only directory), returns decoded SAS dataset.
+    If there is no SAS dataset but a parquet dataset with the same name (see source_path), the parquet dataset is read directly
+
+    params:
+        sas_dir Path: directory with SAS datasets
+        filename str: name of SAS dataset (without extension)
+        columns set: optional set of columns to keep (in order of dataset), default is None (all columns)
+            columnar copies only read the requested columns, SAS datasets must be fully decoded and are then subset
+        predicates list: optional list of Predicates rows must meet (cols must be in columns if given), default is none (all rows)
+            pushed down into reads of columnar copies, SAS datasets are filtered once decoded
+        encoding str: encoding to pass to read_sas, default is ISO-8859-1
+
+    returns:
+        df
+
+    """
+
+    if columnar_current(sas_dir, filename, read_manifest(sas_dir)):
+        return read_parquet_cols(sas_dir / COLUMNAR_DIR / f"{filename}.parquet", columns, predicates)
+
+    source = source_path(sas_dir, filename)
+
+    if source.suffix == '.parquet':
+        return read_parquet_cols(source, columns, predicates)
+
+    # take fingerprint of source before decoding, so copy is never fingerprinted against a file changed after it was read
+
+    entry = source_entry(sas_dir, filename)
+
+    df = pd.read_sas(source, encoding = encoding)
+
+    try:
+        convert_to_columnar(sas_dir = sas_dir, filename = filename, df = df, entry = entry)
+    except OSError as err:
+        log.warning(f"Columnar copy of {filename} not written, reading SAS dataset: {err!r}")
+
+    if predicates:
+        df = df.loc[predicate_mask(df, predicates)].reset_index(drop=True)
+
+    if columns is not None:
+        df = df[[col for col in df.columns if col in columns]]
+
+    return df
+
+def iter_dataset_chunks(*, sas_dir, filename, chunksize, columns=None, predicates=(), encoding='ISO-8859-1'):
+    """
+    Function iter_dataset_chunks to read SAS dataset in chunks (from columnar copy if valid), without caching.
+    Reads are projected to the given columns plus all columns registered for the dataset (all columns if neither is given)
+    If predicates are given, only rows meeting all predicates are kept, filtering each chunk before conversion to a df if read from columnar copy
+
+    params:
+        sas_dir Path: directory with SAS datasets
+        filename str: name of SAS dataset (without extension, including _op suffix if applicable)
+        chunksize int: max number of rows per chunk
+        columns list: optional list of columns needed by caller, default is None
+        predicates list: optional list of Predicates rows must meet, default is none (all rows)
+        encoding str: encoding to pass to read_sas, default is ISO-8859-1
+
+    yields:
+        df with up to chunksize rows (fewer if filtered by predicates)
+
+    """
+
+    wanted = set(columns or []) | _PROJECTIONS.get(sud_name(filename), set())
+
+    if wanted:
+        wanted |= {predicate.col for predicate in predicates}
+
+    source = source_path(sas_dir, filename)
+
+    if columnar_current(sas_dir, filename, read_manifest(sas_dir)) or (source.suffix == '.parquet'):
+
+        parquet_file = pq.ParquetFile(source if source.suffix == '.parquet' else sas_dir / COLUMNAR_DIR / f"{filename}.parquet")
+
+        read_cols = [col for col in parquet_file.schema_arrow.names if col in wanted] if wanted else None
+
+        for batch in parquet_file.iter_batches(batch_size = chunksize, columns = read_cols):
+
+            if predicates:
+
+                mask = predicates[0].arrow_mask(batch)
+
+                for predicate in predicates[1:]:
+                    mask = pc.and_(mask, predicate.arrow_mask(batch))
+
+                batch = batch.filter(mask)
+
+            yield batch.to_pandas()
+
+    else:
+
+        reader = pd.read_sas(sas_dir / f"{filename}.sas7bdat", encoding = encoding, chunksize = chunksize)
+
+        for chunk in reader:
+
+            if predicates:
+                chunk = chunk.loc[predicate_mask(chunk, predicates)]
+
+            yield chunk[[col for col in chunk.columns if col in wanted]] if wanted else chunk
+
+        reader.close()
+
+def add_group_sums(sums, df, by, sum_cols):
+    """
+    Function add_group_sums to add sums of sum_cols by the by cols in df to running sums from prior chunks
+
+    params:
+        sums df: running sums indexed by the by cols (None for first chunk)
+        df df: chunk to add
+        by list: list of cols to group by
+        sum_cols list: list of cols to sum
+
+    returns:
+        df: running sums indexed by the by cols (one row per group seen so far)
+
+    """
+
+    chunk_sums = df.groupby(by)[sum_cols].sum()
+
+    return chunk_sums if sums is None else sums.add(chunk_sums, fill_value=0)
+
+@timed_stage('read')
+def read_chunked_sums(*, sas_dir, filename, chunksize, by, sum_cols, recs_col=None, filters=[], predicates=(), encoding='ISO-8859-1'):
+    """
+    Function read_chunked_sums to stream dataset in chunks, drop rows not meeting every filter and sum sum_cols by the by cols
+    (with the number of recs summed in each group if recs_col is given). Memory is bounded by chunksize and number of groups rather than size of file
+
+    params:
+        sas_dir Path: directory with SAS datasets
+        filename str: name of SAS dataset (without extension, including _op suffix if applicable)
+        chunksize int: max number of rows per chunk
+        by list: list of cols to group by (any cols not on the dataset are ignored)
+        sum_cols list: list of cols to sum
+        recs_col str: optional name of col to add with number of recs in each group, default is None (recs not counted)
+        filters list: list of functions to apply to each chunk, each returning boolean mask of rows to keep, default is none
+        predicates list: list of Predicates rows must meet, pushed down into chunked read (see iter_dataset_chunks), default is none
+        encoding str: encoding to pass to read_sas, default is ISO-8859-1
+
+    returns:
+        df: one row per group with by cols, summed sum_cols and recs_col if given
+
+    """
+
+    sums = None
+
+    for chunk in iter_dataset_chunks(sas_dir = sas_dir, filename = filename, chunksize = chunksize, columns = by + sum_cols, predicates = predicates, encoding = encoding):
+
+        for row_filter in filters:
+            chunk = chunk.loc[row_filter(chunk)]
+
+        if recs_col is not None:
+            chunk = chunk.assign(**{recs_col : 1})
+
+        sums = add_group_sums(sums, chunk, [col for col in by if col in chunk.columns], sum_cols + ([recs_col] if recs_col is not None else []))
+
+    return sums.reset_index()
+
+@timed_stage('read')
+def read_sas_cached(*, sas_dir, filename, year, columns=None, predicates=(), encoding='ISO-8859-1'):
+    """
+    Function read_sas_cached to read SAS dataset (from columnar copy if valid), decoding each file only once per run
+    Cache is keyed by resolved path, _op suffix, year and file modified time, so a file replaced mid-run will be decoded again
+
+    Reads are projected to the given columns plus all columns registered for the dataset with register_columns
+    (all columns are read if neither is given). A cached df is reused if it was read with all requested columns, otherwise
+    the dataset is read again with the union of cached and requested columns.
+    Reads with predicates are cached separately for each set of predicates, and only hold rows meeting all predicates
+
+    params:
+        sas_dir Path: directory with SAS datasets
+        filename str: name of SAS dataset (without extension, including _op suffix if applicable)
+        year str: TAF year of dataset
+        columns list: optional list of columns needed by caller, default is None
+        predicates list: optional list of Predicates rows must meet (pushed down into read, see read_dataset), default is none (all rows)
+        encoding str: encoding to pass to read_sas, default is ISO-8859-1
+
+    returns:
+        df: copy of cached df (callers are free to modify), may contain more than the requested columns
+
+    """
+
+    path = source_path(sas_dir, filename).resolve()
+
+    key = (str(path), filename.endswith('_op'), str(year), os.path.getmtime(path), tuple(predicates))
+
+    wanted = set(columns or []) | _PROJECTIONS.get(sud_name(filename), set())
+
+    if wanted:
+        wanted |= {predicate.col for predicate in predicates}
+
+    cached_cols, df = _DATASETS.get(key, (set(), None))
+
+    if df is not None and (cached_cols is None or (wanted and wanted <= cached_cols)):
+        CACHE_STATS['hits'] += 1
+
+    else:
+        CACHE_STATS['misses'] += 1
+
+        read_cols = (wanted | cached_cols) if (wanted and cached_cols is not None) else None
+
+        df = read_dataset(sas_dir = sas_dir, filename = filename, columns = read_cols, predicates = predicates, encoding = encoding)
+        _DATASETS[key] = (read_cols, df)
+
+    return df.copy()
+
+def clear_cache():
+    """
+    Function clear_cache to drop all cached datasets and reset hit/miss counters
+
+    """
+
+    _DATASETS.clear()
+    CACHE_STATS.update({'hits' : 0, 'misses' : 0})
@@ -0,0 +1,131 @@
+"""
+store of prepped dfs (with status dfs) written by each run, so tables already built for a databook year can be loaded by later runs
+(e.g. the prior year tables for comparisons) instead of being rebuilt from the SAS datasets
+"""
+
+import os
+import json
+import hashlib
+import pandas as pd
+from pathlib import Path
+from functools import lru_cache
+
+from .read_data import dataset_fingerprint
+
+# increment if the format of stored results changes, so results stored by older code are not used
+# (changes to the code that preps tables are picked up by code_hash)
+
+STORE_VERSION = 1
+
+# packages with all code that reads, preps and writes tables (hashed by code_hash)
+
+CODE_DIRS = [Path(__file__).parents[1], Path(__file__).parents[2] / 'common' / 'utils']
+
+@lru_cache(maxsize=None)
+def code_hash():
+    """
+    Function code_hash to return sha256 hex digest of the source of every module in CODE_DIRS (paths and contents),
+    so stored results and table fingerprints (see table_fingerprints) from any other version of the code are never used
+
+    raises error if:
+        no modules are found (e.g. run from a build without sources), as code versions could not be told apart
+
+    """
+
+    sha = hashlib.sha256()
+
+    modules = sorted((path.relative_to(code_dir.parent).as_posix(), path) for code_dir in CODE_DIRS for path in code_dir.rglob('*.py'))
+
+    if not modules:
+        raise RuntimeError(f"ERROR: No source modules found in {', '.join(str(code_dir) for code_dir in CODE_DIRS)} to fingerprint code version - FIX")
+
+    for name, path in modules:
+        sha.update(name.encode())
+        sha.update(hashlib.sha256(path.read_bytes()).digest())
+
+    return sha.hexdigest()
+
+def config_hash(config):
+    """
+    Function config_hash to return sha256 hex digest of config entry for table
+
+    """
+
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+def store_key(*, year, table, table_type, dq_states, config, sas_dir, datasets):
+    """
+    Function store_key to create key of stored prepped df for given table
+
+    params:
+        year str/int: TAF year of table
+        table str: name of table (key in TABLE_MAPPINGS)
+        table_type str: SUD or OUD
+        dq_states list: list of states excluded for DQ reasons
+        config dict: config entry for table (including any use_sud_ds)
+        sas_dir Path: directory with SAS datasets for year
+        datasets list: names of all SAS datasets read for table (with _op suffix if applicable)
+
+    returns:
+        dict of key values, including a fingerprint of each input dataset
+
+    """
+
+    return {'version' : STORE_VERSION, 'code' : code_hash(), 'year' : str(year), 'table' : table, 'table_type' : table_type, 'dq_states' : sorted(dq_states),
+            'config' : config_hash(config), 'inputs' : {filename : dataset_fingerprint(sas_dir, filename) for filename in sorted(set(datasets))}}
+
+def store_paths(store_dir, key):
+    """
+    Function store_paths to return paths of prepped df, status df and key files for given key
+
+    """
+
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    return {'prepped_df' : store_dir / f"{digest}.parquet", 'prepped_status' : store_dir / f"{digest}.status.parquet", 'key' : store_dir / f"{digest}.json"}
+
+def load_prepped(store_dir, key):
+    """
+    Function load_prepped to read stored prepped df and status df for given key
+
+    returns:
+        tuple of prepped df and status df, or None if no results stored for key
+
+    """
+
+    paths = store_paths(store_dir, key)
+
+    # key file is written last, so results are only read if completely written
+
+    if not paths['key'].exists():
+        return None
+
+    return pd.read_parquet(paths['prepped_df']), pd.read_parquet(paths['prepped_status'])
+
+def save_prepped(store_dir, key, prepped_df, prepped_status):
+    """
+    Function save_prepped to write prepped df and status df for given key (each written to temp file and then moved, with key file written last).
+    If results cannot be written (e.g. read-only directory, or col types that cannot be stored), nothing is stored
+
+    returns:
+        bool: whether results were stored
+
+    """
+
+    paths = store_paths(store_dir, key)
+
+    try:
+        store_dir.mkdir(parents=True, exist_ok=True)
+
+        for name, df in [('prepped_df', prepped_df), ('prepped_status', prepped_status)]:
+            tmp = paths[name].with_suffix(f".{os.getpid()}.tmp")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, paths[name])
+
+        with open(paths['key'], 'w') as f:
+            json.dump(key, f, indent=2, sort_keys=True)
+
+    except (OSError, ValueError, TypeError):
+        return False
+
+    return True
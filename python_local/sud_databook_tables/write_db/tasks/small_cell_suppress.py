@@ -1,8 +1,11 @@
 import pandas as pd
+import numpy as np
+
+from common.utils.timing import timed_stage
 
 def suppress_second_lowest(row, suppress_value):
     """
-    Function suppress_second_lowest to do the following:
+    Function suppress_second_lowest (row-wise version of second_lowest_mask, applied to rendered values) to do the following:
         - Identify if there is exactly ONE value within the row suppressed
         - If yes, also suppress the SECOND lowest that is > 0. If there are ties for second lowest, just suppress the first
 
@@ -14,40 +17,134 @@ def suppress_second_lowest(row, suppress_value):
         input row (series) with second lowest suppressed if appropriate
 
     """
-    
+
     # count the number of values in the series with the suppress value (default to 0)
-    
+
     cnt_suppress = dict(row.value_counts()).get(suppress_value, 0)
 
     # if exactly one suppressed, create a boolean mask to identify numeric values > 0,
     # then identify the lowest value index with the min value in the series and also suppress
-    
+
     if cnt_suppress == 1:
-        
+
         mask = row.apply(lambda x: pd.to_numeric(x, errors='coerce')>0)
-        
+
         row.loc[pd.to_numeric(row[mask]).idxmin()] = suppress_value
-    
+
     return row
 
-def match_suppress(num, denom, suppress_value):
+def second_lowest_mask(values, mask):
+    """
+    Function second_lowest_mask to add second lowest suppression to a suppression mask for all rows at once
+    (same rules as row-wise suppress_second_lowest):
+        - Identify rows with exactly ONE value suppressed
+        - For those rows, also suppress the lowest remaining value that is > 0. If there are ties, just suppress the first
+
+    Rows with exactly one value suppressed but no remaining values > 0 are left as is
+
+    params:
+        values df: numeric values (non-numerics as nan)
+        mask df: boolean mask of values already suppressed, same shape as values
+
+    returns:
+        mask df with second lowest values added
+
+    """
+
+    vals, suppressed = values.to_numpy(dtype=float), mask.to_numpy(copy=True)
+
+    # set all values not eligible (suppressed, nan, <= 0) to inf so argmin returns first position of min eligible value in each row
+
+    eligible = ~suppressed & (vals > 0)
+
+    lowest = np.where(eligible, vals, np.inf).argmin(axis=1)
+
+    rows = np.flatnonzero((suppressed.sum(axis=1) == 1) & eligible.any(axis=1))
+
+    suppressed[rows, lowest[rows]] = True
+
+    return pd.DataFrame(suppressed, index=mask.index, columns=mask.columns)
+
+@timed_stage('suppress')
+def suppression_mask(df, *args, suppress_value='DS', min_max=(0,11), suppress_second = False, match_numer = False, include_cols = []):
+    """
+    Function suppression_mask to identify all cells to suppress in given columns, without changing df (see small_cell_suppress for params).
+    Values already equal to suppress_value are included in the mask
+
+    params:
+        include_cols list: optional list of additional cols to return in values and mask without suppressing by range
+            (only values already equal to suppress_value are flagged), default is none
+
+    returns:
+        tuple of numeric values df (non-numerics set to nan) and boolean mask df of cells to suppress, each with one col per unique col in args and include_cols
+
+    """
+
+    cols = list(dict.fromkeys(col for suppress_cols in list(args) + [include_cols] for col in suppress_cols))
+    range_cols = list(dict.fromkeys(col for suppress_cols in args for col in suppress_cols))
+
+    values = df[cols].apply(pd.to_numeric, errors='coerce')
+
+    mask = (df[cols] == suppress_value)
+    mask[range_cols] = mask[range_cols] | ((values[range_cols] > min_max[0]) & (values[range_cols] < min_max[1]))
+
+    # if match_numer, must suppress number if denom is suppressed BEFORE suppressing second lowest (if requested)
+
+    if match_numer:
+
+        mask = match_numer_mask(mask, numerators = args[0], denominators = args[1])
+
+    # if suppressing second, must suppress denoms first, match numer again, and THEN suppress second for numerator
+
+    if suppress_second:
+
+        mask[args[1]] = second_lowest_mask(values[args[1]], mask[args[1]])
+
+        mask = match_numer_mask(mask, numerators = args[0], denominators = args[1])
+
+        mask[args[0]] = second_lowest_mask(values[args[0]], mask[args[0]])
+
+    return values, mask
+
+def match_numer_mask(mask, numerators, denominators):
+    """
+    Function match_numer_mask to flag numerator as suppressed wherever denominator in the same position is suppressed
+
+    params:
+        mask df: boolean mask of suppressed values with numerator and denominator cols
+        numerators list: list of numerator cols
+        denominators list: list of denominator cols
+
+    returns:
+        mask df
+
+    """
+
+    pairs = list(zip(numerators, denominators))
+
+    mask[[pair[0] for pair in pairs]] = mask[[pair[0] for pair in pairs]].to_numpy() | mask[[pair[1] for pair in pairs]].to_numpy()
+
+    return mask
+
+def apply_suppression(df, mask, suppress_value='DS'):
     """
-    Function match_suppress to be applied row wise to num and denom and return suppress_value if denom = suppress_value
+    Function apply_suppression to set all cells flagged in mask to suppress_value (only cols with any suppressed value are changed)
+
     params:
-        num/denom to come from row passed as series
-        suppress_value str: value indicating suppression
+        df df: df to write to
+        mask df: boolean mask with one col per col to suppress
+        suppress_value [str, int, float] value to use if suppressing, default = 'DS'
 
     returns:
-        suppress_value or original num value
+        df
 
     """
 
-    if denom == suppress_value:
-        return suppress_value
+    for col in mask.columns[mask.any()]:
 
-    else:
-        return num
+        df[col] = df[col].astype(object).mask(mask[col], suppress_value)
 
+    return df
 
 def suppress_match_numer(*, df, numerators, denominators, suppress_value='DS'):
     """
@@ -63,16 +160,16 @@ def suppress_match_numer(*, df, numerators, denominators, suppress_value='DS'):
 
     """
 
-    for pair in zip(numerators, denominators):
-
-        df[pair[0]] = df[list(pair)].apply(lambda x: match_suppress(*x, suppress_value), axis=1)
+    mask = match_numer_mask(df[list(dict.fromkeys(numerators + denominators))] == suppress_value, numerators, denominators)
 
-    return df
+    return apply_suppression(df, mask[numerators], suppress_value=suppress_value)
 
 
+@timed_stage('suppress')
 def small_cell_suppress(df, *args, suppress_value='DS', min_max=(0,11), suppress_second = False, match_numer = False):
     """
     Function small_cell_suppress to set all values of given columns within given range to given suppressed value.
+    Builds a boolean mask of all cells to suppress (see suppression_mask) and only sets suppress_value at the end
 
     params:
         df df: pandas df
@@ -80,33 +177,13 @@ def small_cell_suppress(df, *args, suppress_value='DS', min_max=(0,11), suppress
         suppress_value [str, int, float] value to use if suppressing, default = 'DS'
         min_max tuple: tuple with range of min/max values to identify for suppression, will identify EXCLUSIVE of range, default = (0,11)
         suppress_second bool: boolean to indicate must suppress SECOND lowest value if only one value within row suppressed, default = False (do not suppress second lowest)
-        match_numer bool:
+        match_numer bool: boolean to indicate numerator must be suppressed if denominator in same position is suppressed, default = False
 
     returns:
         df with suppression applied
 
     """
 
-    # loop through all suppress col lists to suppress each col individually
-
-    for suppress_cols in args:
-
-        df[suppress_cols] = df[suppress_cols].applymap(lambda x: suppress_value if (x > min_max[0]) & (x < min_max[1]) else x)
-
-    # if match_numer, must suppress number if denom is suppressed BEFORE suppressing second lowest (if requested)
-
-    if match_numer:
-
-        df = suppress_match_numer(df = df, numerators = args[0], denominators = args[1])
-
-    # if suppressing second, must suppress denoms first, match numer again, and THEN suppress second for numerator
-
-    if suppress_second:
-
-        df[args[1]] = df[args[1]].apply(suppress_second_lowest, suppress_value=suppress_value, axis=1)
-
-        df = suppress_match_numer(df = df, numerators = args[0], denominators = args[1])
-
-        df[args[0]] = df[args[0]].apply(suppress_second_lowest, suppress_value=suppress_value, axis=1)
+    values, mask = suppression_mask(df, *args, suppress_value=suppress_value, min_max=min_max, suppress_second=suppress_second, match_numer=match_numer)
 
-    return df
\ No newline at end of file
+    return apply_suppression(df, mask, suppress_value=suppress_value)
@@ -0,0 +1,124 @@
+"""
+cache of parsed templates (shells): each shell is parsed once and pickled with an index of the state col of every sheet,
+keyed by the hash of the shell file, so later runs unpickle the workbook instead of parsing the xlsx again
+"""
+
+import os
+import pickle
+import hashlib
+import openpyxl as xl
+
+from .read_data import file_hash
+from .write_excel import TemplateIndex
+
+# increment if changes to TemplateIndex would change cached indexes, so entries from older code are not used
+
+TEMPLATE_CACHE_VERSION = 2
+
+def index_template(workbook, col = 'A'):
+    """
+    Function index_template to create TemplateIndex of all sheets in loaded template, with hash of the cell values of each sheet,
+    read from the cells already in each sheet (iterating rows or cols of a sheet adds its empty cells, which would then be written)
+
+    params:
+        workbook excel obj: template to index
+        col str: col to index, default is A (first col)
+
+    returns:
+        TemplateIndex
+
+    """
+
+    col_idx = xl.utils.column_index_from_string(col)
+
+    cells, hashes = {}, {}
+
+    for sheet in workbook.worksheets:
+
+        sha = hashlib.sha256()
+        cells[sheet.title] = []
+
+        for (row_num, col_num), cell in sorted(sheet._cells.items()):
+
+            if cell.value is None:
+                continue
+
+            sha.update(repr((row_num, col_num, cell.value)).encode())
+
+            if (col_num == col_idx) and cell.value:
+                cells[sheet.title].append((cell.value, row_num))
+
+        hashes[sheet.title] = sha.hexdigest()
+
+    return TemplateIndex(workbook, workbook.sheetnames, col = col, cells = cells, hashes = hashes)
+
+def read_entry(cache_path):
+    """
+    Function read_entry to return cached entry, or None if the entry is corrupt or was not written by the same cache and openpyxl versions
+    (entries are the sha256 digest of the pickled entry followed by the pickled entry, and are only unpickled if the digest matches)
+
+    params:
+        cache_path Path: path to cached entry
+
+    returns:
+        dict of version, workbook and index, or None
+
+    """
+
+    with open(cache_path, 'rb') as f:
+        digest, data = f.read(32), f.read()
+
+    if hashlib.sha256(data).digest() != digest:
+        return None
+
+    entry = pickle.loads(data)
+
+    return entry if entry['version'] == (TEMPLATE_CACHE_VERSION, xl.__version__) else None
+
+def load_template(path, cache_dir=None):
+    """
+    Function load_template to return template workbook and TemplateIndex of template, from cache if template was cached
+    (cache entries are keyed by hash of template file, so any change to the template creates a new entry)
+
+    params:
+        path Path: path to template (xlsx)
+        cache_dir Path: optional per user directory of cached templates (see TEMPLATE_CACHEDIR), default is None (parse template without cache)
+
+    returns:
+        tuple of workbook and TemplateIndex
+
+    """
+
+    if cache_dir is None:
+        workbook = xl.load_workbook(path)
+        return workbook, index_template(workbook)
+
+    cache_path = cache_dir / f"{file_hash(path)}.pkl"
+
+    # use cached entry only if intact and written by the same cache and openpyxl versions (otherwise rebuild below)
+
+    if cache_path.exists():
+
+        entry = read_entry(cache_path)
+
+        if entry is not None:
+            return entry['workbook'], entry['index']
+
+    workbook = xl.load_workbook(path)
+    index = index_template(workbook)
+
+    # write entry before the workbook is written to, to temp file and then move so a partial entry is never read
+    # (cache dir is only readable and writable by the user, as entries are unpickled)
+
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    data = pickle.dumps({'version' : (TEMPLATE_CACHE_VERSION, xl.__version__), 'workbook' : workbook, 'index' : index}, protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+
+    with open(tmp, 'wb') as f:
+        f.write(hashlib.sha256(data).digest() + data)
+
+    os.replace(tmp, cache_path)
+
+    return workbook, index
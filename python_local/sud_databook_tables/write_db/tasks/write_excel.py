@@ -1,6 +1,80 @@
 import pandas as pd
 import openpyxl as xl
 
+from common.utils.cell_status import render_status
+from common.utils.timing import timed_stage, add_metrics
+
+class TemplateIndex():
+    """
+    TemplateIndex to hold the parts of a template workbook read to prep tables: all sheet names, and the value and row of each non-empty cell
+    in the state column of given sheets. Can be passed in place of the workbook to prep tables without the workbook object (e.g. in worker processes)
+
+    Only the given sheets are indexed (reading a column adds its empty cells to the sheet, so only read sheets that will be written),
+    unless cells are given (e.g. read from the cells already in each sheet, see index_template)
+
+    Sheet name matched to each sheet number and state rows of each sheet (with chars stripped) are kept once found, so repeat lookups
+    are O(1)
+
+    Must initialize with:
+        workbook excel obj: template to index
+        sheet_names list: list of sheets to index
+        col str: col to index, default is A (first col)
+        cells dict: optional list of (value, row) of non-empty cells in col for each sheet, default is None (read from workbook)
+        hashes dict: optional hash of each sheet (see template_cache), default is None (empty dict)
+
+    """
+
+    def __init__(self, workbook, sheet_names, col = 'A', cells = None, hashes = None):
+
+        self.sheetnames = list(workbook.sheetnames)
+        self.col = col
+        self.cells = cells if cells is not None else {name : [(cell.value, cell.row) for cell in workbook[name][col] if cell.value] for name in sheet_names}
+        self.hashes = hashes if hashes is not None else {}
+
+        self.sheet_names, self.state_rows = {}, {}
+
+    def sheet_name(self, sheet_num):
+        """
+        Method sheet_name to return sheet name starting with given sheet number
+
+        raises error if:
+            0 or >1 sheets match given sheet number
+
+        """
+
+        if sheet_num not in self.sheet_names:
+
+            match = [name for name in self.sheetnames if name.startswith(sheet_num)]
+
+            assert len(match)==1, f"ERROR: {len(match)} sheet names start with given sheet number ({sheet_num}), requires exactly 1 - FIX"
+
+            self.sheet_names[sheet_num] = match[0]
+
+        return self.sheet_names[sheet_num]
+
+    def states(self, sheet_name, strip_chars=[]):
+        """
+        Method states to return list of (value, row) of each non-empty cell in sheet with all chars in strip_chars removed from values
+
+        """
+
+        key = (sheet_name, tuple(strip_chars))
+
+        if key not in self.state_rows:
+            self.state_rows[key] = strip_cells(self.cells[sheet_name], strip_chars)
+
+        return self.state_rows[key]
+
+def strip_cells(cells, strip_chars=[]):
+    """
+    Function strip_cells to remove all chars in strip_chars from values of list of (value, row)
+
+    """
+
+    table = str.maketrans('', '', ''.join(strip_chars))
+
+    return [(str(value).translate(table), row) for value, row in cells]
+
 def read_template_col(*, workbook, sheet_name, state_list, col = 'A', state_col_name = 'state', strip_chars=[]):
     """
     Function read_template_col to read the first (default) column of the given template to
@@ -8,7 +82,7 @@ def read_template_col(*, workbook, sheet_name, state_list, col = 'A', state_col_
     (this allows for possible row breaks in template)
     
     params:
-        workbook excel obj: workbook to read from
+        workbook excel obj/TemplateIndex: workbook to read from, or TemplateIndex of workbook
         sheet_name str: sheet to read
         state_list list: list of states to validate against
         col str: col to read, default is A (first col)
@@ -20,69 +94,124 @@ def read_template_col(*, workbook, sheet_name, state_list, col = 'A', state_col_
         df: df with list of states in order of template with state and rownum columns
     
     """
-    
-    workbook.active = workbook.sheetnames.index(sheet_name)
-    sheet = workbook.active
-    
+
     # add tuple for cell value and row to extracted list, remove all chars in strip_chars
-    
-    extracted = []
-    for cell in sheet[col]:
-        if cell.value:
-            value = ''.join((filter(lambda x: x not in strip_chars, list(cell.value))))
-            extracted.append((value, cell.row))
-        
+
+    if isinstance(workbook, TemplateIndex):
+
+        assert col == workbook.col, f"ERROR: Col {col} requested from template index of col {workbook.col} - FIX"
+
+        extracted = workbook.states(sheet_name, strip_chars)
+
+    else:
+
+        workbook.active = workbook.sheetnames.index(sheet_name)
+        extracted = strip_cells([(cell.value, cell.row) for cell in workbook.active[col] if cell.value], strip_chars)
+
     # create df with state value and row number
-    
-    state_order = pd.DataFrame([value for value in extracted if value[0] in state_list],
+
+    states = set(state_list)
+
+    state_order = pd.DataFrame([value for value in extracted if value[0] in states],
                                 columns = [state_col_name , 'rownum' ])
     
     return state_order
 
+# shared style objects assigned to all written cells (one alignment, one number format per class of column), so styles are
+# not rebuilt or re-derived per cell. Only alignment and number format are set so template borders/fonts are kept
+
+CENTER = xl.styles.Alignment(horizontal='center')
+
+NUMBER_FORMATS = {'pval' : '0.000', 'pctdiff' : '###,##0.00', 'stat_diff' : '###,##0.00', 'stat' : '###,##0.0', 'integer' : '###,##0'}
+
+def format_class(col_name):
+    """
+    Function format_class to return class of number format to apply to given column:
+        pval, pctdiff (ends in _pctdiff), stat_diff (ends in _stat_diff), stat (contains _stat), otherwise integer
+
+    """
+
+    if col_name == 'pval':
+        return 'pval'
+
+    elif col_name.endswith('_pctdiff'):
+        return 'pctdiff'
+
+    elif col_name.endswith('_stat_diff'):
+        return 'stat_diff'
+
+    elif '_stat' in col_name:
+        return 'stat'
+
+    return 'integer'
+
 def write_cell(row_col, col_value, sheet, column, col_name):
     """
-    Function write_cell to be applied row-wise to input df to write value to excel cell
+    Function write_cell to write single value to excel cell
     params:
-        row_col str: name of df column that contains row # to write to
-        col_value df value: value in df column to write to sheet
+        row_col str: row # to write to
+        col_value df value: value to write to sheet
         sheet str: name of sheet
         column int: excel column # to write to
         col_name str: name of column writing to sheet
 
-    If col_name ends in _stat, will apply comma with 1 decimal format, otherwise comma with 0 decimals
+    Number format is set based on class of column name (see format_class)
 
     returns:
         none
 
     """
 
-    cellref = sheet.cell(row=row_col, column=column)
-    cellref.value = col_value
-    cellref.alignment = xl.styles.Alignment(horizontal='center')
+    apply_plan(sheet, [(row_col, column, col_value, format_class(col_name))])
 
-    if col_name == 'pval':
-        cellref.number_format = '0.000'
-        
-    elif col_name.endswith('_pctdiff'):
-        cellref.number_format = '###,##0.00'
+def sheet_plan(*, df, cols, scol, row_col):
+    """
+    Function sheet_plan to create list of all cells to write for given df, with one (row, column, value, format class) tuple per cell
 
-    elif col_name.endswith('_stat_diff'):
-        cellref.number_format = '###,##0.00'
+    params:
+        df df: dataframe to write (values as written, status strings already rendered)
+        cols list: list of columns to write, written to consecutive excel columns
+        scol int: starting col
+        row_col str: name of df column with row number to write each rec to
 
-    elif '_stat' in col_name:
-        cellref.number_format = '###,##0.0'
+    returns:
+        list of tuples
 
-    else:
-        cellref.number_format = '###,##0'
+    """
+
+    rows = df[row_col].astype(int).tolist()
+
+    return [(row, column, value, format_class(col_name))
+            for column, col_name in enumerate(cols, start=scol)
+            for row, value in zip(rows, df[col_name].tolist())]
+
+def apply_plan(sheet, plan):
+    """
+    Function apply_plan to write all cells in plan (see sheet_plan) to sheet, with shared alignment and number format for each format class
+
+    params:
+        sheet obj: worksheet to write to
+        plan list: list of (row, column, value, format class) tuples
+
+    returns:
+        none
 
-def write_sheet(*, workbook, df, sheet_name, cols, scol, srow=None, row_col=None):
     """
-        function write_text to write data to Excel sheet by cell
+
+    for row, column, value, fmt in plan:
+
+        cellref = sheet.cell(row=row, column=column)
+        cellref.value = value
+        cellref.alignment = CENTER
+        cellref.number_format = NUMBER_FORMATS[fmt]
+
+@timed_stage('write')
+def prepare_sheet(*, df, cols, scol, srow=None, row_col=None, status=None):
+    """
+        function prepare_sheet to create the full list of cells to write to Excel sheet (see sheet_plan), without writing
         
         params:
-            workbook obj: open workbook object
             df df: dataframe to write
-            sheet_name str: sheet name
             cols list: list of columns to write
             scol int: starting col
             srow int: optional starting row, if given will write sequentially at starting row, otherwise will use row_col given below
@@ -90,27 +219,62 @@ def write_sheet(*, workbook, df, sheet_name, cols, scol, srow=None, row_col=None
             row_col str: optional value if specifying specific row numbers based on column with numbers in passed df 
                 if not given, will write to each row in order beginning with srow
                 if given, will use row number in that df col to determine where to write in excel sheet
+            status df: optional df with status of each cell in df (same index, must include all cols), if given
+                the status string (e.g. DS for suppressed) is written for every cell that does not have a value
         
         returns:
-            None (writes to worksheet)
+            list of (row, column, value, format class) tuples
     
     """
-    
-    workbook.active = workbook.sheetnames.index(sheet_name)
-    sheet = workbook.active
 
-    # if srow is given, must create temp row_num col to pass to write_cell to determine row to write to
+    # if status is given, set status strings for all cells to write (only place status strings are set, all prior processing is on numeric values)
+
+    if status is not None:
+        df = df.copy()
+        df[cols] = render_status(df[cols], status[cols])
+
+    # if srow is given, must create temp row_num col to determine row to write to
 
     if srow:
         row_col = 'row_num'
         df = df.copy().reset_index(drop=True)
         df[row_col] = df.index + srow
 
-    # loop over all cols to write to table
+    return sheet_plan(df = df, cols = cols, scol = scol, row_col = row_col)
+
+@timed_stage('write')
+def write_plan(*, workbook, sheet_name, plan):
+    """
+        function write_plan to write list of cells (see sheet_plan) to Excel sheet, setting sheet as active sheet
+        
+        params:
+            workbook obj: open workbook object
+            sheet_name str: sheet name
+            plan list: list of (row, column, value, format class) tuples
+        
+        returns:
+            None (writes to worksheet)
     
-    column=scol
-    for col_name in cols:
+    """
+
+    workbook.active = workbook.sheetnames.index(sheet_name)
+
+    apply_plan(workbook.active, plan)
+
+    add_metrics(cells = len(plan))
+
+def write_sheet(*, workbook, df, sheet_name, cols, scol, srow=None, row_col=None, status=None):
+    """
+        function write_text to write data to Excel sheet, creating the full list of cells to write (see prepare_sheet) and then writing all at once
+        
+        params:
+            workbook obj: open workbook object
+            sheet_name str: sheet name
+            see prepare_sheet for all other params
         
-        df[[row_col, col_name]].apply(lambda x: write_cell(*x, sheet = sheet, column = column, col_name = col_name), axis=1)
+        returns:
+            None (writes to worksheet)
+    
+    """
 
-        column += 1
\ No newline at end of file
+    write_plan(workbook = workbook, sheet_name = sheet_name, plan = prepare_sheet(df = df, cols = cols, scol = scol, srow = srow, row_col = row_col, status = status))
@@ -0,0 +1,77 @@
+"""
+tests of compare_versions: the stream engine (rows compared as streamed, see stream_tables) must write the same log as the pandas engine
+(sheet dfs compared, see comp_tables) for the same workbook pair
+"""
+
+import openpyxl as xl
+import pytest
+
+from compare_versions.compare_versions import comp_sheet
+
+# rows of each sheet of base and comparison workbooks after the title and header rows: NA strings, periods and blanks on either side
+# are all missing values, DS cells with trailing spaces and numbers equal when rounded are equal, all other cells differ
+
+SHEETS = {
+    'A.1. Table A.1.' : ([('United States', 1200, 0.4567, 'DS ', 'NA'),
+                          ('Alabama*', 'N/A', 12.0, 'DS', '#N/A'),
+                          ('Alaska', 'NULL', 'nan', '.', None)],
+                         [('United States', 1200, 0.45671, 'DS', '.'),
+                          ('Alabama', '.', 12, 'DS ', None),
+                          ('Alaska', None, '. ', 'N/A', 'NA')]),
+    'B.1. Table B.1.' : ([('United States', 30, 'NA', 0.5),
+                          ('Alabama', 10, 'DS', 0.25),
+                          ('Alaska', 'NA', 4, 0.125)],
+                         [('United States', 31, '.', 0.5),
+                          ('Alabama', 'DS', 'DS', 0.26),
+                          ('Alaska', 5, 'N/A', 'NA')]),
+}
+
+def write_workbook(path, side):
+    """
+    Function write_workbook to write workbook with the given side (0 base, 1 comparison) of each sheet in SHEETS, after a title row and header row
+
+    """
+
+    workbook = xl.Workbook()
+    workbook.remove(workbook.active)
+
+    for sheetname, sides in SHEETS.items():
+
+        sheet = workbook.create_sheet(sheetname)
+
+        sheet.append([f"Table {sheetname}"])
+        sheet.append(['State'] + [f"Col {i}" for i in range(1, len(sides[side][0]))])
+
+        for row in sides[side]:
+            sheet.append(row)
+
+        sheet.append(['Source: test workbook'])
+
+    workbook.save(path)
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+
+    root = tmp_path_factory.mktemp('compare_versions')
+
+    paths = (root / 'base.xlsx', root / 'comp.xlsx')
+
+    for side, path in enumerate(paths):
+        write_workbook(path, side)
+
+    return paths
+
+@pytest.mark.parametrize('sheetname', list(SHEETS))
+def test_engines_same_log(paths, sheetname):
+
+    stream = comp_sheet(sheetname, *paths, engine = 'stream').messages
+    pandas = comp_sheet(sheetname, *paths, engine = 'pandas').messages
+
+    assert stream == pandas
+
+def test_na_strings_equal(paths):
+
+    # all cells of A.1 are missing or equal on both sides, so both engines find no differences
+
+    for engine in ['stream', 'pandas']:
+        assert comp_sheet('A.1. Table A.1.', *paths, engine = engine).messages[-1] == '--All equal!\n'
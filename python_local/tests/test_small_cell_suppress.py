@@ -0,0 +1,68 @@
+"""
+tests of small_cell_suppress: second_lowest_mask (all rows at once) must suppress the same cells as row-wise suppress_second_lowest
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from write_db.tasks.small_cell_suppress import suppress_second_lowest, second_lowest_mask
+
+def row_wise_mask(values, mask, suppress_value='DS'):
+    """
+    Function row_wise_mask to return mask of cells suppressed by applying suppress_second_lowest to each row of values with masked cells set to suppress_value
+    (rows with exactly one value suppressed but no remaining values > 0 raise in suppress_second_lowest, so are left as is)
+
+    """
+
+    rows = []
+
+    for (_, row), (_, row_mask) in zip(values.iterrows(), mask.iterrows()):
+
+        row = row.astype(object).mask(row_mask, suppress_value)
+
+        try:
+            rows.append(suppress_second_lowest(row.copy(), suppress_value) == suppress_value)
+        except ValueError:
+            rows.append(row_mask)
+
+    return pd.DataFrame(rows, index=mask.index, columns=mask.columns).astype(bool)
+
+def assert_parity(values, mask):
+
+    pd.testing.assert_frame_equal(second_lowest_mask(values, mask), row_wise_mask(values, mask))
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_rows(seed):
+
+    # values drawn with ties, zeros, nan and negatives, and masks from empty to most cells suppressed
+
+    rng = np.random.default_rng(seed)
+
+    nrows, ncols = rng.integers(1, 40), rng.integers(1, 8)
+    columns = [f"c{i}" for i in range(ncols)]
+
+    values = pd.DataFrame(rng.choice([0, 2, 5, 12, 12, 15, 30, 30, np.nan, -1], size=(nrows, ncols)).astype(float), columns=columns)
+    mask = pd.DataFrame(rng.random((nrows, ncols)) < rng.random() * 0.5, columns=columns)
+
+    assert_parity(values, mask)
+
+@pytest.mark.parametrize('row, row_mask, expected', [
+    # ties for second lowest: only the first is suppressed
+    ([3, 12, 12, 40], [True, False, False, False], [True, True, False, False]),
+    # zeros, nan and negatives are never suppressed as second lowest
+    ([3, 0, np.nan, -4, 20], [True, False, False, False, False], [True, False, False, False, True]),
+    # no eligible cells: row left as is
+    ([3, 0, np.nan, -4], [True, False, False, False], [True, False, False, False]),
+    # no or more than one value suppressed: row left as is
+    ([3, 12, 40], [False, False, False], [False, False, False]),
+    ([3, 5, 40], [True, True, False], [True, True, False]),
+])
+def test_cases(row, row_mask, expected):
+
+    values = pd.DataFrame([row], dtype=float)
+    mask = pd.DataFrame([row_mask])
+
+    assert second_lowest_mask(values, mask).iloc[0].tolist() == expected
+
+    assert_parity(values, mask)
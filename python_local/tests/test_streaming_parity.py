@@ -0,0 +1,118 @@
+"""
+tests of streaming mode (chunksize): tables that sum counts per group as datasets are read (TableClassWideTransform and TableClassDuals) must
+write the same values when read in chunks as when read in full, including when groups have more than one rec (counts split over duplicate recs)
+"""
+
+import numpy as np
+import pandas as pd
+import openpyxl as xl
+import pytest
+from pathlib import Path
+
+from common.utils.general_funcs import variable_matcher, variable_constructor, read_config
+from benchmark.fixtures import write_fixtures
+from benchmark.run_benchmark import run_once
+
+YEAR = '2020'
+
+CONFIG_DIR = Path(__file__).parents[1] / 'sud_databook_tables' / 'write_db' / 'config'
+
+STREAMING_CLASSES = ['TableClassWideTransform', 'TableClassDuals']
+
+def read_configs():
+    """
+    Function read_configs to read TABLE_MAPPINGS and G_TABLE_MAPPINGS from config (read for each run, as gen_tables changes config entries)
+
+    """
+
+    config = read_config(config_dir = CONFIG_DIR, variable_match = {'matcher' : variable_matcher, 'constructor' : variable_constructor})
+
+    return config['TABLE_MAPPINGS'], config['G_TABLE_MAPPINGS']
+
+def streaming_sheets(table_details):
+    """
+    Function streaming_sheets to return sheet numbers of all streaming tables, keyed by output file (see run_once)
+
+    """
+
+    tables = [kwargs for kwargs in table_details.values() if kwargs.get('use_class') in STREAMING_CLASSES]
+
+    return {'sud_workbook.xlsx' : [kwargs['sheet_num_sud'] for kwargs in tables if kwargs.get('sheet_num_sud')],
+            'oud_workbook.xlsx' : [kwargs['sheet_num_op'] for kwargs in tables if kwargs.get('sheet_num_op')]}
+
+def split_counts(path, seed=0):
+    """
+    Function split_counts to rewrite dataset with each rec split into one to three recs with the same keys, with count split between them
+    (so groups of main and numerator datasets joined have different numbers of recs), in random order
+
+    """
+
+    df = pd.read_parquet(path)
+
+    rng = np.random.default_rng(seed)
+
+    splits = rng.integers(1, 4, len(df))
+
+    split = df.loc[df.index.repeat(splits)].copy()
+    split['count'] = np.concatenate([np.diff(np.sort(np.r_[0, rng.integers(0, count + 1, n - 1), count])) for count, n in zip(df['count'], splits)])
+
+    split.sample(frac=1, random_state=seed).to_parquet(path, index=False)
+
+def run_values(root, shells, chunksize=None):
+    """
+    Function run_values to run all tables from fixtures and return values of each streaming table sheet, keyed by output file and sheet number
+
+    """
+
+    table_details, g_table_details = read_configs()
+
+    run_once(root = root, year = YEAR, shells = shells, table_details = table_details, g_table_details = g_table_details, chunksize = chunksize)
+
+    values = {}
+
+    for outfile, sheet_nums in streaming_sheets(table_details).items():
+
+        workbook = xl.load_workbook(root / 'out' / outfile)
+
+        for sheet_num in sheet_nums:
+            sheet = workbook[next(name for name in workbook.sheetnames if name.startswith(f"{sheet_num} "))]
+            values[(outfile, sheet_num)] = list(sheet.values)
+
+    return values
+
+@pytest.fixture(scope='module')
+def runs(tmp_path_factory):
+
+    # run on fixtures as written (one rec per group), then with every rec of the datasets read by streaming tables split,
+    # each in full and in chunks smaller than the number of groups
+
+    root = tmp_path_factory.mktemp('fixtures')
+
+    table_details, g_table_details = read_configs()
+
+    shells = write_fixtures(root = root, year = YEAR, table_details = table_details, g_table_details = g_table_details)
+
+    runs = {'one rec per group, full' : run_values(root, shells),
+            'one rec per group, chunks' : run_values(root, shells, chunksize = 40)}
+
+    datasets = {sas_ds for kwargs in table_details.values() if kwargs.get('use_class') in STREAMING_CLASSES
+                for sas_ds in [kwargs['sas_ds']] + kwargs.get('sas_ds_numer', [])}
+
+    for path in (root / 'sas').glob('*/*.parquet'):
+        if path.stem.replace('_op', '') in datasets:
+            split_counts(path)
+
+    runs['split recs, full'] = run_values(root, shells)
+    runs['split recs, chunks'] = run_values(root, shells, chunksize = 40)
+
+    return runs
+
+@pytest.mark.parametrize('recs', ['one rec per group', 'split recs'])
+def test_chunks_match_full(runs, recs):
+
+    full, chunks = runs[f"{recs}, full"], runs[f"{recs}, chunks"]
+
+    assert chunks.keys() == full.keys()
+
+    for sheet, values in full.items():
+        assert chunks[sheet] == values, f"{sheet} differs"